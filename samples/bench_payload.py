@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' script to benchmark payload size and serialization time of module views
+    as json (the jsonify path of the api) and as binary (encode_topology) '''
+
+import os
+import json
+import gzip
+import time
+import argparse
+import tempfile
+import torch
+
+from models import torch_models
+from visunn import build, load_modu, build_topology, module_tag
+from visunn.backend import encode_topology
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+# optional brotli compression (pip install visunn[brotli])
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# models that can't trace cifar-sized inputs
+INPUT_SIZES = {
+    'inception_v3': 299
+}
+
+
+def get_modu(name, logdir):
+    ''' builds (or loads) the topology of a zoo model or a logged file '''
+    if os.path.exists(name):
+        return load_modu(name)
+
+    model = torch_models[name](num_classes=10)
+    model.eval()
+    size = INPUT_SIZES.get(name, 32)
+    inputs = torch.randn(1, 3, size, size)
+    params = [param for param, _ in model.named_parameters()]
+
+    save_path = os.path.join(logdir, name + '.pt')
+    build(model, inputs, params, save_path, processes=1)
+    return load_modu(save_path)
+
+
+def bench(fn, views, rep):
+    ''' times a serializer over all views, returning seconds and bodies '''
+    elapsed = 0.0
+    for _ in range(rep):
+        start = time.perf_counter()
+        bodies = [fn(view) for view in views]
+        elapsed += time.perf_counter() - start
+    return elapsed / rep, bodies
+
+
+def sizes(bodies):
+    ''' sums raw, gzip and brotli sizes of serialized bodies '''
+    raw = sum(len(body) for body in bodies)
+    gz = sum(len(gzip.compress(body, compresslevel=6)) for body in bodies)
+    br = float('nan')
+    if brotli is not None:
+        br = sum(len(brotli.compress(body, quality=5)) for body in bodies)
+    return raw, gz, br
+
+
+def main(args):
+    names = args.names if args.names else list(torch_models)
+
+    print('{:<20} {:>7} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'Model', 'Modules', 'Format', 'Encode', 'Raw', 'Gzip', 'Brotli'))
+    with tempfile.TemporaryDirectory() as logdir:
+        for name in names:
+            modu = get_modu(name, logdir)
+
+            # views are decoded up front, so that only serialization is timed
+            views = []
+            for module in modu.modules:
+                tag = module_tag(modu, module)
+                view = modu.view(tag, args.layout)
+                if view is None:
+                    view = build_topology(modu, tag, layout=args.layout)
+                views.append(view)
+
+            label = os.path.basename(name)
+            for fmt, fn in [
+                ('json', lambda view: json.dumps(view).encode('utf-8')),
+                ('binary', encode_topology)
+            ]:
+                elapsed, bodies = bench(fn, views, args.rep)
+                raw, gz, br = sizes(bodies)
+                print('{:<20} {:>7} {:>7} {:>9.3f}s {:>10} {:>10} {:>10}'
+                      .format(label, len(views), fmt, elapsed, raw, gz, br),
+                      flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--names', type=str, nargs='*', default=None,
+                        help='names of (torchvision) models or paths of '
+                             'logged topologies, defaults to all models')
+    parser.add_argument('-r', '--rep', type=int, default=5,
+                        help='number of trials to average over')
+    parser.add_argument('-l', '--layout', type=str, default='layered',
+                        choices=['layered', 'dot'],
+                        help='layout backend of views')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' script to benchmark throughput and memory of the backend server with
+    pre-forked workers (memory is read from /proc, so linux only) '''
+
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+import http.client
+from multiprocessing import Pool
+
+from visunn import load_modu, module_tag, MODU_EXT
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+
+def get_memory(pid):
+    ''' reads rss, pss and private memory (in kB) of a process '''
+    memory = {}
+    with open('/proc/{}/smaps_rollup'.format(pid), 'r') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            if key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                memory[key] = int(value.split()[0])
+    return memory['Rss'], memory['Pss'], \
+        memory['Private_Clean'] + memory['Private_Dirty']
+
+
+def get_children(pid):
+    ''' retrieves pids of the child processes of a process '''
+    with open('/proc/{}/task/{}/children'.format(pid, pid), 'r') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def get_urls(args):
+    ''' lists the api urls of every module of the benchmarked model '''
+    modu = load_modu(os.path.join(args.logdir, args.name + MODU_EXT))
+    return ['/api/' + module_tag(modu, name) for name in modu.modules]
+
+
+def wait_ready(port, timeout=60.0):
+    ''' waits until the server accepts requests '''
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            conn = http.client.HTTPConnection('localhost', port)
+            conn.request('GET', '/api/root')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except (ConnectionError, http.client.HTTPException):
+            time.sleep(0.2)
+    raise RuntimeError('server did not start in {} s'.format(timeout))
+
+
+def client(payload):
+    ''' requests urls round robin for a duration, returning latencies '''
+    port, urls, offset, duration = payload
+    conn = http.client.HTTPConnection('localhost', port)
+    latencies = []
+    end = time.time() + duration
+    idx = offset
+    while time.time() < end:
+        start = time.perf_counter()
+        conn.request('GET', urls[idx % len(urls)])
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - start)
+        idx += 1
+    conn.close()
+    return latencies
+
+
+def bench(args, workers, urls):
+    ''' serves with a number of workers and loads it with clients '''
+    command = [sys.executable, '-m', 'visunn.main', '-l', args.logdir,
+               '-n', args.name, '-p', str(args.port), '-w', str(workers),
+               '-c', str(args.cache_size)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(args.port)
+
+        with Pool(args.clients) as pool:
+            results = pool.map(client, [
+                (args.port, urls, idx * len(urls) // args.clients,
+                 args.duration) for idx in range(args.clients)])
+        latencies = sorted(lat for result in results for lat in result)
+
+        # memory of the master and its workers, once loaded
+        pids = [server.pid] + get_children(server.pid)
+        memory = [get_memory(pid) for pid in pids]
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait()
+
+    rss, pss, private = [sum(column) for column in zip(*memory)]
+    return {
+        'throughput': len(latencies) / args.duration,
+        'p50': latencies[len(latencies) // 2],
+        'p99': latencies[int(len(latencies) * 0.99)],
+        'rss': rss / 1024,
+        'pss': pss / 1024,
+        'private': private / 1024
+    }
+
+
+def main(args):
+    urls = get_urls(args)
+
+    print('{:<8} {:>10} {:>9} {:>9} {:>10} {:>10} {:>10}'.format(
+        'Workers', 'Req/s', 'p50', 'p99', 'RSS MB', 'PSS MB', 'Priv MB'))
+    for workers in args.workers:
+        stats = bench(args, workers, urls)
+        print('{:<8} {:>10.1f} {:>7.1f}ms {:>7.1f}ms {:>10.1f} {:>10.1f} '
+              '{:>10.1f}'.format(
+                  workers, stats['throughput'], stats['p50'] * 1e3,
+                  stats['p99'] * 1e3, stats['rss'], stats['pss'],
+                  stats['private']), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--logdir', type=str, required=True,
+                        help='folder of logged topology')
+    parser.add_argument('-n', '--name', type=str, default='model',
+                        help='model name of logged topology')
+    parser.add_argument('-w', '--workers', type=int, nargs='*',
+                        default=[1, 2, 4],
+                        help='numbers of server workers to benchmark')
+    parser.add_argument('-c', '--clients', type=int, default=8,
+                        help='number of concurrent client processes')
+    parser.add_argument('-d', '--duration', type=float, default=10.0,
+                        help='seconds to load each server for')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='max number of module responses each worker '
+                             'caches (0 renders every request)')
+    parser.add_argument('-p', '--port', type=int, default=5050,
+                        help='port number to serve on')
+    args = parser.parse_args()
+
+    main(args)
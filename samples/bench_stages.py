@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' script to benchmark time and peak memory of each parsing stage on
+    synthetic graphs and the model zoo (offline, on cpu), and to compare
+    results against a baseline, failing on regressions '''
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+from copy import deepcopy
+import torch
+from torch.utils.tensorboard._pytorch_graph import graph
+from tensorboard.compat.proto.graph_pb2 import GraphDef
+
+from models import torch_models
+from benchmark import get_model_and_inputs
+from visunn import proto_to_dict, process_nodes, process_modules, build_modu
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+# bumped whenever the format of results changes
+RESULTS_VERSION = 1
+
+# stages in pipeline order, named as in builder.STAGES ('trace' runs torch's
+# graph(), so only models have it)
+STAGES = ['trace', 'proto_to_dict', 'process_nodes', 'process_modules',
+          'build_modu']
+
+# ops of synthetic op nodes, cycled through
+SYNTHETIC_OPS = ['aten::_convolution', 'aten::batch_norm', 'aten::relu_',
+                 'aten::add_']
+
+
+def get_synthetic_graphdef(n_nodes, depth=4, fanout=8, prim_density=0.75,
+                           param_density=0.25, skip_density=0.1, seed=0):
+    ''' builds a graphdef shaped like a traced model, with a synthetic module
+        hierarchy
+
+        n_nodes        (int)   : number of nodes (including 'prim' nodes)
+        depth          (int)   : number of nested modules above each op node
+        fanout         (int)   : number of submodules per module
+        prim_density   (float) : fraction of nodes that are 'prim' ops (about
+                                 0.75 in traced zoo models)
+        param_density  (float) : fraction of op nodes that take a weight
+        skip_density   (float) : fraction of op nodes that also take an
+                                 earlier op node (skip connections)
+        seed           (int)   : seed of the random generator
+
+        consecutive op nodes share leaf modules, and every other level is
+        wrapped in a single-child module so that process_modules has trivial
+        modules to collapse
+    '''
+    rng = random.Random(seed)
+    graphdef = GraphDef()
+
+    def _add(name, op, inputs, shape=None):
+        node = graphdef.node.add(name=name, op=op, input=inputs)
+        if shape is not None:
+            dims = node.attr['_output_shapes'].list.shape.add()
+            for size in shape:
+                dims.dim.add(size=size)
+        return name
+
+    shape = (1, 64, 8, 8)
+    prev_name = _add('input/x.1', 'IO Node', [], shape)
+    ops = [prev_name]
+
+    # each op node comes with prims_per_op 'prim' nodes on average
+    prims_per_op = prim_density / max(1.0 - prim_density, 1e-6)
+    n_ops = max(1, int(n_nodes * (1.0 - prim_density)))
+    n_leaves = fanout ** depth
+    idx = 0
+    while len(graphdef.node) < n_nodes - 1:
+        # [1] place op nodes in leaf modules in order, most significant
+        # level first, so that neighboring op nodes share modules
+        # #####################################################################
+        leaf = min(idx * n_leaves // n_ops, n_leaves - 1)
+        modules = ['Net']
+        for level in reversed(range(depth)):
+            modules.append('Block[{}]'.format(leaf // fanout ** level %
+                                              fanout))
+            if level % 2 == 1:
+                modules.append('Wrapper[0]')
+        scope = '/'.join(modules) + '/'
+
+        # [2] add 'prim' inputs: constants, packed in a list if several
+        # #####################################################################
+        inputs = [prev_name]
+        if skip_density > 0 and rng.random() < skip_density:
+            inputs.append(rng.choice(ops[-64:]))
+
+        n_prims = int(prims_per_op) + \
+            (rng.random() < prims_per_op - int(prims_per_op))
+        constants = [_add(scope + str(len(graphdef.node)), 'prim::Constant',
+                          []) for _ in range(max(n_prims - 1, 1))
+                     if n_prims > 0]
+        if n_prims > 1:
+            inputs.append(_add(scope + str(len(graphdef.node)),
+                               'prim::ListConstruct', constants))
+        else:
+            inputs.extend(constants)
+
+        if rng.random() < param_density:
+            inputs.append(_add(scope + 'weight/weight.' + str(idx),
+                               'prim::GetAttr', []))
+
+        # [3] add op node
+        # #####################################################################
+        prev_name = _add(scope + 'input.' + str(idx),
+                         SYNTHETIC_OPS[idx % len(SYNTHETIC_OPS)], inputs,
+                         shape)
+        ops.append(prev_name)
+        idx += 1
+
+    _add('output/output.1', 'IO Node', [prev_name], shape)
+    return graphdef
+
+
+def measure(fn, make_arg, rep):
+    ''' times a stage over fresh arguments, then traces its peak memory
+
+        fn        (callable) : stage, as a function of its argument
+        make_arg  (callable) : function that builds a fresh argument (stages
+                               edit their argument in place)
+        rep       (int)      : number of timed trials
+
+        tracemalloc slows python down, so memory is traced in a separate
+        (untimed) trial, and only counts what the stage itself allocates
+    '''
+    times = []
+    for _ in range(rep):
+        arg = make_arg()
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+
+    arg = make_arg()
+    tracemalloc.start()
+    result = fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'time': sorted(times)[len(times) // 2], 'peak': peak}, result
+
+
+def bench_stages(graphdef, rep, trace=None, params=None):
+    ''' runs every stage on a graphdef, returning per-stage results
+
+        trace   (callable) : function that traces the graphdef (to time the
+                             'trace' stage, if specified)
+        params  (list)     : names of model parameters
+    '''
+    stages = {}
+    if trace is not None:
+        stages['trace'], _ = measure(lambda _: trace(), lambda: None, rep)
+
+    stages['proto_to_dict'], graphdict = measure(
+        proto_to_dict, lambda: graphdef, rep)
+    stages['process_nodes'], graphdict = measure(
+        process_nodes, lambda: deepcopy(graphdict), rep)
+    stages['process_modules'], graphdict = measure(
+        process_modules, lambda: deepcopy(graphdict), rep)
+    stages['build_modu'], _ = measure(
+        lambda g: build_modu(g, params=params, compact=True),
+        lambda: deepcopy(graphdict), rep)
+
+    return {'nodes': len(graphdef.node), 'pruned': len(graphdict),
+            'stages': stages}
+
+
+def print_case(name, case):
+    for stage in STAGES:
+        if stage not in case['stages']:
+            continue
+        result = case['stages'][stage]
+        print('{:<24} {:>8} {:<16} {:>9.4f}s {:>10.2f}'.format(
+            name, case['nodes'], stage, result['time'],
+            result['peak'] / 2 ** 20), flush=True)
+
+
+def compare(baseline, results, threshold, min_time, min_peak):
+    ''' compares results with a baseline, returning the regressions
+
+        threshold  (float) : relative increase of time or peak memory that
+                             counts as a regression
+        min_time   (float) : seconds under which times are too noisy to
+                             compare
+        min_peak   (int)   : bytes under which peaks are not compared
+    '''
+    print('{:<24} {:<16} {:>10} {:>10} {:>8}  {:>10} {:>10} {:>8}'.format(
+        'Case', 'Stage', 'Old time', 'New time', 'Change', 'Old MB',
+        'New MB', 'Change'))
+
+    regressions = []
+    for name, case in results['cases'].items():
+        old_case = baseline['cases'].get(name, None)
+        if old_case is None:
+            continue
+        for stage in STAGES:
+            if stage not in case['stages'] or \
+                    stage not in old_case['stages']:
+                continue
+            old, new = old_case['stages'][stage], case['stages'][stage]
+            time_change = new['time'] / max(old['time'], 1e-9) - 1
+            peak_change = new['peak'] / max(old['peak'], 1) - 1
+
+            flags = []
+            if time_change > threshold and new['time'] >= min_time:
+                flags.append('time')
+            if peak_change > threshold and new['peak'] >= min_peak:
+                flags.append('memory')
+            if len(flags) > 0:
+                regressions.append((name, stage, flags))
+
+            print('{:<24} {:<16} {:>9.4f}s {:>9.4f}s {:>+7.1%}  {:>10.2f} '
+                  '{:>10.2f} {:>+7.1%} {}'.format(
+                      name, stage, old['time'], new['time'], time_change,
+                      old['peak'] / 2 ** 20, new['peak'] / 2 ** 20,
+                      peak_change,
+                      '<- ' + ', '.join(flags) if len(flags) > 0 else ''))
+
+    return regressions
+
+
+def run(args):
+    ''' benchmarks synthetic graphs and zoo models '''
+    names = args.names if args.names is not None else list(torch_models)
+    results = {
+        'version': RESULTS_VERSION,
+        'env': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'rep': args.rep
+        },
+        'cases': {}
+    }
+
+    print('{:<24} {:>8} {:<16} {:>10} {:>10}'.format(
+        'Case', 'Nodes', 'Stage', 'Time', 'Peak MB'))
+
+    # [1] synthetic graphs of increasing size
+    # #########################################################################
+    for n_nodes in args.sizes:
+        graphdef = get_synthetic_graphdef(
+            n_nodes, depth=args.depth, fanout=args.fanout,
+            prim_density=args.prim_density,
+            param_density=args.param_density, seed=args.seed)
+        name = 'synthetic-{}'.format(n_nodes)
+        results['cases'][name] = bench_stages(graphdef, args.rep)
+        print_case(name, results['cases'][name])
+
+    # [2] zoo models with random inputs
+    # #########################################################################
+    for name in names:
+        model, inputs = get_model_and_inputs(name)
+        params = [param for param, _ in model.named_parameters()]
+
+        def trace():
+            with torch.no_grad():
+                return graph(model, inputs)[0]
+
+        results['cases'][name] = bench_stages(trace(), args.rep, trace=trace,
+                                              params=params)
+        print_case(name, results['cases'][name])
+
+    return results
+
+
+def main(args):
+    if args.compare is not None:
+        with open(args.compare[0], 'r') as f:
+            baseline = json.load(f)
+        with open(args.compare[1], 'r') as f:
+            results = json.load(f)
+    else:
+        results = run(args)
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1)
+        if args.baseline is None:
+            return
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    print()
+    regressions = compare(baseline, results, args.threshold, args.min_time,
+                          args.min_peak << 20)
+    if len(regressions) > 0:
+        print('\n{} regressions beyond {:.0%}'.format(
+            len(regressions), args.threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--names', type=str, nargs='*', default=None,
+                        help='names of (torchvision) models, defaults to all '
+                             '(pass -n alone to skip models)')
+    parser.add_argument('-s', '--sizes', type=int, nargs='*',
+                        default=[100, 1000, 10000, 100000],
+                        help='number of nodes of synthetic graphs (pass -s '
+                             'alone to skip them)')
+    parser.add_argument('-r', '--rep', type=int, default=3,
+                        help='number of timed trials (the median is kept)')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='module depth of synthetic graphs')
+    parser.add_argument('--fanout', type=int, default=8,
+                        help='submodules per module of synthetic graphs')
+    parser.add_argument('--prim-density', type=float, default=0.75,
+                        help='fraction of prim nodes of synthetic graphs')
+    parser.add_argument('--param-density', type=float, default=0.25,
+                        help='fraction of op nodes with weights of synthetic '
+                             'graphs')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of synthetic graphs')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='file path to write results to (json)')
+    parser.add_argument('-b', '--baseline', type=str, default=None,
+                        help='file path of results to compare against')
+    parser.add_argument('-c', '--compare', type=str, nargs=2, default=None,
+                        metavar=('BASELINE', 'RESULTS'),
+                        help='compares two result files, without running')
+    parser.add_argument('-t', '--threshold', type=float, default=0.25,
+                        help='relative increase that fails a comparison')
+    parser.add_argument('--min-time', type=float, default=0.01,
+                        help='seconds under which times are not compared')
+    parser.add_argument('--min-peak', type=int, default=1,
+                        help='megabytes under which peaks are not compared')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' script to benchmark the overhead of Visu.update on a training loop '''
+
+import os
+import time
+import argparse
+import tempfile
+import torch
+from torch import nn, optim
+from torch.utils.data import DataLoader, TensorDataset
+
+from models import torch_models
+from visunn import Visu, read_metrics, METRICS_EXT
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+
+def train_steps(model, batches, objective, optimizer, visu=None, step=0):
+    ''' runs the training loop of samples/train.py
+
+        visu  (Visu) : logs every step if specified
+        step  (int)  : iteration of the first step
+
+        returns seconds taken by the loop, and by the calls to visu.update
+    '''
+    model.train()
+    in_update = 0.0
+    start = time.perf_counter()
+    for batch, targets in batches:
+        model.zero_grad()
+        optimizer.zero_grad()
+
+        logits = model(batch)
+        loss = objective(logits, targets)
+
+        loss.backward()
+        optimizer.step()
+
+        if visu is not None:
+            update_start = time.perf_counter()
+            visu.update(step, optimizer, loss)
+            in_update += time.perf_counter() - update_start
+        step += 1
+
+    # wait for queued kernels, so that both loops are timed to completion
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return time.perf_counter() - start, in_update
+
+
+def main(args):
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    torch.manual_seed(0)
+
+    model = torch_models[args.name](num_classes=10).to(device)
+    objective = nn.CrossEntropyLoss(reduction='sum')
+    optimizer = optim.Adam(model.parameters(), lr=1e-3)
+
+    # random cifar-10 sized batches, so no download is needed
+    batches = [
+        (torch.randn(args.batch_size, 3, 32, 32, device=device),
+         torch.randint(10, (args.batch_size,), device=device))
+        for _ in range(args.steps)
+    ]
+
+    logdir = tempfile.mkdtemp()
+    dataloader = DataLoader(
+        TensorDataset(batches[0][0].cpu(), batches[0][1].cpu()),
+        batch_size=args.batch_size
+    )
+    visu = Visu(model, dataloader, logdir=logdir, name=args.name,
+                precompute=False, background=False)
+
+    # warm up allocator and kernels
+    train_steps(model, batches, objective, optimizer)
+
+    # [1] alternate plain and logged loops so that drift affects both
+    # #########################################################################
+    plain, logged, in_update = [], [], []
+    for trial in range(args.rep):
+        plain.append(train_steps(model, batches, objective, optimizer)[0])
+        elapsed, elapsed_update = train_steps(
+            model, batches, objective, optimizer,
+            visu=visu, step=trial * args.steps)
+        logged.append(elapsed)
+        in_update.append(elapsed_update)
+    visu.close()
+
+    def _median(values):
+        return sorted(values)[len(values) // 2] / args.steps
+
+    plain, logged, in_update = \
+        _median(plain), _median(logged), _median(in_update)
+
+    # [2] report median time per step and check everything was logged
+    # #########################################################################
+    # end-to-end overhead is within the noise of the loop itself, so time
+    # spent blocked in visu.update is reported as well
+    # #########################################################################
+    n_logged = len(read_metrics(
+        os.path.join(logdir, args.name + METRICS_EXT))['step'])
+    print('{:<20} {:>6} {:>10} {:>10} {:>9} {:>10} {:>9} {:>7}'.format(
+        'Model', 'Batch', 'Plain', 'Logged', 'Overhead', 'Update',
+        'Overhead', 'Logged'))
+    print('{:<20} {:>6} {:>8.3f}ms {:>8.3f}ms {:>8.2f}% {:>8.2f}us '
+          '{:>8.3f}% {:>7}'.format(
+              args.name, args.batch_size, plain * 1e3, logged * 1e3,
+              (logged - plain) / plain * 100, in_update * 1e6,
+              in_update / plain * 100, n_logged))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--name', type=str, default='ThreeLayerConvNet',
+                        help='string of callable (torchvision) model')
+    parser.add_argument('-b', '--batch-size', type=int, default=128,
+                        help='number of samples per batch')
+    parser.add_argument('-s', '--steps', type=int, default=100,
+                        help='number of training steps per trial')
+    parser.add_argument('-r', '--rep', type=int, default=9,
+                        help='number of trials to take the median of')
+    args = parser.parse_args()
+
+    main(args)
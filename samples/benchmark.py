@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' script to benchmark graph parsing across the model zoo and synthetic
+    module hierarchies '''
+
+import time
+import argparse
+from copy import deepcopy
+import torch
+from torch.utils.tensorboard._pytorch_graph import graph
+
+from models import torch_models
+from visunn import proto_to_dict, process_nodes, process_modules
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+# models that can't trace cifar-sized inputs
+INPUT_SIZES = {
+    'inception_v3': 299
+}
+
+
+def get_model_and_inputs(name, batch_size=1):
+    ''' initializes a zoo model in eval mode with random inputs '''
+    model = torch_models[name](num_classes=10)
+    model.eval()
+
+    size = INPUT_SIZES.get(name, 32)
+    inputs = torch.randn(batch_size, 3, size, size)
+
+    return model, inputs
+
+
+def get_synthetic_graphdict(n_nodes, depth=4, fanout=8):
+    ''' builds a pruned graphdict with a synthetic module hierarchy
+
+        n_nodes  (int) : number of op nodes
+        depth    (int) : number of nested modules above each op node
+        fanout   (int) : number of submodules per module
+
+        every other level is wrapped in a single-child module so that
+        process_modules has trivial modules to collapse
+    '''
+    graphdict = {}
+    prev_name = None
+    for idx in range(n_nodes):
+        modules = ['Net']
+        position = idx
+        for level in range(depth):
+            modules.append('Block[{}]'.format(position % fanout))
+            position //= fanout
+            if level % 2 == 1:
+                modules.append('Wrapper[0]')
+
+        name = '/'.join(modules) + '/' + str(idx)
+        graphdict[name] = {
+            'name': name,
+            'op': 'aten::relu',
+            'input': [prev_name] if prev_name is not None else [],
+            'output': [],
+            'input_shapes': [],
+            'output_shapes': []
+        }
+        prev_name = name
+
+    return graphdict
+
+
+def bench(fn, graphdict, rep):
+    ''' times a graph processing stage, returning average seconds per call '''
+    elapsed = 0.0
+    for _ in range(rep):
+        # stages edit graphdict in place, so copy outside the timer
+        graphcopy = deepcopy(graphdict)
+        start = time.time()
+        graphcopy = fn(graphcopy)
+        elapsed += time.time() - start
+
+    return elapsed / rep, graphcopy
+
+
+def main_synthetic(args):
+    print('{:<20} {:>7} {:>10} {:>10}'.format(
+        'Synthetic', 'Nodes', 'Time', 'us/node'))
+    for n_nodes in args.sizes:
+        graphdict = get_synthetic_graphdict(n_nodes)
+        elapsed, _ = bench(process_modules, graphdict, args.rep)
+
+        print('{:<20} {:>7} {:>9.3f}s {:>10.2f}'.format(
+            'process_modules', n_nodes, elapsed, elapsed / n_nodes * 1e6),
+            flush=True)
+
+
+def main(args):
+    if args.synthetic:
+        main_synthetic(args)
+        return
+
+    names = args.names if args.names else list(torch_models)
+
+    print('{:<20} {:>7} {:>7} {:>7} {:>10} {:>10} {:>10}'.format(
+        'Model', 'Nodes', 'Edges', 'Pruned', 'Nodes', 'us/elem', 'Modules'))
+    for name in names:
+        model, inputs = get_model_and_inputs(name)
+        with torch.no_grad():
+            graphdef, _ = graph(model, inputs)
+        graphdict = proto_to_dict(graphdef)
+
+        n_nodes = len(graphdict)
+        n_edges = sum(len(node['input']) for node in graphdict.values())
+        elapsed, graphdict = bench(process_nodes, graphdict, args.rep)
+        elapsed_mods, _ = bench(process_modules, graphdict, args.rep)
+
+        print('{:<20} {:>7} {:>7} {:>7} {:>9.3f}s {:>10.2f} {:>9.3f}s'.format(
+            name, n_nodes, n_edges, len(graphdict), elapsed,
+            elapsed / (n_nodes + n_edges) * 1e6, elapsed_mods), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--names', type=str, nargs='*', default=None,
+                        help='names of (torchvision) models, defaults to all')
+    parser.add_argument('-r', '--rep', type=int, default=5,
+                        help='number of trials to average over')
+    parser.add_argument('-s', '--synthetic', default=False,
+                        action='store_true',
+                        help='whether to benchmark synthetic hierarchies')
+    parser.add_argument('--sizes', type=int, nargs='*',
+                        default=[1000, 5000, 10000, 50000],
+                        help='number of nodes of synthetic hierarchies')
+    args = parser.parse_args()
+
+    main(args)
@@ -7,6 +7,7 @@ import time
 import argparse
 from pprint import pprint
 from pympler import asizeof
+from google.protobuf.json_format import MessageToDict
 import networkx as nx
 import matplotlib.pyplot as plt
 from torch.utils.data import DataLoader
@@ -14,8 +15,8 @@ from torchvision import datasets, transforms
 from torch.utils.tensorboard._pytorch_graph import graph
 
 from models import torch_models
-from visunn import DATA_DIR, plot, proto_to_dict, process_nodes, \
-                   process_modules, build_modu
+from visunn import DATA_DIR, CompactModu, plot, proto_to_dict, \
+                   process_nodes, process_modules, build_modu
 
 __author__ = 'Vincent Liu'
 __email__ = 'vliu15@stanford.edu'
@@ -52,6 +53,30 @@ def get_model_and_dataloader(name):
     return model, dataloader
 
 
+def message_to_dict(graphdef):
+    ''' reference graphdef conversion through MessageToDict (for timing) '''
+    graphdict = {}
+    for node in graphdef.node:
+        node = MessageToDict(node)
+        graphdict[node['name']] = {
+            'name': node.get('name', ''),
+            'op': node.get('op', ''),
+            'input': node.get('input', []),
+            'output': [],
+            'input_shapes': [],
+            'output_shapes': []
+        }
+        if '_output_shapes' in node['attr']:
+            shapes = node['attr']['_output_shapes']['list']['shape']
+            for shape in shapes:
+                if 'dim' in shape:
+                    graphdict[node['name']]['output_shapes'].append(
+                        tuple(int(dim['size']) for dim in shape['dim'])
+                    )
+
+    return graphdict
+
+
 def main(args):
     model, dataloader = get_model_and_dataloader(args.name)
 
@@ -79,6 +104,14 @@ def main(args):
     print('    dict footprint: {}b'
           .format(asizeof.asizeof(graphdict)))
 
+    start = time.time()
+    for _ in range(args.rep):
+        reference = message_to_dict(graphdef)
+    end = time.time()
+    print('    (reference) MessageToDict: {:.3f}s, matches: {}'
+          .format((end - start)/args.rep, reference == graphdict),
+          flush=True)
+
     # [3] prune trivial nodes
     start = time.time()
     graphdict = process_nodes(graphdict)
@@ -112,6 +145,18 @@ def main(args):
     print('    modu footprint: {}b'
           .format(asizeof.asizeof(modu)))
 
+    # [5b] compact modularized topology
+    start = time.time()
+    compact_modu = CompactModu(modu)
+    for _ in range(args.rep - 1):
+        compact_modu = CompactModu(modu)
+    end = time.time()
+    print('[5b] compact modularized topology: {:.3f}s'
+          .format((end - start)/args.rep), flush=True)
+    print('    compact modu footprint: {}b ({:.1f}x smaller)'
+          .format(asizeof.asizeof(compact_modu),
+                  asizeof.asizeof(modu) / asizeof.asizeof(compact_modu)))
+
     # [6] interactive plotting
     if args.shell:
         pprint(list(modu.modules))
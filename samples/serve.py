@@ -4,7 +4,7 @@
 
 import argparse
 
-from visunn import App
+from visunn import App, LAYOUTS
 
 __author__ = 'Vincent Liu'
 __email__ = 'vliu15@stanford.edu'
@@ -14,11 +14,34 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', '--logdir', type=str, required=True,
                         help='string corresponding to saved model')
-    parser.add_argument('-n', '--name', type=str, required=True,
-                        help='string of model name')
+    parser.add_argument('-n', '--name', type=str, default=None,
+                        help='string of model name (serves all models in '
+                             'logdir under /api/<model>/<tag> if not set)')
     parser.add_argument('-p', '--port', type=int, default=5000,
                         help='port number to launch web app on')
+    parser.add_argument('-c', '--cache-size', type=int, default=128,
+                        help='max number of module responses to cache')
+    parser.add_argument('--layout', type=str, default='layered',
+                        choices=LAYOUTS,
+                        help='graph layout backend (dot requires graphviz)')
+    parser.add_argument('-b', '--budget', type=int, default=1024,
+                        help='max megabytes of topologies to keep loaded '
+                             '(when serving all models)')
+    parser.add_argument('--max-age', type=int, default=86400,
+                        help='seconds browsers may reuse module responses '
+                             'for without revalidating')
+    parser.add_argument('-r', '--reload', default=False,
+                        action='store_true',
+                        help='whether to swap in topologies whose files are '
+                             'replaced (browsers then always revalidate)')
     args = parser.parse_args()
 
-    app = App(args.logdir, args.name).app
-    app.run(use_reloader=True, port=args.port, threaded=True)
+    # browsers must revalidate whenever topologies can be swapped in, which
+    # the registry (serving all models) always does
+    reloads = args.reload or args.name is None
+    max_age = None if reloads else args.max_age
+
+    app = App(args.logdir, args.name, cache_size=args.cache_size,
+              layout=args.layout, budget=args.budget << 20,
+              max_age=max_age, reload=args.reload).app
+    app.run(port=args.port, threaded=True)
@@ -15,7 +15,6 @@ with open('README.md', 'r') as f:
 REQUIRED_PACKAGES = [
     'torch>=1.4.0',
     'numpy>=1.15.1',
-    'pydot>=1.4.1',
     'networkx>=2.4',
     'protobuf>=3.11.3',
     'flask>=1.1.1',
@@ -23,6 +22,15 @@ REQUIRED_PACKAGES = [
     'gevent>=20.4.0'
 ]
 
+EXTRA_PACKAGES = {
+    # optional graphviz layout backend (also requires the `dot` binary)
+    'graphviz': ['pydot>=1.4.1'],
+    # optional brotli compression of api responses
+    'brotli': ['brotli>=1.0.7'],
+    # optional asyncio server
+    'async': ['aiohttp>=3.6.0']
+}
+
 TEST_PACKAGES = [
     'matplotlib>=3.2.0',
     'pympler>=0.8',
@@ -32,7 +40,8 @@ TEST_PACKAGES = [
 ]
 
 CONSOLE_SCRIPTS = [
-    'visu = visunn.main:run_main'
+    'visu = visunn.main:run_main',
+    'visunn = visunn.main:run_command'
 ]
 
 VERSION = '0.1.1'
@@ -47,6 +56,7 @@ setup(
     long_description_content_type='text/markdown',
     url='https://github.com/vliu15/visunn',
     install_requires=REQUIRED_PACKAGES,
+    extras_require=EXTRA_PACKAGES,
     packages=find_packages(),
     entry_points={
         'console_scripts': CONSOLE_SCRIPTS
@@ -57,9 +67,9 @@ setup(
         'Intended Audience :: Education',
         'Intended Audience :: Science/Research',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Scientific/Engineering',
         'Topic :: Scientific/Engineering :: Mathematics',
         'Topic :: Scientific/Engineering :: Artificial Intelligence',
@@ -68,6 +78,6 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
     license='MIT',
-    python_requires='>=3.5',
+    python_requires='>=3.9',
     keywords='deep learning visualization neural networks pytorch torch'
 )
@@ -1,8 +1,20 @@
 from .visu import *
+from .builder import *
+from .cache import *
 from .modu import *
+from .compact import *
 from .plot import *
+from .layout import *
+from .topology import *
+from .export import *
+from .storage import *
 from .util import *
+from .metrics import *
+from .activations import *
+from .snapshots import *
+from .profiler import *
+from .costmodel import *
 from .constants import *
 from .backend import *
 
-__all__ = ['Visu', 'Modu']
+__all__ = ['Visu', 'Modu', 'CompactModu', 'MappedModu']
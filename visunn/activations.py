@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains sampled per-module activation statistics
+
+    file layout (all integers little endian):
+
+        [magic (8 bytes)][version (uint32)][bins (uint32)]
+        [names length (uint32)][module names (json, utf-8)]
+        [block]*
+
+    where each block holds the modules sampled at one step, as columns:
+
+        [step (int64)][rows (uint32)]
+        [module id (uint32 x rows)]
+        [mean, std, min, max, zeros (float32 x rows, each)]
+        [histogram (float32 x rows x bins)]
+
+    histograms split [min, max] of each sample into equal-width bins and
+    hold the fraction of values in each bin
+'''
+
+import re
+import json
+import queue
+import struct
+import threading
+
+import numpy as np
+import torch
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['ActivationMonitor', 'module_scopes', 'read_activations']
+
+MAGIC = b'VISUACT\x00'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIII')
+BLOCK = struct.Struct('<qI')
+
+# scalar statistics stored per sample, before the histogram
+STATS = ['mean', 'std', 'min', 'max', 'zeros']
+
+
+def module_scopes(model):
+    ''' maps each submodule to its scope in the traced graph
+
+        model  (torch.nn.Module) : pytorch model
+
+        scopes name modules as traced, e.g. the module at `layer1.0` of a
+        resnet is 'ResNet/Sequential[layer1]/BasicBlock[0]/' (modu names
+        parenthesize collapsed modules, see topology.module_scope)
+    '''
+    scopes = {'': type(model).__name__ + '/'}
+    for path, module in model.named_modules():
+        if path == '':
+            continue
+        parent, _, attr = path.rpartition('.')
+        scopes[path] = scopes[parent] + \
+            '{}[{}]/'.format(type(module).__name__, attr)
+    return {module: scopes[path] for path, module in model.named_modules()}
+
+
+def _first_tensor(output):
+    ''' retrieves the first floating point tensor of a module output '''
+    if torch.is_tensor(output):
+        return output if output.is_floating_point() else None
+    if isinstance(output, (list, tuple)):
+        for value in output:
+            tensor = _first_tensor(value)
+            if tensor is not None:
+                return tensor
+    return None
+
+
+def _summarize(tensor, bins):
+    ''' computes the statistics of a tensor on its device, as one row '''
+    x = tensor.detach().reshape(-1).float()
+    if x.numel() == 0:
+        return None
+
+    std, mean = torch.std_mean(x, unbiased=False)
+    low, high = x.min(), x.max()
+    zeros = (x == 0).float().mean()
+
+    # bins over [min, max] are computed without syncing to the host
+    # (constant tensors fall in the first bin)
+    span = high - low
+    scale = bins / torch.where(span > 0, span, torch.ones_like(span))
+    idx = ((x - low) * scale).long().clamp_(0, bins - 1)
+    hist = torch.zeros(bins, device=x.device).scatter_add_(
+        0, idx, torch.ones_like(x)) / x.numel()
+
+    return torch.cat([torch.stack([mean, std, low, high, zeros]), hist])
+
+
+class ActivationMonitor(object):
+    ''' samples activation statistics of modules with forward hooks
+
+        hooks on the modules are only registered for sampled forward passes,
+        so other steps only pay for the hooks on the model itself, and the
+        statistics of all modules are stacked on device and handed to a
+        background thread that copies them to the host and writes them
+    '''
+    def __init__(self, model, path, every=100, module_filter=None, bins=32):
+        ''' registers sampling hooks on the model
+
+            model          (torch.nn.Module) : pytorch model
+            path           (str)             : file path of the samples
+            every          (int)             : sample every n training
+                                               forward passes
+            module_filter  (str, callable)   : regex searched in, or
+                                               predicate of, module names
+                                               to sample (defaults to all)
+            bins           (int)             : number of histogram bins
+        '''
+        self._path = path
+        self._every = every
+        self._bins = bins
+        self._step = 0
+        self._rows = None
+
+        # [1] select modules to sample
+        # #####################################################################
+        if module_filter is None:
+            accept = lambda name: True
+        elif callable(module_filter):
+            accept = module_filter
+        else:
+            accept = re.compile(module_filter).search
+
+        scopes = module_scopes(model)
+        self._modules = [(module, name) for module, name in scopes.items()
+                         if accept(name)]
+        self._names = [name for _, name in self._modules]
+
+        # the model is sampled by its own hook (see _end), since hooks run in
+        # order of registration
+        self._root = None
+        if len(self._modules) > 0 and self._modules[0][0] is model:
+            self._root = 0
+        self._handles = []
+
+        # [2] write header (samples of earlier runs are discarded)
+        # #####################################################################
+        names = json.dumps(self._names).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, bins, len(names)))
+            f.write(names)
+
+        # [3] hook the model to toggle sampling per forward pass
+        # #####################################################################
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._model_handles = [
+            model.register_forward_pre_hook(self._begin),
+            model.register_forward_hook(self._end)
+        ]
+
+    @property
+    def path(self):
+        ''' retrieves path of the samples '''
+        return self._path
+
+    @property
+    def modules(self):
+        ''' retrieves names of sampled modules '''
+        return self._names
+
+    def _begin(self, model, inputs):
+        ''' registers module hooks if this forward pass is sampled '''
+        if not model.training:
+            return
+        self._step += 1
+        if (self._step - 1) % self._every != 0 or len(self._modules) == 0:
+            return
+
+        self._rows = []
+        for idx, (module, _) in enumerate(self._modules):
+            if idx == self._root:
+                continue
+            self._handles.append(module.register_forward_hook(
+                lambda module, inputs, output, idx=idx:
+                    self._sample(idx, output)
+            ))
+
+    def _sample(self, idx, output):
+        ''' computes the statistics of a module output '''
+        tensor = _first_tensor(output)
+        if tensor is None:
+            return
+        with torch.no_grad():
+            row = _summarize(tensor, self._bins)
+        if row is not None:
+            self._rows.append((idx, row))
+
+    def _end(self, model, inputs, output):
+        ''' aggregates the statistics of a sampled pass and removes hooks '''
+        if self._rows is None:
+            return
+        if self._root is not None:
+            self._sample(self._root, output)
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+        rows, self._rows = self._rows, None
+        if len(rows) == 0:
+            return
+
+        # rows may be on different devices (e.g. model parallel)
+        device = rows[0][1].device
+        ids = [idx for idx, _ in rows]
+        stats = torch.stack([row.to(device) for _, row in rows])
+        self._queue.put((self._step - 1, ids, stats))
+
+    def _run(self):
+        ''' writes aggregated samples until closed '''
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            step, ids, stats = item
+            # columns are contiguous after transposing
+            stats = stats.cpu().numpy().astype('<f4').T.copy()
+            with open(self._path, 'ab') as f:
+                f.write(BLOCK.pack(step, len(ids)))
+                f.write(np.array(ids, dtype='<u4').tobytes())
+                f.write(stats.tobytes())
+
+    def flush(self):
+        ''' blocks until all samples taken so far are written '''
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        ''' writes pending samples and removes all hooks '''
+        for handle in self._model_handles + self._handles:
+            handle.remove()
+        self._model_handles, self._handles = [], []
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+def read_activations(path, name=None):
+    ''' reads activation samples into columns
+
+        path  (str) : file path of the samples
+        name  (str) : module name to read samples of (defaults to all)
+
+        returns a dict with 'bins', and per module name a dict of numpy
+        arrays 'step', 'mean', 'std', 'min', 'max', 'zeros' and 'hist'
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise ValueError('{} is not a visunn activations file'.format(path))
+    _, version, bins, length = HEADER.unpack_from(data, 0)
+    if version != FORMAT_VERSION:
+        raise ValueError('{} has unsupported format version {} '
+                         '(expected {})'.format(path, version, FORMAT_VERSION))
+
+    offset = HEADER.size
+    names = json.loads(data[offset:offset+length].decode('utf-8'))
+    offset += length
+    wanted = None
+    if name is not None:
+        wanted = names.index(name) if name in names else -1
+
+    # [1] gather the rows of each module across blocks
+    # #########################################################################
+    width = len(STATS) + bins
+    samples = {}
+    while offset + BLOCK.size <= len(data):
+        step, rows = BLOCK.unpack_from(data, offset)
+        size = BLOCK.size + rows * 4 * (1 + width)
+        # a trailing partial block (e.g. from a crash mid-write) is ignored
+        if offset + size > len(data):
+            break
+
+        ids = np.frombuffer(data, dtype='<u4', count=rows,
+                            offset=offset + BLOCK.size)
+        stats = np.frombuffer(data, dtype='<f4', count=rows * width,
+                              offset=offset + BLOCK.size + rows * 4) \
+            .reshape(width, rows)
+        for col, idx in enumerate(ids):
+            if wanted is None or idx == wanted:
+                samples.setdefault(int(idx), []).append((step, stats[:, col]))
+        offset += size
+
+    # [2] convert to columns per module
+    # #########################################################################
+    result = {'bins': bins}
+    for idx, rows in samples.items():
+        table = np.stack([row for _, row in rows])
+        columns = {'step': np.array([step for step, _ in rows], dtype='<i8')}
+        for col, stat in enumerate(STATS):
+            columns[stat] = table[:, col]
+        columns['hist'] = table[:, len(STATS):]
+        result[names[idx]] = columns
+    return result
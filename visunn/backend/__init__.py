@@ -1,2 +1,8 @@
+from .cache import *
 from .routes import *
+from .registry import *
+from .watcher import *
+from .binary import *
 from .app import *
+from .aio import *
+from .prefork import *
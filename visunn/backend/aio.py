@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains asyncio app to serve the backend
+
+    the event loop only routes requests and answers from the response cache,
+    while module views (export, layout, serialization and compression) are
+    rendered in a bounded pool of worker processes, so that a slow module
+    (e.g. a graphviz layout) never stalls other clients, and static frontend
+    files are sent straight from disk
+'''
+
+import os
+import asyncio
+import multiprocessing as mp
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from werkzeug.datastructures import MIMEAccept
+
+from visunn.topology import tag_module
+from visunn.backend.cache import LRUCache
+from visunn.backend.registry import Registry
+from visunn.backend.binary import MIMETYPE
+from visunn.backend.routes import MAX_BATCH_SIZE, MAX_SUBTREE_DEPTH, \
+                                  _negotiate, _invalidate, _subtree_tags, \
+                                  _render_view, _render_batch, \
+                                  _render_activations, _render_snapshots
+from visunn.constants import ACTIVATIONS_EXT, SNAPSHOTS_EXT
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['AsyncApp']
+
+# optional asyncio server (pip install visunn[async])
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+# registry of topologies in each worker process (see _init_worker)
+_registry = None
+
+
+def _init_worker(logdir, budget):
+    ''' opens a registry of topologies in a worker process '''
+    global _registry
+    _registry = Registry(logdir, budget=budget)
+
+
+def _work(render, model, *args):
+    ''' renders a response from the topology of a model in a worker '''
+    return render(_registry.get(model), *args)
+
+
+def _query_int(request, key, default=None):
+    ''' retrieves an int query argument, as request.args.get(type=int) '''
+    try:
+        return int(request.query[key])
+    except (KeyError, ValueError):
+        return default
+
+
+def _respond(request, body, max_age=None):
+    ''' responds with a precompressed body, or 304 if the client has it
+
+        request  (web.Request) : request to respond to
+        body     (_Body)       : precompressed body
+        max_age  (int)         : seconds clients may reuse the body for
+                                 without revalidating (always revalidated if
+                                 None)
+    '''
+    coding, suffix, fresh = _negotiate(
+        body, parse_accept_header(request.headers.get('Accept-Encoding')),
+        parse_etags(request.headers.get('If-None-Match')))
+
+    headers = {
+        'ETag': quote_etag(body.etag + suffix),
+        'Vary': 'Accept-Encoding, Accept',
+        'Cache-Control': 'no-cache' if max_age is None else
+                         'public, max-age={}'.format(max_age)
+    }
+    if fresh:
+        return web.Response(status=304, headers=headers)
+    if coding != 'identity':
+        headers['Content-Encoding'] = coding
+    return web.Response(body=body.codings[coding], content_type=body.mimetype,
+                        headers=headers)
+
+
+class AsyncApp(object):
+    ''' asyncio web app of one model, or of all models in logdir
+
+        renders are single-flight (concurrent requests for the same response
+        share one render), and requests beyond the queue depth are turned
+        away with 503, while requests that wait longer than the timeout get
+        504 (their render still finishes, and is cached for the next request)
+    '''
+    def __init__(self, logdir, name=None, cache_size=128, layout='layered',
+                 budget=1 << 30, max_age=86400, processes=None, timeout=30.0,
+                 max_pending=64):
+        ''' initializes the web app (worker processes start with it)
+
+            logdir       (str)   : folder of logged topologies
+            name         (str)   : model name (serves all models if not
+                                   specified)
+            cache_size   (int)   : max number of module responses to cache
+            layout       (str)   : layout backend, 'layered' or 'dot'
+            budget       (int)   : max total bytes of loaded topologies (per
+                                   process)
+            max_age      (int)   : seconds browsers may reuse module
+                                   responses for without revalidating
+            processes    (int)   : number of worker processes to render
+                                   responses with (defaults to number of cpus)
+            timeout      (float) : seconds a request may wait for its render
+            max_pending  (int)   : max number of renders queued or running
+        '''
+        if web is None:
+            raise ImportError('the asyncio server requires aiohttp '
+                              '(pip install visunn[async])')
+
+        self._name = name
+        self._layout = layout
+        self._max_age = max_age
+        self._timeout = timeout
+        self._max_pending = max_pending
+        self._static_folder = os.path.realpath(os.path.join(
+            os.path.dirname(__file__), '..', 'frontend', 'build'))
+
+        # topologies are memory-mapped, so the event loop and every worker
+        # open their own registry over the same files
+        self._registry = Registry(logdir, budget=budget)
+        self._cache = LRUCache(maxsize=cache_size)
+        self._registry.subscribe(
+            lambda old, new: _invalidate(self._cache, old))
+        self._flights = {}
+        self._processes = processes or os.cpu_count()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self._processes,
+            mp_context=mp.get_context('spawn'),
+            initializer=_init_worker, initargs=(logdir, budget))
+
+        # register routes (api routes before the catch-all for build files)
+        # #####################################################################
+        app = web.Application()
+        prefix = '/api' if name is not None else '/api/{model}'
+        if name is None:
+            app.router.add_get('/api/models', self._models)
+        app.router.add_get(prefix + '/batch', self._batch)
+        app.router.add_get(prefix + '/{tag}', self._topology)
+        app.router.add_get(prefix + '/{tag}/subtree', self._subtree)
+        app.router.add_get(prefix + '/{tag}/activations', self._activations)
+        app.router.add_get(prefix + '/{tag}/snapshots', self._snapshots)
+        app.router.add_get('/', self._static)
+        app.router.add_get('/{path:.*}', self._static)
+
+        app.on_response_prepare.append(self._allow_origin)
+        app.on_startup.append(self._start_workers)
+        app.on_cleanup.append(self._shutdown)
+        self._app = app
+
+    @property
+    def app(self):
+        return self._app
+
+    @property
+    def registry(self):
+        ''' retrieves the registry of models of the event loop '''
+        return self._registry
+
+    async def _allow_origin(self, request, response):
+        ''' allows cross-origin requests, as flask-cors does for App '''
+        response.headers['Access-Control-Allow-Origin'] = '*'
+
+    async def _start_workers(self, app):
+        ''' starts the worker processes ahead of the first request '''
+        for _ in range(self._processes):
+            self._pool.submit(os.getpid)
+
+    async def _shutdown(self, app):
+        ''' stops the worker processes '''
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _land(self, key, flight):
+        ''' caches the result of a finished render '''
+        del self._flights[key]
+        if not flight.cancelled() and flight.exception() is None and \
+                flight.result() is not None:
+            self._cache.put(key, flight.result())
+
+    async def _render(self, key, executor, fn, *args):
+        ''' retrieves a cached response, or renders it on an executor
+
+            key       (hashable) : cache key
+            executor  (Executor) : pool to render with (threads if None)
+            fn        (callable) : function of args to the response
+        '''
+        body = self._cache.lookup(key)
+        if body is not None:
+            return body
+
+        # [1] join the render in flight, or queue one if there is room
+        # #####################################################################
+        flight = self._flights.get(key, None)
+        if flight is None:
+            if len(self._flights) >= self._max_pending:
+                raise web.HTTPServiceUnavailable(headers={'Retry-After': '1'})
+            flight = asyncio.get_running_loop().run_in_executor(
+                executor, fn, *args)
+            self._flights[key] = flight
+            flight.add_done_callback(partial(self._land, key))
+
+        # [2] wait for it, without cancelling it for other requests
+        # #####################################################################
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight),
+                                          self._timeout)
+        except asyncio.TimeoutError:
+            raise web.HTTPGatewayTimeout()
+
+    def _modu(self, request):
+        ''' retrieves the model name and topology of a request (or 404) '''
+        model = request.match_info.get('model', self._name)
+        try:
+            return model, self._registry.get(model)
+        except KeyError:
+            raise web.HTTPNotFound()
+
+    def _tag(self, request, modu):
+        ''' retrieves the module tag of a request (or 404) '''
+        tag = request.match_info['tag']
+        if tag_module(modu, tag) not in modu.modules:
+            raise web.HTTPNotFound()
+        return tag
+
+    async def _view(self, model, modu, tag, binary=False):
+        ''' retrieves the (cached) body of the view of a module '''
+        return await self._render((tag, modu.hash, binary), self._pool,
+                                  _work, _render_view, model, tag,
+                                  self._layout, binary)
+
+    async def _views(self, request, model, modu, tags):
+        ''' responds with the (cached) views of several modules '''
+        tags = list(dict.fromkeys(tags))
+        if len(tags) == 0 or len(tags) > MAX_BATCH_SIZE:
+            raise web.HTTPBadRequest()
+        if any(tag_module(modu, tag) not in modu.modules for tag in tags):
+            raise web.HTTPNotFound()
+
+        key = ('batch', tuple(tags), modu.hash)
+        body = self._cache.lookup(key)
+        if body is None:
+            bodies = await asyncio.gather(
+                *[self._view(model, modu, tag) for tag in tags])
+            # joining and compressing releases the gil, so threads suffice
+            body = await self._render(key, None, _render_batch, modu, tags,
+                                      self._layout, bodies)
+        return _respond(request, body, self._max_age)
+
+    async def _models(self, request):
+        return web.json_response(self._registry.models())
+
+    async def _topology(self, request):
+        model, modu = self._modu(request)
+        tag = self._tag(request, modu)
+        binary = parse_accept_header(request.headers.get('Accept'),
+                                     MIMEAccept).best_match(
+            ['application/json', MIMETYPE]) == MIMETYPE
+        body = await self._view(model, modu, tag, binary)
+        return _respond(request, body, self._max_age)
+
+    async def _batch(self, request):
+        model, modu = self._modu(request)
+        return await self._views(request, model, modu,
+                                 request.query.getall('tag', []))
+
+    async def _subtree(self, request):
+        model, modu = self._modu(request)
+        tag = self._tag(request, modu)
+        depth = _query_int(request, 'depth', 1)
+        if depth < 0 or depth > MAX_SUBTREE_DEPTH:
+            raise web.HTTPBadRequest()
+        return await self._views(request, model, modu,
+                                 _subtree_tags(modu, tag, depth))
+
+    async def _activations(self, request):
+        model, modu = self._modu(request)
+        tag = self._tag(request, modu)
+        path = self._registry.path(model, ACTIVATIONS_EXT)
+        if not os.path.exists(path):
+            raise web.HTTPNotFound()
+
+        # samples are only appended, so the file size versions the response
+        key = ('activations', path, tag, os.path.getsize(path))
+        body = await self._render(key, self._pool, _work, _render_activations,
+                                  model, tag, path)
+        if body is None:
+            raise web.HTTPNotFound()
+        return _respond(request, body)
+
+    async def _snapshots(self, request):
+        model, modu = self._modu(request)
+        tag = self._tag(request, modu)
+        path = self._registry.path(model, SNAPSHOTS_EXT)
+        if not os.path.exists(path):
+            raise web.HTTPNotFound()
+
+        # steps in [start, end), so that series can be fetched in pages
+        start = _query_int(request, 'start')
+        end = _query_int(request, 'end')
+        key = ('snapshots', path, tag, start, end, os.path.getsize(path))
+        body = await self._render(key, self._pool, _work, _render_snapshots,
+                                  model, tag, path, start, end)
+        if body is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=body, content_type='application/json')
+
+    async def _static(self, request):
+        ''' serves build files (and index.html for any other path) '''
+        path = request.match_info.get('path', '')
+        full_path = os.path.realpath(os.path.join(self._static_folder, path))
+        if path != '' and os.path.isfile(full_path) and \
+                full_path.startswith(self._static_folder + os.sep):
+            return web.FileResponse(full_path)
+        return web.FileResponse(os.path.join(self._static_folder,
+                                             'index.html'))
@@ -3,12 +3,14 @@
 ''' contains flask app to serve the backend '''
 
 import os
-import pickle
 from flask import Flask, send_from_directory
 from flask_cors import CORS
 
-from visunn.backend.routes import api
-from visunn.constants import MODU_EXT
+from visunn.backend.routes import api, registry_api
+from visunn.backend.registry import Registry
+from visunn.backend.watcher import ModuWatcher
+from visunn.storage import load_modu
+from visunn.constants import MODU_EXT, ACTIVATIONS_EXT, SNAPSHOTS_EXT
 
 __author__ = 'Vincent Liu'
 __email__ = 'vliu15@stanford.edu'
@@ -17,15 +19,27 @@ __all__ = ['App']
 
 
 class App(object):
-    def __init__(self, logdir, name):
+    def __init__(self, logdir, name=None, cache_size=128, layout='layered',
+                 budget=1 << 30, max_age=86400, reload=False):
+        ''' initializes the web app of one model, or of all models in logdir
+
+            logdir      (str)  : folder of logged topologies
+            name        (str)  : model name (serves all models if not
+                                 specified)
+            cache_size  (int)  : max number of module responses to cache
+            layout      (str)  : layout backend, 'layered' or 'dot'
+            budget      (int)  : max total bytes of loaded topologies (when
+                                 serving all models)
+            max_age     (int)  : seconds browsers may reuse module responses
+                                 for without revalidating
+            reload      (bool) : whether to swap in the topology when its file
+                                 is replaced (models served from a registry
+                                 are always reloaded)
+        '''
         app = Flask(__name__, static_folder='../frontend/build')
         app.config.update(dict(debug=True))
         CORS(app)
 
-        # load model topology
-        with open(os.path.join(logdir, name + MODU_EXT), 'rb') as f:
-            self._modu = pickle.load(f)
-
         # route build files
         @app.route('/', defaults={'path': ''})
         @app.route('/<path:path>')
@@ -36,9 +50,36 @@ class App(object):
                 return send_from_directory(app.static_folder, 'index.html')
 
         # register blueprint routings
-        app.register_blueprint(api(self._modu), url_prefix='/api')
+        # #####################################################################
+        # a registry serves every model in logdir under /api/<model>/<tag>,
+        # loading each topology on first access
+        # #####################################################################
+        if name is None:
+            self._modu = None
+            self._registry = Registry(logdir, budget=budget)
+            blueprint = registry_api(self._registry, cache_size=cache_size,
+                                     layout=layout, max_age=max_age)
+        else:
+            # load model topology (module records are decoded on request),
+            # and watch its file for replacements if reloading
+            self._registry = None
+            save_path = os.path.join(logdir, name + MODU_EXT)
+            self._modu = ModuWatcher(save_path) if reload else \
+                load_modu(save_path)
+            blueprint = api(
+                self._modu, cache_size=cache_size, layout=layout,
+                activations_path=os.path.join(logdir, name + ACTIVATIONS_EXT),
+                snapshots_path=os.path.join(logdir, name + SNAPSHOTS_EXT),
+                max_age=max_age
+            )
+        app.register_blueprint(blueprint, url_prefix='/api')
         self._app = app
 
     @property
     def app(self):
         return self._app
+
+    @property
+    def registry(self):
+        ''' retrieves the registry of models (None if serving one model) '''
+        return self._registry
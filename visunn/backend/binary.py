@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains compact binary encoding of module views for the api
+
+    layout (all integers little endian, sections 8-byte aligned so that they
+    can be viewed as typed arrays in place):
+
+        [magic (8 bytes)][version (uint32)][header length (uint32)]
+        [header (json, utf-8)][padding]
+        [section]*
+
+    the header holds the number of nodes, the op table, the names of the
+    estimate columns, attributes of module nodes that are not columns
+    ('params', 'cost'), and per section its [offset, length, dtype, shape]
+    relative to the start of the sections:
+
+        names           (uint8)            : utf-8 names, concatenated
+        name_offsets    (uint32, names+1)  : offsets of names in the blob
+        ops             (uint32, nodes)    : op of each node (in op table)
+        coords          (float32, nodes x 2)
+        edges           (uint32, edges x 2): (input, node) name indices
+        inputs          (uint32)           : name indices of view inputs
+        outputs         (uint32)           : name indices of view outputs
+        input_links     (uint32)           : csr of each node's inputs
+        output_links    (uint32)           : csr of each node's outputs
+        shape_dims      (int64)            : dims of shapes, concatenated
+        shape_offsets   (uint32, shapes+1) : offsets of shapes in the dims
+        input_shapes    (uint32)           : csr of each node's input shapes
+        output_shapes   (uint32)           : csr of each node's output shapes
+        estimates       (float64, nodes x estimates, nan if missing)
+
+    the first `nodes` names are the nodes of the view (in the order of meta),
+    and later names are only linked to, and each csr is stored as its
+    indptr (nodes+1) followed by its indices
+'''
+
+import json
+import struct
+from itertools import accumulate, chain
+
+import numpy as np
+
+from visunn.costmodel import ESTIMATES
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['MIMETYPE', 'encode_topology', 'decode_topology']
+
+MIMETYPE = 'application/vnd.visunn.topology'
+MAGIC = b'VISUTOP\x00'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sII')
+ALIGNMENT = 8
+
+
+def _offsets(rows):
+    ''' builds offsets (lengths of rows, accumulated from 0) of rows '''
+    return np.fromiter(accumulate(map(len, rows), initial=0), dtype='<u4',
+                       count=len(rows) + 1)
+
+
+def _csr(rows, index):
+    ''' builds csr indptr and indices of rows of keys mapped by an index '''
+    indptr = _offsets(rows)
+    indices = np.fromiter(map(index.__getitem__, chain.from_iterable(rows)),
+                          dtype='<u4', count=int(indptr[-1]))
+    return np.concatenate([indptr, indices])
+
+
+def encode_topology(view):
+    ''' encodes a module view (as built by build_topology) as bytes
+
+        view  (dict) : module view with 'meta', 'coords', 'edges', 'inputs'
+                       and 'outputs'
+    '''
+    meta = view['meta']
+    nodes = list(meta.values())
+    n = len(nodes)
+
+    # [1] intern names (nodes first, then names only linked to) and shapes
+    # #########################################################################
+    inputs = [node['input'] for node in nodes]
+    outputs = [node['output'] for node in nodes]
+    names = list(dict.fromkeys(chain(
+        meta, chain.from_iterable(inputs), chain.from_iterable(outputs))))
+    index = {name: idx for idx, name in enumerate(names)}
+
+    input_shapes = [list(map(tuple, node['input_shapes'])) for node in nodes]
+    output_shapes = [list(map(tuple, node['output_shapes']))
+                     for node in nodes]
+    shapes = list(dict.fromkeys(chain(chain.from_iterable(input_shapes),
+                                      chain.from_iterable(output_shapes))))
+    shape_index = {shape: idx for idx, shape in enumerate(shapes)}
+
+    ops = list(dict.fromkeys(node['op'] for node in nodes))
+    op_index = {op: idx for idx, op in enumerate(ops)}
+
+    # [2] build columns
+    # #########################################################################
+    blobs = [name.encode('utf-8') for name in names]
+    coords = view['coords']
+    edges = view['edges']
+    estimates = np.full((n, len(ESTIMATES)), np.nan, dtype='<f8')
+    for idx, node in enumerate(nodes):
+        if 'estimate' in node:
+            estimates[idx] = [node['estimate'][key] for key in ESTIMATES]
+
+    sections = {
+        'names': np.frombuffer(b''.join(blobs), dtype='u1'),
+        'name_offsets': _offsets(blobs),
+        'ops': np.fromiter((op_index[node['op']] for node in nodes),
+                           dtype='<u4', count=n),
+        'coords': np.fromiter(chain.from_iterable(map(coords.__getitem__,
+                                                      meta)),
+                              dtype='<f4', count=2 * n).reshape(n, 2),
+        'edges': np.fromiter(chain.from_iterable(
+                                 (index[in_name], index[name])
+                                 for name in edges for in_name in edges[name]),
+                             dtype='<u4').reshape(-1, 2),
+        'inputs': np.array([index[name] for name in view['inputs']],
+                           dtype='<u4'),
+        'outputs': np.array([index[name] for name in view['outputs']],
+                            dtype='<u4'),
+        'input_links': _csr(inputs, index),
+        'output_links': _csr(outputs, index),
+        'shape_dims': np.fromiter(chain.from_iterable(shapes), dtype='<i8'),
+        'shape_offsets': _offsets(shapes),
+        'input_shapes': _csr(input_shapes, shape_index),
+        'output_shapes': _csr(output_shapes, shape_index),
+        'estimates': estimates
+    }
+
+    # [3] lay out header and aligned sections
+    # #########################################################################
+    extra = {}
+    for idx, node in enumerate(nodes):
+        attrs = {key: node[key] for key in ('params', 'cost') if key in node}
+        if len(attrs) > 0:
+            extra[idx] = attrs
+
+    layout, offset = {}, 0
+    for key, array in sections.items():
+        layout[key] = [offset, array.nbytes, array.dtype.str,
+                       list(array.shape)]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({
+        'nodes': n,
+        'ops': ops,
+        'estimates': ESTIMATES,
+        'extra': extra,
+        'sections': layout
+    }, separators=(',', ':')).encode('utf-8')
+    start = HEADER.size + len(header)
+    header += b' ' * (-start % ALIGNMENT)
+
+    data = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, len(header)))
+    data += header
+    for key, array in sections.items():
+        data += array.tobytes()
+        data += b'\x00' * (-array.nbytes % ALIGNMENT)
+    return bytes(data)
+
+
+def decode_topology(data):
+    ''' decodes bytes from encode_topology back into a module view (dict)
+
+        meant for clients and tests, since the server only encodes
+    '''
+    magic, version, length = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('not a visunn binary topology (version {})'
+                         .format(FORMAT_VERSION))
+    header = json.loads(data[HEADER.size:HEADER.size+length].decode('utf-8'))
+    start = HEADER.size + length
+
+    arrays = {}
+    for key, (offset, nbytes, dtype, shape) in header['sections'].items():
+        arrays[key] = np.frombuffer(data, dtype=dtype, count=nbytes //
+                                    np.dtype(dtype).itemsize,
+                                    offset=start + offset).reshape(shape)
+
+    n = header['nodes']
+    offsets = arrays['name_offsets']
+    blob = arrays['names'].tobytes()
+    names = [blob[offsets[i]:offsets[i+1]].decode('utf-8')
+             for i in range(len(offsets) - 1)]
+    dims, shape_offsets = arrays['shape_dims'], arrays['shape_offsets']
+    shapes = [dims[shape_offsets[i]:shape_offsets[i+1]].tolist()
+              for i in range(len(shape_offsets) - 1)]
+
+    def _rows(csr, table):
+        indptr, indices = csr[:n+1], csr[n+1:]
+        return [[table[j] for j in indices[indptr[i]:indptr[i+1]]]
+                for i in range(n)]
+
+    inputs = _rows(arrays['input_links'], names)
+    outputs = _rows(arrays['output_links'], names)
+    input_shapes = _rows(arrays['input_shapes'], shapes)
+    output_shapes = _rows(arrays['output_shapes'], shapes)
+
+    meta = {}
+    for i in range(n):
+        meta[names[i]] = {
+            'name': names[i],
+            'op': header['ops'][arrays['ops'][i]],
+            'input': inputs[i],
+            'output': outputs[i],
+            'input_shapes': input_shapes[i],
+            'output_shapes': output_shapes[i]
+        }
+        if not np.isnan(arrays['estimates'][i]).any():
+            meta[names[i]]['estimate'] = {
+                key: int(value) for key, value in
+                zip(header['estimates'], arrays['estimates'][i])}
+        meta[names[i]].update(header['extra'].get(str(i), {}))
+
+    edges = {name: [] for name in names[:n]}
+    for in_idx, idx in arrays['edges']:
+        edges.setdefault(names[idx], []).append(names[in_idx])
+
+    return {
+        'meta': meta,
+        'coords': {names[i]: arrays['coords'][i].tolist() for i in range(n)},
+        'edges': edges,
+        'inputs': [names[i] for i in arrays['inputs']],
+        'outputs': [names[i] for i in arrays['outputs']]
+    }
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains lru cache for built api responses '''
+
+import threading
+from collections import OrderedDict
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['LRUCache']
+
+
+class _Flight(object):
+    ''' tracks a value that is still being built '''
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LRUCache(object):
+    ''' size-bounded, thread-safe lru cache with single-flight builds '''
+    def __init__(self, maxsize=128, maxweight=None, weigh=None):
+        ''' initializes an empty cache
+
+            maxsize    (int)      : maximum number of cached entries
+            maxweight  (int)      : maximum total weight of cached entries
+                                    (unbounded if not specified)
+            weigh      (callable) : function of an entry to its weight (e.g.
+                                    bytes), required with maxweight
+        '''
+        self._maxsize = maxsize
+        self._maxweight = maxweight
+        self._weigh = weigh
+        self._weights = {}
+        self._weight = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, build):
+        ''' retrieves the entry for key, building it on a miss
+
+            key    (hashable) : cache key
+            build  (callable) : no-argument function that builds the entry
+
+            concurrent misses on the same key wait for the first build to
+            finish (and share its result or exception) instead of rebuilding
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            flight = self._flights.get(key, None)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+
+        # [1] wait on the build that is already in flight
+        # #####################################################################
+        if not is_leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        # [2] build the entry and publish it to any waiting requests
+        # #####################################################################
+        try:
+            flight.value = build()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            self.put(key, flight.value)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+        return flight.value
+
+    def lookup(self, key, default=None):
+        ''' retrieves the entry for key without building it on a miss '''
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    @property
+    def weight(self):
+        ''' retrieves total weight of cached entries '''
+        return self._weight
+
+    def keys(self):
+        ''' retrieves keys of cached entries, least recently used first '''
+        with self._lock:
+            return list(self._entries)
+
+    def put(self, key, value):
+        ''' inserts an entry, evicting the least recently used if full
+
+            the entry just inserted is kept even if it alone is heavier than
+            maxweight
+        '''
+        weight = self._weigh(value) if self._weigh is not None else 0
+        with self._lock:
+            self._weight += weight - self._weights.get(key, 0)
+            self._weights[key] = weight
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize or (
+                    self._maxweight is not None and len(self._entries) > 1
+                    and self._weight > self._maxweight):
+                evicted, _ = self._entries.popitem(last=False)
+                self._weight -= self._weights.pop(evicted)
+
+    def pop(self, key):
+        ''' discards an entry (if cached) '''
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+                self._weight -= self._weights.pop(key)
+
+    def clear(self):
+        ''' discards all cached entries '''
+        with self._lock:
+            self._entries.clear()
+            self._weights.clear()
+            self._weight = 0
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains pre-forking server to serve the backend from several processes
+
+    the app (with its topologies) is built once in the master, which then
+    freezes the garbage collector and forks workers that all accept on one
+    listening socket, so that loaded objects stay in pages shared
+    copy-on-write (the collector never touches frozen objects) and
+    memory-mapped topology files are shared through the page cache
+'''
+
+import os
+import gc
+import signal
+import socket
+
+from gevent.pywsgi import WSGIServer
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['serve_forked', 'preload']
+
+
+def preload(app):
+    ''' loads every topology served by an App ahead of forking
+
+        app  (App) : web app (of one model, or of all models in logdir)
+    '''
+    if app.registry is not None:
+        for model in app.registry.models():
+            app.registry.get(model['name'])
+
+
+def _serve(listener, app):
+    ''' runs a worker, serving on a listening socket until terminated '''
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    WSGIServer(listener, app, log=None).serve_forever()
+
+
+def serve_forked(app, port, workers=None, host='localhost', backlog=1024,
+                 ready=None):
+    ''' serves a wsgi app from pre-forked worker processes
+
+        app      (Flask)    : wsgi app, built before forking
+        port     (int)      : port number to listen on
+        workers  (int)      : number of worker processes (defaults to number
+                              of cpus)
+        host     (str)      : host to listen on
+        backlog  (int)      : max number of pending connections
+        ready    (callable) : function of worker pids, called once forked
+
+        workers that die are forked again, until the master is interrupted
+        (or terminated), which then terminates the workers
+    '''
+    workers = workers or os.cpu_count()
+
+    # [1] listen in the master, so that every worker accepts on one socket
+    # #########################################################################
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    listener.setblocking(False)
+
+    # [2] move everything loaded so far out of reach of the collector, whose
+    # passes would otherwise write to (and unshare) every page of objects
+    # #########################################################################
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    def _fork():
+        ''' forks a worker, returning its pid in the master '''
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve(listener, app)
+            finally:
+                os._exit(1)
+        return pid
+
+    # [3] fork workers, and fork replacements of any that die
+    # #########################################################################
+    pids = set(_fork() for _ in range(workers))
+    if ready is not None:
+        ready(sorted(pids))
+
+    stopping = []
+
+    def _stop(*_):
+        ''' terminates all workers (without forking replacements) '''
+        stopping.append(True)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        while len(pids) > 0:
+            try:
+                pid, _ = os.wait()
+            except KeyboardInterrupt:
+                _stop()
+                continue
+            except ChildProcessError:
+                break
+            pids.discard(pid)
+            if not stopping:
+                pids.add(_fork())
+    finally:
+        listener.close()
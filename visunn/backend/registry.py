@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains registry of lazily loaded topologies in a log directory '''
+
+import os
+
+from visunn.storage import load_modu
+from visunn.backend.cache import LRUCache
+from visunn.constants import MODU_EXT
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['Registry']
+
+
+class Registry(object):
+    ''' serves the topologies of all models logged in a folder
+
+        topologies are loaded when first requested and kept in an lru cache
+        bounded by a memory budget, where each topology weighs the size of
+        its file (memory-mapped topologies only page in what is served, so
+        this is an upper bound for them)
+
+        evicted topologies are never closed explicitly, since requests may
+        still be serving them, and are unmapped once no longer referenced
+    '''
+    def __init__(self, logdir, budget=1 << 30, max_models=64):
+        ''' initializes an empty registry
+
+            logdir      (str) : folder of logged topologies
+            budget      (int) : max total bytes of loaded topologies
+            max_models  (int) : max number of loaded topologies
+        '''
+        self._logdir = logdir
+        self._callbacks = []
+        self._modus = LRUCache(maxsize=max_models, maxweight=budget,
+                               weigh=lambda entry: entry[1])
+
+    @property
+    def logdir(self):
+        ''' retrieves folder of logged topologies '''
+        return self._logdir
+
+    def subscribe(self, callback):
+        ''' calls a function of the old and new topology whenever a replaced
+            file is reloaded with a different content hash '''
+        self._callbacks.append(callback)
+
+    def path(self, name, ext=MODU_EXT):
+        ''' retrieves the file path of a logged model (or its logs) '''
+        return os.path.join(self._logdir, name + ext)
+
+    def models(self):
+        ''' lists the logged models, sorted by name
+
+            returns a list of dicts with the 'name', file 'size' (bytes),
+            'mtime' (seconds since epoch) and whether it is 'loaded'
+        '''
+        loaded = set(name for name, _ in self._modus.keys())
+        models = []
+        for entry in os.scandir(self._logdir):
+            if not entry.is_file() or not entry.name.endswith(MODU_EXT):
+                continue
+            stat = entry.stat()
+            name = entry.name[:-len(MODU_EXT)]
+            models.append({
+                'name': name,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'loaded': name in loaded
+            })
+        return sorted(models, key=lambda model: model['name'])
+
+    def get(self, name):
+        ''' retrieves the topology of a model, loading it on first access
+
+            name  (str) : model name
+
+            raises KeyError if no such model is logged
+        '''
+        # names come from urls, so only files directly in logdir are served
+        if name != os.path.basename(name) or name.startswith('.'):
+            raise KeyError(name)
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            raise KeyError(name)
+
+        # replaced files are loaded afresh, and the stale topology is dropped
+        # (requests being served keep it until they are done)
+        key = (name, stat.st_mtime_ns)
+        stale = None
+        for cached in self._modus.keys():
+            if cached[0] == name and cached != key:
+                stale = self._modus.lookup(cached, stale)
+                self._modus.pop(cached)
+
+        modu, _ = self._modus.get(
+            key, lambda: (load_modu(self.path(name)), stat.st_size))
+        if stale is not None and stale[0].hash != modu.hash:
+            for callback in self._callbacks:
+                callback(stale[0], modu)
+        return modu
@@ -2,67 +2,415 @@
 # -*- coding: utf-8 -*-
 ''' contains blueprint routing for flask app '''
 
-from flask import Blueprint, jsonify
+import os
+import gzip
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, abort, current_app, request
 
-from visunn.plot import plot
+from visunn.topology import build_topology, module_tag, tag_module, \
+                            module_scope
+from visunn.activations import read_activations
+from visunn.snapshots import KINDS, read_snapshots
+from visunn.backend.cache import LRUCache
+from visunn.backend.binary import MIMETYPE, encode_topology
+from visunn.backend.watcher import ModuWatcher
+from visunn.constants import ACTIVATIONS_EXT, SNAPSHOTS_EXT
 
 __author__ = 'Vincent Liu'
 __email__ = 'vliu15@stanford.edu'
 
-__all__ = ['api']
+__all__ = ['api', 'registry_api']
 
+# optional brotli compression (pip install visunn[brotli])
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-def api(modu):
+# bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+# max number of modules per batch request, and max depth of subtrees
+MAX_BATCH_SIZE = 64
+MAX_SUBTREE_DEPTH = 2
+
+# content codings, in order of preference (with etag suffixes, since strong
+# etags must differ between codings of the same body)
+ENCODINGS = [('br', '-br'), ('gzip', '-gz')]
+
+
+def _dumps(value):
+    ''' serializes json the same way in every thread and process
+
+        flask.json only sorts keys within an app context, which threads of
+        batch renders and asyncio worker processes lack, and cached bodies
+        must not depend on which of them rendered a module (since their
+        etags do not)
+    '''
+    return json.dumps(value, sort_keys=True)
+
+
+class _Body(object):
+    ''' serialized body, precompressed once with every coding '''
+    __slots__ = ('etag', 'mimetype', 'codings')
+
+    def __init__(self, body, etag, mimetype='application/json'):
+        ''' compresses a body
+
+            body      (str, bytes) : serialized json (or binary)
+            etag      (str)        : entity tag of the body (without quotes)
+            mimetype  (str)        : content type of the body
+        '''
+        data = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.etag = etag
+        self.mimetype = mimetype
+        self.codings = {'identity': data}
+        if len(data) >= MIN_COMPRESS_SIZE:
+            self.codings['gzip'] = gzip.compress(data, compresslevel=6)
+            if brotli is not None:
+                self.codings['br'] = brotli.compress(
+                    data, mode=brotli.MODE_TEXT, quality=5)
+
+
+def _etag(*values):
+    ''' derives an entity tag from the values that version a body '''
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
+def _invalidate(cache, modu):
+    ''' discards the cached responses of a topology (by content hash) '''
+    for key in cache.keys():
+        if modu.hash in key:
+            cache.pop(key)
+
+
+def _json_response(body):
+    ''' wraps serialized json in a response '''
+    return current_app.response_class(body, mimetype='application/json')
+
+
+def _negotiate(body, accept_encodings, if_none_match):
+    ''' picks the coding of a body for a request, and whether it is stale
+
+        body              (_Body)  : precompressed body
+        accept_encodings  (Accept) : parsed Accept-Encoding of the request
+        if_none_match     (ETags)  : parsed If-None-Match of the request
+
+        returns the coding, its etag suffix, and whether the client already
+        has the body (under any coding)
+    '''
+    # [1] negotiate the content coding
+    # #########################################################################
+    coding, suffix = 'identity', ''
+    for candidate, candidate_suffix in ENCODINGS:
+        if candidate in body.codings and accept_encodings[candidate] > 0:
+            coding, suffix = candidate, candidate_suffix
+            break
+
+    # [2] match revalidations against any coding of the body
+    # #########################################################################
+    etags = [body.etag] + [body.etag + s for _, s in ENCODINGS]
+    fresh = any(if_none_match.contains_weak(etag) for etag in etags) or \
+        if_none_match.star_tag
+    return coding, suffix, fresh
+
+
+def _cached_response(body, max_age=None):
+    ''' responds with a precompressed body, or 304 if the client has it
+
+        body     (_Body) : precompressed body
+        max_age  (int)   : seconds clients may reuse the body for without
+                           revalidating (always revalidated if None)
+    '''
+    coding, suffix, fresh = _negotiate(body, request.accept_encodings,
+                                       request.if_none_match)
+    if fresh:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(
+            body.codings[coding], mimetype=body.mimetype)
+        if coding != 'identity':
+            response.content_encoding = coding
+
+    response.set_etag(body.etag + suffix)
+    response.vary.add('Accept-Encoding')
+    response.vary.add('Accept')
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
+
+def _render_view(modu, tag, layout, binary=False):
+    ''' serializes the precomputed view of a module, or builds it
+
+        binary  (bool) : whether to encode the view with encode_topology
+                         rather than as json
+    '''
+    view = modu.view(tag, layout)
+    if view is None:
+        view = build_topology(modu, tag, layout=layout)
+    if binary:
+        return _Body(encode_topology(view),
+                     _etag(modu.hash, layout, tag, MIMETYPE), MIMETYPE)
+    return _Body(_dumps(view), _etag(modu.hash, layout, tag))
+
+
+def _render_batch(modu, tags, layout, bodies):
+    ''' joins the serialized views of modules into one object by tag '''
+    return _Body(
+        b'{' + b','.join(_dumps(tag).encode('utf-8') + b':' +
+                         body.codings['identity']
+                         for tag, body in zip(tags, bodies)) + b'}',
+        _etag(modu.hash, layout, tags)
+    )
+
+
+def _render_activations(modu, tag, path):
+    ''' serializes the activation samples of a module (None if none) '''
+    scope = module_scope(modu, tag_module(modu, tag))
+    samples = read_activations(path, name=scope)
+    columns = samples.get(scope, None)
+    if columns is None:
+        return None
+    columns = {key: value.tolist() for key, value in columns.items()}
+    columns['bins'] = samples['bins']
+    return _Body(_dumps(columns),
+                 _etag(path, tag, os.path.getsize(path)))
+
+
+def _render_snapshots(modu, tag, path, start=None, end=None):
+    ''' serializes the param snapshots of a module in [start, end) steps
+        (None if none) '''
+    series = read_snapshots(path, module_scope(modu, tag_module(modu, tag)),
+                            start=start, end=end)
+    if series is None:
+        return None
+
+    series['step'] = series['step'].tolist()
+    for kind in KINDS:
+        series[kind] = {stat: column.tolist()
+                        for stat, column in series[kind].items()}
+    return _dumps(series)
+
+
+def _view(modu, tag, cache, layout, binary=False):
+    ''' retrieves the (cached) body of the view of a module '''
+    # bodies are keyed by module tag and topology content hash, and are
+    # immutable for a given topology
+    return cache.get((tag, modu.hash, binary),
+                     lambda: _render_view(modu, tag, layout, binary))
+
+
+def _topology(modu, tag, cache, layout, max_age):
+    ''' responds with the (cached) view of a module, as json or binary '''
+    # unknown tags are rejected before the (single-flight) build
+    if tag_module(modu, tag) not in modu.modules:
+        abort(404)
+    binary = request.accept_mimetypes.best_match(
+        ['application/json', MIMETYPE]) == MIMETYPE
+    return _cached_response(_view(modu, tag, cache, layout, binary), max_age)
+
+
+def _subtree_tags(modu, tag, depth):
+    ''' retrieves the tags of a module and of its submodules up to a depth '''
+    name = tag_module(modu, tag)
+    tags = [tag]
+    for sub_name in modu.modules:
+        if sub_name != name and sub_name.startswith(name) and \
+                sub_name[len(name):].count('/') <= depth:
+            tags.append(module_tag(modu, sub_name))
+    return tags
+
+
+def _batch(modu, tags, cache, layout, max_age, executor):
+    ''' responds with the (cached) views of several modules, as one object
+
+        modu      (Modu)               : modu object
+        tags      (list)               : module tags
+        cache     (LRUCache)           : cache of bodies
+        layout    (str)                : layout backend, 'layered' or 'dot'
+        max_age   (int)                : seconds clients may reuse the
+                                         response for without revalidating
+        executor  (ThreadPoolExecutor) : pool to build views with
+
+        views missing from the cache are built concurrently (layouts with
+        graphviz run in a subprocess, and compression releases the gil), and
+        the batch is joined from the serialized views of its modules
+    '''
+    tags = list(dict.fromkeys(tags))
+    if len(tags) == 0 or len(tags) > MAX_BATCH_SIZE:
+        abort(400)
+    if any(tag_module(modu, tag) not in modu.modules for tag in tags):
+        abort(404)
+
+    def _build():
+        ''' joins the bodies of the views of all modules '''
+        bodies = executor.map(
+            lambda tag: _view(modu, tag, cache, layout), tags)
+        return _render_batch(modu, tags, layout, bodies)
+
+    body = cache.get(('batch', tuple(tags), modu.hash), _build)
+    return _cached_response(body, max_age)
+
+
+def _subtree(modu, tag, cache, layout, max_age, executor):
+    ''' responds with the views of a module and its submodules, as one object
+
+        the depth of submodules (1 for children) is taken from the query
+    '''
+    depth = request.args.get('depth', 1, type=int)
+    if tag_module(modu, tag) not in modu.modules:
+        abort(404)
+    if depth < 0 or depth > MAX_SUBTREE_DEPTH:
+        abort(400)
+    return _batch(modu, _subtree_tags(modu, tag, depth), cache, layout,
+                  max_age, executor)
+
+
+def _activations(modu, tag, cache, path):
+    ''' responds with the (cached) activation samples of a module '''
+    if path is None or not os.path.exists(path):
+        abort(404)
+
+    # samples are only appended, so the file size versions the response (and
+    # clients revalidate, since more samples may be appended)
+    size = os.path.getsize(path)
+    body = cache.get(('activations', path, tag, size),
+                     lambda: _render_activations(modu, tag, path))
+    if body is None:
+        abort(404)
+
+    return _cached_response(body)
+
+
+def _snapshots(modu, tag, path):
+    ''' responds with the param snapshots of a module in a range of steps '''
+    if path is None or not os.path.exists(path):
+        abort(404)
+
+    # steps in [start, end), so that series can be fetched in pages
+    start = request.args.get('start', None, type=int)
+    end = request.args.get('end', None, type=int)
+    body = _render_snapshots(modu, tag, path, start=start, end=end)
+    if body is None:
+        abort(404)
+    return _json_response(body)
+
+
+def api(modu, cache_size=128, layout='layered', activations_path=None,
+        snapshots_path=None, max_age=86400, workers=None):
     ''' creates routing for the topology feature
 
-        modu  (Modu) : modu object
+        modu              (Modu, ModuWatcher) : modu object, or watcher that
+                                                hot reloads it
+        cache_size        (int)               : max number of module
+                                                responses to keep cached
+        layout            (str)               : layout backend, 'layered' or
+                                                'dot'
+        activations_path  (str)               : file path of activation
+                                                samples
+        snapshots_path    (str)               : file path of param snapshots
+        max_age           (int)               : seconds clients may reuse
+                                                module responses for without
+                                                revalidating (always
+                                                revalidated if None)
+        workers           (int)               : number of threads to build
+                                                the views of batches with
+                                                (defaults to number of cpus)
     '''
     blueprint = Blueprint('api', __name__)
+    cache = LRUCache(maxsize=cache_size)
+    executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+
+    # each request serves the topology current when it arrives, and swaps
+    # only discard responses of the replaced topology
+    watcher = modu if isinstance(modu, ModuWatcher) else None
+    if watcher is not None:
+        watcher.subscribe(lambda old, new: _invalidate(cache, old))
+
+    def _modu():
+        return watcher.modu if watcher is not None else modu
+
+    @blueprint.route('/batch', methods=['GET'])
+    def batch():
+        return _batch(_modu(), request.args.getlist('tag'), cache, layout,
+                      max_age, executor)
 
     @blueprint.route('/<tag>', methods=['GET'])
     def topology(tag):
-        # [1] format the get request that comes in
-        # #####################################################################
-        if tag == 'root':
-            module = modu.root
-        else:
-            module = tag.replace(';', '/') + '/'
-
-        # [2] retrieve metadata from modu
-        # #####################################################################
-        meta, inputs, outputs = modu.export(module)
-        # revise inputs/outputs for root module
-        if tag == 'root':
-            inputs, outputs = [], []
-            for name, node in meta.items():
-                if len(node['input']) == 0:
-                    inputs += [name]
-                if len(node['output']) == 0:
-                    outputs += [name]
-
-        # [3] accumulate edges between nodes
-        # #####################################################################
-        edges = {}
-        for name, node in meta.items():
-            if 'input' in list(node):
-                edges[name] = [
-                    in_name for in_name in node['input'] if in_name in meta
-                ]
-
-        # [4] use these edges to plot and retrieve coordinates
-        # #####################################################################
-        _, coords = plot(edges, normalize=True, truncate=False)
-
-        # [5] format and export as json
-        # #####################################################################
-        module = {
-            'meta': meta,
-            'coords': coords,
-            'edges': edges,
-            'inputs': inputs,
-            'outputs': outputs
-        }
-
-        return jsonify(module)
+        return _topology(_modu(), tag, cache, layout, max_age)
+
+    @blueprint.route('/<tag>/subtree', methods=['GET'])
+    def subtree(tag):
+        return _subtree(_modu(), tag, cache, layout, max_age, executor)
+
+    @blueprint.route('/<tag>/activations', methods=['GET'])
+    def activations(tag):
+        return _activations(_modu(), tag, cache, activations_path)
+
+    @blueprint.route('/<tag>/snapshots', methods=['GET'])
+    def snapshots(tag):
+        return _snapshots(_modu(), tag, snapshots_path)
+
+    return blueprint
+
+
+def registry_api(registry, cache_size=128, layout='layered', max_age=86400,
+                 workers=None):
+    ''' creates routing for the topologies of all models in a registry
+
+        registry    (Registry) : registry of logged models
+        cache_size  (int)      : max number of module responses to keep
+                                 cached (shared by all models)
+        layout      (str)      : layout backend, 'layered' or 'dot'
+        max_age     (int)      : seconds clients may reuse module responses
+                                 for without revalidating (always
+                                 revalidated if None)
+        workers     (int)      : number of threads to build the views of
+                                 batches with (defaults to number of cpus)
+    '''
+    blueprint = Blueprint('api', __name__)
+    cache = LRUCache(maxsize=cache_size)
+    executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+    registry.subscribe(lambda old, new: _invalidate(cache, old))
+
+    def _modu(model):
+        ''' retrieves the topology of a model, or responds with 404 '''
+        try:
+            return registry.get(model)
+        except KeyError:
+            abort(404)
+
+    @blueprint.route('/models', methods=['GET'])
+    def models():
+        return _json_response(_dumps(registry.models()))
+
+    @blueprint.route('/<model>/batch', methods=['GET'])
+    def batch(model):
+        return _batch(_modu(model), request.args.getlist('tag'), cache,
+                      layout, max_age, executor)
+
+    @blueprint.route('/<model>/<tag>', methods=['GET'])
+    def topology(model, tag):
+        return _topology(_modu(model), tag, cache, layout, max_age)
+
+    @blueprint.route('/<model>/<tag>/subtree', methods=['GET'])
+    def subtree(model, tag):
+        return _subtree(_modu(model), tag, cache, layout, max_age, executor)
+
+    @blueprint.route('/<model>/<tag>/activations', methods=['GET'])
+    def activations(model, tag):
+        return _activations(_modu(model), tag, cache,
+                            registry.path(model, ACTIVATIONS_EXT))
+
+    @blueprint.route('/<model>/<tag>/snapshots', methods=['GET'])
+    def snapshots(model, tag):
+        return _snapshots(_modu(model), tag,
+                          registry.path(model, SNAPSHOTS_EXT))
 
     return blueprint
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains watcher that hot reloads the topology of a logged model '''
+
+import os
+import time
+import threading
+
+from visunn.storage import load_modu
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['ModuWatcher']
+
+
+class ModuWatcher(object):
+    ''' holds the topology of a logged model, swapping in replaced files
+
+        the file is polled by stat from a daemon thread (so without extra
+        services), and since topology files are only ever replaced whole (see
+        save_modu), a changed file is always complete once it is seen
+
+        swaps only rebind the reference to the topology, so requests that are
+        being served keep the topology they started with, and the replaced
+        file stays mapped until they are done
+    '''
+    def __init__(self, path, interval=0.5):
+        ''' loads the topology of a file (polling starts on first access)
+
+            path      (str)   : file path of logged topology
+            interval  (float) : seconds between polls of the file
+        '''
+        self._path = path
+        self._interval = interval
+        self._callbacks = []
+        self._signature = self._stat()
+        self._modu = load_modu(path)
+        self._pid = None
+
+    @property
+    def path(self):
+        ''' retrieves file path of logged topology '''
+        return self._path
+
+    @property
+    def modu(self):
+        ''' retrieves the current topology
+
+            polling threads do not survive forks, so every process (e.g. each
+            pre-forked worker) starts its own on first access
+        '''
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, daemon=True).start()
+        return self._modu
+
+    def subscribe(self, callback):
+        ''' calls a function of the old and new topology on each swap that
+            changes the content hash '''
+        self._callbacks.append(callback)
+
+    def _stat(self):
+        ''' retrieves what changes when the file is replaced '''
+        stat = os.stat(self._path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _run(self):
+        ''' polls the file until the process exits '''
+        while True:
+            time.sleep(self._interval)
+            self.poll()
+
+    def poll(self):
+        ''' swaps in the file if it was replaced, returning whether it was '''
+        try:
+            signature = self._stat()
+        except FileNotFoundError:
+            return False
+        if signature == self._signature:
+            return False
+
+        # files written in place (e.g. by older versions) may not be
+        # complete yet, so they are retried on the next poll
+        try:
+            modu = load_modu(self._path)
+        except Exception:
+            return False
+
+        old, self._modu, self._signature = self._modu, modu, signature
+        if old.hash != modu.hash:
+            for callback in self._callbacks:
+                callback(old, modu)
+        return True
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains the topology build pipeline and its background runner '''
+
+import time
+import copy
+import pickle
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+
+import torch.multiprocessing as mp
+from torch.utils.tensorboard._pytorch_graph import graph
+
+from visunn.storage import save_modu
+from visunn.cache import architecture_hash
+from visunn.costmodel import estimate_costs
+from visunn.topology import precompute as precompute_views
+from visunn.profiler import profile_modules, rollup
+from visunn.util import proto_to_dict, process_nodes, process_modules, \
+                 build_modu
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['STAGES', 'build', 'submit']
+
+# stages of the build pipeline, in the order they are timed
+STAGES = ['cache', 'trace', 'proto_to_dict', 'process_nodes',
+          'process_modules', 'build_modu', 'estimate', 'profile', 'precompute',
+          'save']
+
+
+@contextmanager
+def _timed(timings, stage):
+    ''' records the wall time of a stage in seconds '''
+    start = time.perf_counter()
+    yield
+    timings[stage] = time.perf_counter() - start
+
+
+def build(model, inputs, params, save_path, precompute=True, processes=None,
+          compact=True, profile=False, profile_backward=False, cache=None,
+          cache_key=None):
+    ''' builds the modular topology of a model and saves it, unless cached
+
+        model             (torch.nn.Module) : pytorch model
+        inputs            (torch.Tensor)    : batch of inputs to trace with
+        params            (list)            : names of model parameters
+        save_path         (str)             : file path to save topology to
+        precompute        (bool)            : whether to precompute module
+                                              views
+        processes         (int)             : number of processes to
+                                              precompute views with
+        compact           (bool)            : whether to store the topology
+                                              as a CompactModu
+        profile           (bool)            : whether to measure latency and
+                                              memory of modules (on cpu)
+        profile_backward  (bool)            : whether to also measure
+                                              backward passes
+        cache             (TopologyCache)   : cache of topologies to reuse
+                                              and store the topology in
+        cache_key         (str)             : architecture hash of the model
+                                              (computed if not specified)
+
+        returns a mapping of stage (see STAGES) to wall time in seconds, where
+        stages after 'cache' are missing if the topology was cached
+    '''
+    timings = {}
+
+    # [0] reuse the topology of an unchanged architecture
+    # #########################################################################
+    # measured profiles differ from run to run, so they are never cached
+    # #########################################################################
+    with _timed(timings, 'cache'):
+        if cache is not None and not profile:
+            cache_key = cache_key or architecture_hash(
+                model, inputs, precompute=precompute, compact=compact)
+            if cache.fetch(cache_key, save_path):
+                return timings
+        else:
+            cache = None
+
+    # [1] use pytorch functionality to port to graphdef proto
+    # #########################################################################
+    # `graph` function:
+    #   https://github.com/pytorch/...
+    #       pytorch/blob/master/torch/utils/tensorboard/_pytorch_graph.py
+    #
+    # `GraphDef` protobuf:
+    #   https://github.com/tensorflow/...
+    #       tensorflow/blob/master/tensorflow/core/framework/graph.proto
+    #   from tensorboard.compat.proto.graph_pb2 import GraphDef
+    #   fields: ['node', 'versions', 'version' (deprecated), 'library']
+    #
+    # NOTE: see note on recycled layers in README.md
+    # #########################################################################
+    with _timed(timings, 'trace'):
+        graphdef, _ = graph(model, inputs)
+
+    # [2] convert and parse graphdef proto to dict format
+    # #########################################################################
+    # this maps the name of a node to its relevant contents, saving space
+    # and improving accessibility for downstream processing
+    #
+    # `NodeDef` protobuf:
+    #   https://github.com/tensorflow/...
+    #       tensorflow/blob/master/tensorflow/core/framework/node_def.proto
+    #   from tensorboard.compat.proto.node_def_pb2 import NodeDef
+    #   fields: ['name', 'op', 'input', 'device', 'attr']
+    # #########################################################################
+    with _timed(timings, 'proto_to_dict'):
+        graphdict = proto_to_dict(graphdef)
+
+    # [3] use bfs to prune nodes of op type 'prim'
+    # #########################################################################
+    # tensor basics:
+    #   https://pytorch.org/cppdocs/notes/tensor_basics.html
+    #
+    # only want to keep meaningful operations (that are directly relevant
+    # to manipulating the input tensor), which is why all operations of
+    # type 'prim' (non-tensor operations) are discarded
+    # #########################################################################
+    with _timed(timings, 'process_nodes'):
+        graphdict = process_nodes(graphdict)
+
+    # [4] prune irrelevant modules that don't contribute to the hierarchy
+    # #########################################################################
+    # some modules only contain one submodule or one node, and such modules
+    # are uninteresting and only complicate the hierarchical structure of
+    # topology, all such modules are collapsed
+    # #########################################################################
+    with _timed(timings, 'process_modules'):
+        graphdict = process_modules(graphdict)
+
+    # [5] modularize pruned graph topology as a filesystem
+    # #########################################################################
+    # want to retain the modularity of the topology so that it will be
+    # easy to interact with and represent as a web app
+    # #########################################################################
+    with _timed(timings, 'build_modu'):
+        modu = build_modu(graphdict, params=params, compact=compact)
+
+    # [6] estimate the compute and memory traffic of all nodes and modules
+    # #########################################################################
+    # costs are derived analytically from ops and shapes, so the model is not
+    # run, and elements are assumed to be the size of those of the params
+    # #########################################################################
+    with _timed(timings, 'estimate'):
+        weights = list(model.parameters())
+        modu.add_estimates(estimate_costs(
+            graphdict,
+            {name: tuple(param.shape)
+             for name, param in model.named_parameters()},
+            bytes_per_element=weights[0].element_size() if weights else 4
+        ))
+
+    # [7] measure the costs of all modules
+    # #########################################################################
+    # a copy of the model is run on cpu, so that profiling never touches the
+    # (possibly shared) params, buffers or grads of the model being trained
+    # #########################################################################
+    with _timed(timings, 'profile'):
+        if profile:
+            costs = profile_modules(copy.deepcopy(model).cpu(), inputs.cpu(),
+                                    backward=profile_backward)
+            modu.add_costs(rollup(modu, costs))
+
+    # [8] precompute the views of all modules
+    # #########################################################################
+    # exporting, linking and laying out each module is done up front with
+    # a process pool, so the web app only has to look up each view
+    # #########################################################################
+    with _timed(timings, 'precompute'):
+        if precompute:
+            modu.add_views(precompute_views(modu, processes=processes))
+
+    # [9] log it for later access
+    # #########################################################################
+    # module records are laid out so the web app can map them lazily
+    # #########################################################################
+    with _timed(timings, 'save'):
+        save_modu(modu, save_path)
+        if cache is not None:
+            cache.store(cache_key, save_path)
+
+    return timings
+
+
+def _build_pickled(payload):
+    ''' runs build on arguments pickled by submit '''
+    model, inputs, params, save_path, kwargs = pickle.loads(payload)
+    return build(model, inputs, params, save_path, **kwargs)
+
+
+def submit(model, inputs, params, save_path, background=True, **kwargs):
+    ''' runs build, in a spawned process if background
+
+        model       (torch.nn.Module) : pytorch model
+        inputs      (torch.Tensor)    : batch of inputs to trace with
+        params      (list)            : names of model parameters
+        save_path   (str)             : file path to save topology to
+        background  (bool)            : whether to build in a spawned process
+        kwargs      (dict)            : keyword arguments passed to build
+
+        returns a future of the stage timings, which holds any exception
+        raised by the build (or by the worker dying)
+    '''
+    # [0] reuse a cached topology without building (or spawning) at all
+    # #########################################################################
+    # the architecture hash is taken here, since the sources of classes
+    # defined in a script are not found under the same module when spawned
+    # #########################################################################
+    cache = kwargs.get('cache', None)
+    if background and cache is not None and not kwargs.get('profile', False):
+        timings = {}
+        with _timed(timings, 'cache'):
+            kwargs['cache_key'] = architecture_hash(
+                model, inputs, precompute=kwargs.get('precompute', True),
+                compact=kwargs.get('compact', True))
+            hit = cache.fetch(kwargs['cache_key'], save_path)
+        if hit:
+            future = Future()
+            future.set_result(timings)
+            return future
+
+    # [1] build in this process, blocking until done
+    # #########################################################################
+    if not background:
+        future = Future()
+        try:
+            future.set_result(build(model, inputs, params, save_path,
+                                    **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    # [2] build in a spawned process
+    # #########################################################################
+    # spawning (rather than forking) never copies cuda state or the threads
+    # of dataloader workers into the builder, and tracing (which switches
+    # the model to eval mode) runs on the builder's copy of the model
+    #
+    # arguments are pickled here rather than in the executor's feeder thread,
+    # so pickling never races with training or with hooks registered on the
+    # model afterwards. the standard pickler copies tensor data into the
+    # payload, whereas the executor's would move the tensors of the model and
+    # inputs being trained to shared memory for good
+    # #########################################################################
+    payload = pickle.dumps((model, inputs, params, save_path, kwargs),
+                           protocol=pickle.HIGHEST_PROTOCOL)
+
+    executor = ProcessPoolExecutor(max_workers=1,
+                                   mp_context=mp.get_context('spawn'))
+    future = executor.submit(_build_pickled, payload)
+    # the worker exits once the build is done
+    executor.shutdown(wait=False)
+    return future
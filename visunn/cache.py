@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains content-addressed cache of built topologies
+
+    topologies are keyed by a hash of everything that determines the build:
+    the module hierarchy (types, hyperparameters and class code), param
+    and buffer shapes and dtypes, input shapes and dtypes, the torch version
+    and the build options, so that an unchanged model is never re-traced
+'''
+
+import os
+import types
+import shutil
+import hashlib
+
+import torch
+from torch import nn
+
+from visunn.storage import FORMAT_VERSION
+from visunn.constants import MODU_EXT
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['TopologyCache', 'architecture_hash']
+
+# bumped whenever the build pipeline changes what it writes
+CACHE_VERSION = 1
+
+# extension of the (empty) files whose mtimes order entries by last use
+STAMP_EXT = '.used'
+
+
+def _hash_code(sha, code):
+    ''' hashes the bytecode of a code object (and of nested code objects) '''
+    sha.update(code.co_code)
+    sha.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(sha, const)
+        elif isinstance(const, frozenset):
+            # iteration order of sets varies with string hash randomization
+            sha.update(repr(sorted(const, key=repr)).encode())
+        else:
+            sha.update(repr(const).encode())
+
+
+def _hash_class(sha, cls):
+    ''' hashes the methods of a module class and of its bases
+
+        bytecode is hashed rather than source, which would need every source
+        file to be parsed, and is unaffected by line numbers and comments
+    '''
+    for base in cls.__mro__:
+        if base is nn.Module or base is object:
+            continue
+        sha.update((base.__module__ + '.' + base.__qualname__).encode())
+        for name, attr in sorted(vars(base).items()):
+            func = getattr(attr, '__func__', attr)
+            if isinstance(func, types.FunctionType):
+                sha.update(name.encode())
+                _hash_code(sha, func.__code__)
+
+
+def _tensor_specs(value):
+    ''' retrieves the shapes and dtypes of (nested) tensor inputs '''
+    if torch.is_tensor(value):
+        return [(tuple(value.shape), str(value.dtype))]
+    if isinstance(value, (list, tuple)):
+        return [spec for item in value for spec in _tensor_specs(item)]
+    return [repr(value)]
+
+
+def architecture_hash(model, inputs, **options):
+    ''' hashes everything that determines the topology built from a model
+
+        model    (torch.nn.Module) : pytorch model
+        inputs   (torch.Tensor)    : batch of inputs to trace with
+        options  (dict)            : build options that change the output
+
+        returns a hex string, where the code of module classes stands in for
+        their forward passes (changes to functions they call are not
+        detected)
+    '''
+    sha = hashlib.sha1()
+    sha.update(repr((CACHE_VERSION, FORMAT_VERSION, torch.__version__,
+                     sorted(options.items()))).encode())
+
+    # [1] hash the module hierarchy, with hyperparameters of each module
+    # #########################################################################
+    classes = {}
+    for path, module in model.named_modules():
+        cls = type(module)
+        classes[cls.__module__ + '.' + cls.__qualname__] = cls
+        sha.update(repr((path, cls.__module__, cls.__qualname__,
+                         module.extra_repr())).encode())
+    for name in sorted(classes):
+        _hash_class(sha, classes[name])
+
+    # [2] hash params, buffers and inputs by shape and dtype
+    # #########################################################################
+    for name, param in model.named_parameters():
+        sha.update(repr((name, tuple(param.shape), str(param.dtype))).encode())
+    for name, buffer in model.named_buffers():
+        sha.update(repr((name, tuple(buffer.shape),
+                         str(buffer.dtype))).encode())
+    sha.update(repr(_tensor_specs(inputs)).encode())
+
+    return sha.hexdigest()
+
+
+class TopologyCache(object):
+    ''' directory of topology files named by architecture hash
+
+        entries are hard-linked into and out of the cache where possible
+        (and copied otherwise), which is safe since topology files are only
+        ever replaced (see save_modu) rather than written in place, and the
+        least recently used entries are evicted beyond the size limits
+
+        uses are recorded on a stamp file next to each entry, since touching
+        the entry would also touch the logged topology it is linked to, which
+        servers would then reload as replaced
+    '''
+    def __init__(self, directory, max_entries=32, max_bytes=1 << 30):
+        ''' initializes the cache (the directory is created on first store)
+
+            directory    (str) : folder of cached topologies
+            max_entries  (int) : number of topologies to keep
+            max_bytes    (int) : total size of topologies to keep
+        '''
+        self._directory = directory
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+
+    @property
+    def directory(self):
+        ''' retrieves folder of cached topologies '''
+        return self._directory
+
+    def _entry(self, key):
+        ''' retrieves the file path of a cache entry '''
+        return os.path.join(self._directory, key + MODU_EXT)
+
+    def _touch(self, key):
+        ''' marks a cache entry as recently used '''
+        stamp = self._entry(key) + STAMP_EXT
+        with open(stamp, 'a'):
+            pass
+        os.utime(stamp)
+
+    @staticmethod
+    def _place(src, dst):
+        ''' hard links (or copies) a file over another, atomically '''
+        # renaming a link over another link of the same file does nothing
+        # (and would leave the temp link behind)
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return
+        tmp = '{}.{}.tmp'.format(dst, os.getpid())
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            # e.g. across filesystems, or on filesystems without hard links
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+    def fetch(self, key, path):
+        ''' places the cached topology of a key at a path, if cached
+
+            key   (str) : architecture hash
+            path  (str) : file path to place topology at
+
+            returns whether the key was cached
+        '''
+        entry = self._entry(key)
+        try:
+            self._place(entry, path)
+        except FileNotFoundError:
+            return False
+        self._touch(key)
+        return True
+
+    def store(self, key, path):
+        ''' caches the topology at a path under a key, then evicts
+
+            key   (str) : architecture hash
+            path  (str) : file path of topology to cache
+        '''
+        os.makedirs(self._directory, exist_ok=True)
+        self._place(path, self._entry(key))
+        self._touch(key)
+        self.evict()
+
+    def evict(self):
+        ''' removes least recently used entries beyond the size limits '''
+        entries = []
+        for filename in os.listdir(self._directory):
+            if not filename.endswith(MODU_EXT):
+                continue
+            path = os.path.join(self._directory, filename)
+            try:
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                continue
+            try:
+                used = os.stat(path + STAMP_EXT).st_mtime
+            except FileNotFoundError:
+                used = 0.0
+            entries.append((used, size, filename))
+
+        # newest first, so everything past the limits is evicted (but the
+        # newest entry is always kept)
+        entries.sort(reverse=True)
+        total = 0
+        for idx, (_, size, filename) in enumerate(entries):
+            total += size
+            if idx >= max(self._max_entries, 1) or \
+                    (idx > 0 and total > self._max_bytes):
+                path = os.path.join(self._directory, filename)
+                for evicted in [path, path + STAMP_EXT]:
+                    try:
+                        os.remove(evicted)
+                    except FileNotFoundError:
+                        pass
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains compact, integer-indexed modu for large topologies '''
+
+from array import array
+from collections.abc import Mapping
+import numpy as np
+
+from visunn.constants import MODU_ROOT
+from visunn.modu import Modu, _Node
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['CompactModu', 'CompactBuilder']
+
+# module fields, and which of them hold shapes (rather than names)
+MODULE_KEYS = ['modules', 'op_nodes', 'in_nodes', 'in_shapes', 'out_nodes',
+               'out_shapes', 'params']
+SHAPE_KEYS = ['in_shapes', 'out_shapes', 'input_shapes', 'output_shapes']
+
+# node fields stored as adjacency (names or shapes)
+NODE_KEYS = ['input', 'output', 'input_shapes', 'output_shapes']
+
+
+class _CSR(object):
+    ''' compressed sparse rows of integer ids '''
+    __slots__ = ('indptr', 'indices')
+
+    def __init__(self, rows):
+        self.indptr = array('I', [0])
+        self.indices = array('I')
+        for row in rows:
+            self.indices.extend(row)
+            self.indptr.append(len(self.indices))
+
+    @classmethod
+    def from_arrays(cls, indptr, indices):
+        ''' wraps (numpy) row offsets and ids without copying row by row '''
+        csr = cls.__new__(cls)
+        csr.indptr = array('I', np.asarray(indptr, np.uint32).tobytes())
+        csr.indices = array('I', np.asarray(indices, np.uint32).tobytes())
+        return csr
+
+    def __getstate__(self):
+        return (self.indptr, self.indices)
+
+    def __setstate__(self, state):
+        self.indptr, self.indices = state
+
+
+class _ModuleTable(Mapping):
+    ''' read-only mapping of module name to (decoded) module dict '''
+    __slots__ = ('_modu',)
+
+    def __init__(self, modu):
+        self._modu = modu
+
+    def __getitem__(self, name):
+        return self._modu._decode_module(name)
+
+    def __contains__(self, name):
+        return name in self._modu._module_index or \
+            name in self._modu._overflow
+
+    def __iter__(self):
+        for name in self._modu._module_index:
+            yield name
+        for name in self._modu._overflow:
+            if name not in self._modu._module_index:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class _Module(Mapping):
+    ''' read-only module dict, decoding each field on first access '''
+    __slots__ = ('_modu', '_name', '_fields')
+
+    def __init__(self, modu, name):
+        self._modu = modu
+        self._name = name
+        self._fields = {}
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            if key not in self._modu._module_columns:
+                raise KeyError(key)
+            self._fields[key] = self._modu._decode_field(self._name, key)
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(MODULE_KEYS)
+
+    def __len__(self):
+        return len(MODULE_KEYS)
+
+
+class _NodeTable(Mapping):
+    ''' read-only mapping of node name to (decoded) node dict or record '''
+    __slots__ = ('_modu', '_as_record')
+
+    def __init__(self, modu, as_record=False):
+        self._modu = modu
+        self._as_record = as_record
+
+    def __getitem__(self, name):
+        return self._modu._decode_node(name, self._as_record)
+
+    def __contains__(self, name):
+        return name in self._modu._node_index
+
+    def __iter__(self):
+        return iter(self._modu._node_index)
+
+    def __len__(self):
+        return len(self._modu._node_index)
+
+
+class CompactBuilder(object):
+    ''' accumulates the modules of a topology as interned ids
+
+        exposes the update api of modu that build_modu fills, so that the
+        ids of each module field are appended as (module, value) pairs to
+        flat arrays, rather than added to a set per module, and only turned
+        into csr rows once all modules are known
+    '''
+    def __init__(self, graphdict, root=MODU_ROOT):
+        ''' starts an empty topology with the root module
+
+            graphdict  (dict) : mapping of node name to nodedict
+            root       (str)  : name of root module
+        '''
+        self._graphdict = graphdict
+        self._root = root
+
+        # node names are interned as their index in graphdict, so that only
+        # other strings (ops, module names, params) need their own ids
+        self._node_index = {name: idx for idx, name in enumerate(graphdict)}
+        self._strings, self._string_ids = list(graphdict), {}
+        self._shapes, self._shape_ids = [], {}
+        self._module_index = {}
+        self._pairs = {key: array('Q') for key in MODULE_KEYS}
+
+        # every node repeats the submodules and params of all its ancestors,
+        # so those (few) pairs are deduplicated as they come
+        self._seen = {'modules': set(), 'params': set()}
+        self.add(root)
+
+    @property
+    def root(self):
+        ''' retrieves root module of modular topology '''
+        return self._root
+
+    def _intern(self, value, shape=False):
+        ''' retrieves the id of a name (or shape), interning it if new '''
+        if shape:
+            table, ids = self._shapes, self._shape_ids
+        else:
+            idx = self._node_index.get(value, None)
+            if idx is not None:
+                return idx
+            table, ids = self._strings, self._string_ids
+        idx = ids.get(value, None)
+        if idx is None:
+            idx = ids[value] = len(table)
+            table.append(value)
+        return idx
+
+    def add(self, name):
+        ''' initializes a new module '''
+        if name not in self._module_index:
+            self._module_index[name] = len(self._module_index)
+
+    def update(self, name, key, value):
+        ''' updates the field of a module (adding it if new) '''
+        row = self._module_index.get(name, None)
+        if row is None:
+            row = self._module_index[name] = len(self._module_index)
+        # op nodes are stored by the id of their full name (rather than as
+        # new relative names), see CompactModu._decode_field
+        if key == 'op_nodes':
+            value = name + value
+        pair = row << 32 | self._intern(value, key in SHAPE_KEYS)
+        if key in self._seen:
+            if pair in self._seen[key]:
+                return
+            self._seen[key].add(pair)
+        self._pairs[key].append(pair)
+
+    def _rows(self, key):
+        ''' sorts and deduplicates the pairs of a field into csr rows '''
+        pairs = np.unique(np.frombuffer(self._pairs.pop(key), np.uint64))
+        counts = np.bincount((pairs >> np.uint64(32)).astype(np.intp),
+                             minlength=len(self._module_index))
+        return _CSR.from_arrays(
+            np.concatenate([[0], np.cumsum(counts)]),
+            pairs & np.uint64(0xffffffff))
+
+    def build(self, modu=None):
+        ''' converts the accumulated modules into a compact modu
+
+            modu  (CompactModu) : instance to fill (a new one if None)
+        '''
+        if modu is None:
+            modu = CompactModu.__new__(CompactModu)
+        modu._root = self._root
+        modu._hash = None
+        modu._links = None
+        modu._views = {}
+        modu._costs = {}
+        modu._estimates = {}
+
+        # [1] intern nodes and store their links as csr rows
+        # #####################################################################
+        graphdict = self._graphdict
+        modu._node_index = self._node_index
+        modu._node_ops = array('I', (
+            self._intern(node['op']) for node in graphdict.values()))
+        modu._node_fields = {}
+        for key in NODE_KEYS:
+            shape = key in SHAPE_KEYS
+            modu._node_fields[key] = _CSR(
+                [self._intern(value, shape) for value in node[key]]
+                for node in graphdict.values())
+
+        # [2] store module contents as csr rows
+        # #####################################################################
+        modu._module_index = self._module_index
+        modu._module_fields = {key: self._rows(key) for key in MODULE_KEYS}
+
+        modu._strings = self._strings
+        modu._shapes = self._shapes
+        modu._overflow = {}
+        modu._cleared = set()
+        modu._init_tables()
+        return modu
+
+
+class CompactModu(Modu):
+    ''' modu that stores its topology as interned ids and csr arrays
+
+        all node and module names (and ops, params) are interned into one
+        string table and all shapes into one shape table, so that node links
+        and module contents are stored as arrays of integer ids rather than
+        sets and lists of full path strings
+
+        exposes the same api as modu, where updates after compaction are kept
+        in (small) python sets that are merged in when decoding
+    '''
+    def __init__(self, modu):
+        ''' compacts an existing modu (build_modu builds compact modus
+            directly, see CompactBuilder)
+
+            modu  (Modu) : modu object
+        '''
+        builder = CompactBuilder(modu._graphdict, root=modu.root)
+        for name, module in modu._modules.items():
+            builder.add(name)
+            for key in MODULE_KEYS:
+                for value in module[key]:
+                    builder.update(name, key, value)
+        builder.build(self)
+
+        self._views = getattr(modu, '_views', {})
+        self._costs = modu.costs
+        self._estimates = modu.estimates
+
+    def _init_tables(self):
+        ''' wraps compact storage in the mappings modu expects '''
+        self._modules = _ModuleTable(self)
+        self._graphdict = _NodeTable(self)
+        self._records = _NodeTable(self, as_record=True)
+
+        # fields are decoded for every node and module of every export, so
+        # their csr arrays and tables are looked up once
+        self._node_columns = [
+            (self._node_fields[key].indptr, self._node_fields[key].indices,
+             self._shapes if key in SHAPE_KEYS else self._strings)
+            for key in NODE_KEYS
+        ]
+        self._module_columns = {
+            key: (self._module_fields[key].indptr,
+                  self._module_fields[key].indices,
+                  self._shapes if key in SHAPE_KEYS else self._strings)
+            for key in MODULE_KEYS
+        }
+
+        # older pickles predate resets of compacted modules
+        if getattr(self, '_cleared', None) is None:
+            self._cleared = set()
+
+    def _decode_module(self, name):
+        ''' decodes a module (merging any updates after compaction) '''
+        if name not in self._module_index and name not in self._overflow:
+            raise KeyError(name)
+        return _Module(self, name)
+
+    def _decode_field(self, name, key):
+        ''' decodes one field of a module as a set '''
+        idx = self._module_index.get(name, None)
+        if idx is None or name in self._cleared:
+            values = set()
+        else:
+            indptr, indices, table = self._module_columns[key]
+            ids = indices[indptr[idx]:indptr[idx+1]]
+            if key == 'op_nodes':
+                start = len(name)
+                values = {table[node_id][start:] for node_id in ids}
+            else:
+                values = {table[value_id] for value_id in ids}
+        if name in self._overflow:
+            values.update(self._overflow[name][key])
+        return values
+
+    def _decode_node(self, name, as_record=False):
+        ''' decodes a node dict, or an immutable node record '''
+        idx = self._node_index[name]
+        op = self._strings[self._node_ops[idx]]
+
+        # most rows hold at most one id, so those skip slicing
+        fields = []
+        for indptr, indices, table in self._node_columns:
+            start, end = indptr[idx], indptr[idx+1]
+            if end - start == 1:
+                fields.append((table[indices[start]],))
+            elif end == start:
+                fields.append(())
+            else:
+                fields.append(tuple([table[i] for i in indices[start:end]]))
+
+        if as_record:
+            return _Node(name, op, *fields)
+        return dict(name=name, op=op,
+                    **{key: list(field) for key, field in zip(NODE_KEYS,
+                                                             fields)})
+
+    def _get_records(self):
+        ''' retrieves immutable node records, decoded on access '''
+        return self._records
+
+    def add(self, name):
+        ''' initializes a new module (emptying it, if it exists) '''
+        self._overflow[name] = {key: set() for key in MODULE_KEYS}
+        if name in self._module_index:
+            self._cleared.add(name)
+        self._hash = None
+
+    def update(self, name, key, value):
+        ''' updates the field of an existing module '''
+        if name not in self._overflow:
+            self._overflow[name] = {key: set() for key in MODULE_KEYS}
+        self._overflow[name][key].add(value)
+        self._hash = None
+        self._links = None
+
+    def __getstate__(self):
+        ''' excludes decoding mappings and link memos from pickles '''
+        state = self.__dict__.copy()
+        for key in ['_modules', '_graphdict', '_records', '_links',
+                    '_node_columns', '_module_columns']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._links = None
+        self._init_tables()
@@ -6,7 +6,8 @@ __author__ = 'Vincent Liu'
 __email__ = 'vliu15@stanford.edu'
 
 __all__ = ['DATA_DIR',
-           'LOG_DIR', 'MODU_EXT',
+           'LOG_DIR', 'MODU_EXT', 'METRICS_EXT', 'ACTIVATIONS_EXT',
+           'SNAPSHOTS_EXT', 'CACHE_DIR',
            'MODU_ROOT']
 
 # train config
@@ -15,6 +16,10 @@ DATA_DIR = 'data'
 # visu config
 LOG_DIR = 'logs'
 MODU_EXT = '.pt'
+METRICS_EXT = '.metrics'
+ACTIVATIONS_EXT = '.activations'
+SNAPSHOTS_EXT = '.snapshots'
+CACHE_DIR = '.cache'
 
 # modu config
 MODU_ROOT = ''
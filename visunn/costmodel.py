@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains analytic per-node and per-module compute and memory estimates
+
+    estimates are derived from the ops and shapes of the traced topology
+    (and the shapes of the params), so the model is never run:
+
+        flops   : floating point operations of a forward pass
+        macs    : multiply-accumulates of a forward pass (a mac is 2 flops)
+        bytes   : bytes read and written by a forward pass, i.e. all tensor
+                  inputs, params and outputs of an op, assuming no fusion
+        params  : number of parameter elements
+
+    op attributes (e.g. kernel sizes of pooling) are not kept in the
+    topology, so ops whose cost depends on them are estimated from their
+    input and output shapes alone
+'''
+
+import re
+from functools import reduce
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['ESTIMATES', 'estimate_costs']
+
+ESTIMATES = ['flops', 'macs', 'bytes', 'params']
+
+# ops that only change the view of a tensor (or are identities at inference),
+# so that they neither compute nor move data
+VIEW_OPS = {
+    'view', 'reshape', 'flatten', 'transpose', 't', 'permute', 'squeeze',
+    'unsqueeze', 'expand', 'expand_as', 'chunk', 'split', 'unbind', 'select',
+    'slice', 'narrow', 'size', 'Int', 'detach', 'dropout', 'feature_dropout',
+    'alpha_dropout', 'feature_alpha_dropout', 'numpy_T'
+}
+
+# ops with one flop per output element
+ELEMENTWISE_OPS = {
+    'relu', 'relu6', 'hardtanh', 'leaky_relu', 'elu', 'selu', 'celu', 'gelu',
+    'silu', 'mish', 'sigmoid', 'hardsigmoid', 'hardswish', 'tanh', 'softplus',
+    'threshold', 'clamp', 'clamp_min', 'clamp_max', 'abs', 'neg', 'exp',
+    'log', 'sqrt', 'rsqrt', 'reciprocal', 'pow', 'add', 'sub', 'rsub', 'mul',
+    'div', 'floor_divide', 'remainder', 'maximum', 'minimum', 'where',
+    'masked_fill', 'upsample_nearest1d', 'upsample_nearest2d',
+    'upsample_nearest3d'
+}
+
+# ops that reduce (or pool) each input element with one flop
+REDUCTION_OPS = {
+    'sum', 'mean', 'amax', 'amin', 'max', 'min', 'norm', 'max_pool1d',
+    'max_pool2d', 'max_pool3d', 'avg_pool1d', 'avg_pool2d', 'avg_pool3d',
+    'adaptive_avg_pool1d', 'adaptive_avg_pool2d', 'adaptive_avg_pool3d',
+    'adaptive_max_pool1d', 'adaptive_max_pool2d', 'adaptive_max_pool3d'
+}
+
+# normalizations that compute statistics (mean, variance, normalize, then
+# scale and shift) rather than folding into one multiply-add per element
+STATISTIC_NORM_OPS = {'layer_norm', 'group_norm', 'instance_norm'}
+
+
+def _numel(shape):
+    ''' retrieves the number of elements of a shape (0 if unknown) '''
+    if shape is None:
+        return 0
+    return reduce(lambda a, b: a * b, shape, 1)
+
+
+def _param_name(name):
+    ''' maps a param node name to its model parameter name
+
+        e.g. 'ResNet/Sequential[layer1]/BasicBlock[0]/Conv2d[conv1]/weight'
+        is 'layer1.0.conv1.weight'
+    '''
+    attr = re.split(r'[/)]', name)[-1]
+    return '.'.join(re.findall(r'\[(.*?)\]', name) + [attr])
+
+
+def _conv(operands, output, weights):
+    ''' retrieves macs and extra (bias) flops of a (transposed) convolution '''
+    if len(weights) == 0:
+        return 0, 0
+    # inputs may have unknown shapes (e.g. outputs of chunk)
+    x = operands[0] if len(operands) > 0 else None
+    weight = weights[0]
+    bias = _numel(output) if len(weights) > 1 else 0
+
+    # transposed convolutions upsample, and their weights are laid out as
+    # (in_channels, out_channels / groups, *kernel)
+    if x is not None and len(x) == len(output) and len(x) > 2 and \
+            _numel(output[2:]) > _numel(x[2:]) and weight[0] == x[1]:
+        return _numel(x) * _numel(weight[1:]), bias
+    return _numel(output) * _numel(weight[1:]), bias
+
+
+def _matmul(op, operands, output, weights):
+    ''' retrieves macs and extra (bias) flops of a matrix multiplication '''
+    if op == 'linear':
+        if len(weights) == 0:
+            return 0, 0
+        bias = _numel(output) if len(weights) > 1 else 0
+        return _numel(output) * weights[0][-1], bias
+
+    # addmm and baddbmm take (bias, mat1, mat2), others take (mat1, mat2)
+    bias = 0
+    if op in ('addmm', 'addmv', 'baddbmm'):
+        bias, operands = _numel(output), operands[1:]
+    if len(operands) == 0 or operands[0] is None or len(operands[0]) == 0:
+        return 0, 0
+    return _numel(output) * operands[0][-1], bias
+
+
+def _estimate_node(node, graphdict, param_shapes, bytes_per_element):
+    ''' estimates the costs of one op node (see ESTIMATES) '''
+    cost = {estimate: 0 for estimate in ESTIMATES}
+    op = node['op'].split('::')[-1]
+
+    # param nodes only hold params, and other non-aten nodes (e.g. inputs)
+    # do not compute anything
+    if node['op'] == 'visu::param':
+        cost['params'] = _numel(param_shapes.get(_param_name(node['name'])))
+        return cost
+    if not node['op'].startswith('aten::') or op in VIEW_OPS:
+        return cost
+
+    # [1] gather shapes of tensor inputs (in order) and of params
+    # #########################################################################
+    operands, weights = [], []
+    for in_name in node['input']:
+        in_node = graphdict[in_name]
+        if in_node['op'] == 'visu::param':
+            shape = param_shapes.get(_param_name(in_name))
+            if shape is not None:
+                weights.append(shape)
+        else:
+            shapes = in_node['output_shapes']
+            operands.append(shapes[0] if len(shapes) > 0 else None)
+
+    output = node['output_shapes'][0] \
+        if len(node['output_shapes']) > 0 else None
+    n_in = sum(_numel(shape) for shape in operands)
+    n_out = sum(_numel(shape) for shape in node['output_shapes'])
+    n_params = sum(_numel(shape) for shape in weights)
+
+    # [2] estimate compute by kind of op (in-place variants end with '_')
+    # #########################################################################
+    op = op.rstrip('_')
+    macs, flops = 0, 0
+    if output is None:
+        pass
+    elif op in ('_convolution', 'convolution', 'conv1d', 'conv2d', 'conv3d',
+                'conv_transpose1d', 'conv_transpose2d', 'conv_transpose3d'):
+        macs, flops = _conv(operands, output, weights)
+        flops += 2 * macs
+    elif op in ('linear', 'addmm', 'addmv', 'baddbmm', 'matmul', 'mm', 'mv',
+                'bmm'):
+        macs, flops = _matmul(op, operands, output, weights)
+        flops += 2 * macs
+    elif op == 'batch_norm':
+        # folds into one multiply-add per element at inference
+        macs, flops = n_out, 2 * n_out
+    elif op in STATISTIC_NORM_OPS:
+        flops = 5 * n_out
+    elif op in ('softmax', 'log_softmax'):
+        # exponentiate, sum, and divide (or subtract the log)
+        flops = 3 * n_out
+    elif op in ELEMENTWISE_OPS:
+        flops = n_out
+    elif op in REDUCTION_OPS:
+        # adaptive pooling may also upsample (e.g. 1x1 to 7x7 in vgg)
+        flops = max(n_in, n_out)
+
+    # other ops (e.g. cat, contiguous, padding) only move data
+    cost['macs'] = macs
+    cost['flops'] = flops
+    cost['bytes'] = (n_in + n_out + n_params) * bytes_per_element
+    return cost
+
+
+def estimate_costs(graphdict, param_shapes, bytes_per_element=4):
+    ''' estimates the costs of all nodes and modules of a topology
+
+        graphdict          (dict) : mapping of node name to nodedict
+                                    (after process_modules)
+        param_shapes       (dict) : mapping of model parameter name to shape
+        bytes_per_element  (int)  : size of tensor elements in bytes
+
+        returns a mapping of node and module name (as in modu) to costs (see
+        ESTIMATES), where the costs of a module are the sums over all nodes
+        within it
+    '''
+    costs = {}
+
+    # [1] estimate each op node
+    # #########################################################################
+    for name, node in graphdict.items():
+        costs[name] = _estimate_node(node, graphdict, param_shapes,
+                                     bytes_per_element)
+
+    # [2] accumulate nodes into each of their enclosing modules
+    # #########################################################################
+    # module names are the prefixes of node names up to each '/', as in
+    # build_modu (and the root module is the empty prefix)
+    # #########################################################################
+    modules = {}
+    for name in graphdict:
+        cost = costs[name]
+        end = 0
+        while end >= 0:
+            module = modules.setdefault(
+                name[:end], {estimate: 0 for estimate in ESTIMATES})
+            for estimate in ESTIMATES:
+                module[estimate] += cost[estimate]
+            end = name.find('/', end) + 1 or -1
+
+    costs.update(modules)
+    return costs
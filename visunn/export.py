@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains static-site export of the views of all modules
+
+    an export is a folder that any static file server can host, with the
+    frontend build and one json file per module:
+
+        <outdir>/index.html           : frontend, flagged to read files
+        <outdir>/static/...           : frontend build files
+        <outdir>/api/<tag>.json       : view of a module (as served by the
+                                        api at /api/<tag>)
+        <outdir>/api/<tag>.json.gz    : precompressed view (if compressing)
+        <outdir>/api/<tag>.json.br    : precompressed view (if compressing
+                                        and brotli is installed)
+        <outdir>/api/manifest.json    : content hash of each view
+
+    re-exports only write views whose content changed (and remove views of
+    modules that no longer exist)
+'''
+
+import os
+import json
+import gzip
+import shutil
+import hashlib
+from multiprocessing import Pool
+
+from visunn.topology import build_topology, module_tag
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['export_static', 'FRONTEND_BUILD']
+
+# optional brotli compression (pip install visunn[brotli])
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# folder of the frontend build (npm run build in visunn/frontend)
+FRONTEND_BUILD = os.path.join(os.path.dirname(__file__), 'frontend', 'build')
+
+# flags the exported frontend to read views from files rather than the api
+STATIC_FLAG = '<script>window.VISUNN_STATIC=true</script>'
+
+# per-process state of export workers
+_worker = {}
+
+
+def _write(path, data):
+    ''' writes a file by replacing it, so that servers never see it partial '''
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _paths(outdir, tag):
+    ''' retrieves the file paths of the view of a module, by coding '''
+    path = os.path.join(outdir, 'api', tag + '.json')
+    return {'identity': path, 'gzip': path + '.gz', 'br': path + '.br'}
+
+
+def _init_worker(modu, layout, outdir, compress):
+    ''' stores the modu and options once per worker process '''
+    _worker['modu'] = modu
+    _worker['layout'] = layout
+    _worker['outdir'] = outdir
+    _worker['compress'] = compress
+
+
+def _export_worker(task):
+    ''' serializes the view of one module, writing it if changed
+
+        task  (tuple) : module tag and content hash of its exported view
+                        (None if not exported yet)
+
+        returns the tag, the content hash of the view and whether it was
+        written
+    '''
+    tag, digest = task
+    modu, layout = _worker['modu'], _worker['layout']
+
+    view = modu.view(tag, layout)
+    if view is None:
+        view = build_topology(modu, tag, layout=layout)
+    data = json.dumps(view, separators=(',', ':')).encode('utf-8')
+
+    paths = _paths(_worker['outdir'], tag)
+    codings = ['identity']
+    if _worker['compress']:
+        codings.append('gzip')
+        if brotli is not None:
+            codings.append('br')
+
+    new_digest = hashlib.sha1(data).hexdigest()
+    if new_digest == digest and \
+            all(os.path.exists(paths[coding]) for coding in codings):
+        return tag, new_digest, False
+
+    _write(paths['identity'], data)
+    if 'gzip' in codings:
+        _write(paths['gzip'], gzip.compress(data, compresslevel=9))
+    if 'br' in codings:
+        _write(paths['br'], brotli.compress(data, mode=brotli.MODE_TEXT,
+                                            quality=11))
+
+    # codings of the previous content would otherwise still be served
+    for coding, path in paths.items():
+        if coding not in codings and os.path.exists(path):
+            os.remove(path)
+    return tag, new_digest, True
+
+
+def _copy_frontend(outdir):
+    ''' copies the frontend build (only files that changed), and flags its
+        index.html as static '''
+    for root, _, filenames in os.walk(FRONTEND_BUILD):
+        folder = os.path.join(outdir, os.path.relpath(root, FRONTEND_BUILD))
+        os.makedirs(folder, exist_ok=True)
+        for filename in filenames:
+            src = os.path.join(root, filename)
+            dst = os.path.join(folder, filename)
+            if filename == 'index.html' and root == FRONTEND_BUILD:
+                with open(src, 'r') as f:
+                    html = f.read()
+                html = html.replace('</head>', STATIC_FLAG + '</head>', 1)
+                _write(dst, html.encode('utf-8'))
+                continue
+            src_stat = os.stat(src)
+            if os.path.exists(dst):
+                dst_stat = os.stat(dst)
+                if dst_stat.st_size == src_stat.st_size and \
+                        dst_stat.st_mtime_ns == src_stat.st_mtime_ns:
+                    continue
+            shutil.copy2(src, dst)
+
+
+def export_static(modu, outdir, layout='layered', compress=False,
+                  processes=None):
+    ''' exports the frontend and the views of all modules as static files
+
+        modu       (Modu) : modu object
+        outdir     (str)  : folder to export to
+        layout     (str)  : layout backend passed to plot (for views that are
+                            not precomputed)
+        compress   (bool) : whether to also write gzip (and brotli) codings
+                            of each view
+        processes  (int)  : number of worker processes (defaults to number of
+                            cpus, 1 exports all views in this process)
+
+        returns the number of views written and left unchanged (the
+        frontend is only copied if it is built, see FRONTEND_BUILD)
+    '''
+    os.makedirs(os.path.join(outdir, 'api'), exist_ok=True)
+    manifest_path = os.path.join(outdir, 'api', 'manifest.json')
+
+    # [1] read content hashes of the previous export
+    # #########################################################################
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    # [2] write the views that changed, in parallel
+    # #########################################################################
+    tasks = [(tag, manifest.get(tag, None))
+             for tag in (module_tag(modu, name) for name in modu.modules)]
+    initargs = (modu, layout, outdir, compress)
+
+    if processes == 1 or len(tasks) <= 1:
+        _init_worker(*initargs)
+        results = [_export_worker(task) for task in tasks]
+    else:
+        # the modu is sent once per worker, rather than once per module
+        processes = min(processes or os.cpu_count() or 1, len(tasks))
+        chunksize = max(1, len(tasks) // (4 * processes))
+        with Pool(processes, initializer=_init_worker,
+                  initargs=initargs) as pool:
+            results = list(pool.imap_unordered(_export_worker, tasks,
+                                               chunksize))
+
+    # [3] remove views of modules that no longer exist, then the manifest
+    # #########################################################################
+    digests = {tag: digest for tag, digest, _ in results}
+    for tag in set(manifest) - set(digests):
+        for path in _paths(outdir, tag).values():
+            if os.path.exists(path):
+                os.remove(path)
+    _write(manifest_path,
+           json.dumps(digests, indent=1, sort_keys=True).encode('utf-8'))
+
+    # [4] copy the frontend last, so that it never reads missing views
+    # #########################################################################
+    if os.path.isdir(FRONTEND_BUILD):
+        _copy_frontend(outdir)
+
+    written = sum(1 for _, _, is_written in results if is_written)
+    return written, len(results) - written
@@ -3,7 +3,7 @@
  * @author Vincent Liu
  */
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import styled from 'styled-components';
 import './App.css';
 
@@ -28,13 +28,32 @@ const App = () => {
     let [rotation, setRotation] = useState(true);
     let [position, setPosition] = useState(true);
     let [name, setName] = useState(null);
+    let views = useRef({});
 
-    // retrieve the metadata corresponding to tag
+    // retrieve the metadata corresponding to tag, along with that of its
+    // submodules, so that drilling down does not wait on the server
     useEffect(() => {
+        const getSubtree = async (tag) => {
+            // static exports have no subtrees, only the file of each module
+            if (C.STATIC) {
+                if (!(tag in views.current)) {
+                    let view = await fetch(C.API + tag + '.json');
+                    views.current[tag] = await view.json();
+                }
+                return;
+            }
+            let subtree = await fetch(C.API + tag + '/subtree');
+            Object.assign(views.current, await subtree.json());
+        }
+
         const getConfig = async () => {
-            let config = await fetch('/api/' + tag);
-            let json = await config.json();
-            setConfig(json);
+            if (tag in views.current) {
+                // prefetch the next level in the background
+                getSubtree(tag);
+            } else {
+                await getSubtree(tag);
+            }
+            setConfig(views.current[tag]);
             setRotation(true);
             setPosition(true);
             setReady(true);
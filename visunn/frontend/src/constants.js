@@ -6,6 +6,15 @@
 // root
 export const ROOT = 'root';
 
+// static exports (visunn export-static) have one file per module, next to
+// the app
+export const STATIC = window.VISUNN_STATIC === true;
+
+// api of the model in the url (e.g. /?model=resnet18) when serving a logdir
+const MODEL = new URLSearchParams(window.location.search).get('model');
+export const API = STATIC ? 'api/' :
+    MODEL === null ? '/api/' : '/api/' + MODEL + '/';
+
 // input nodes
 export const INPUT_COLOR = 0x22A6B3;
 export const INPUT_HOVER_COLOR = INPUT_COLOR;
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains a layered (sugiyama-style) graph layout in numpy '''
+
+import numpy as np
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['layered_layout']
+
+
+def _csr(src, dst, n):
+    ''' groups edges by source node as (indptr, indices) '''
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order]
+
+
+def _gather(indptr, indices, nodes):
+    ''' concatenates the csr neighbors of all specified nodes '''
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return indices[offsets + np.arange(counts.sum())]
+
+
+def _rank_layers(src, dst, n):
+    ''' assigns layers with kahn's algorithm, breaking cycles as needed
+
+        returns the layer of each node and a mask of edges to reverse
+    '''
+    indptr, indices = _csr(src, dst, n)
+    indegree = np.bincount(dst, minlength=n)
+    layer = np.full(n, -1, dtype=np.int64)
+
+    frontier = np.nonzero(indegree == 0)[0]
+    depth = 0
+    while True:
+        # cycle (e.g. recycled layers): force the most settled node through
+        if len(frontier) == 0:
+            remaining = np.nonzero(layer < 0)[0]
+            if len(remaining) == 0:
+                break
+            frontier = remaining[[np.argmin(indegree[remaining])]]
+            indegree[frontier] = 0
+
+        layer[frontier] = depth
+        depth += 1
+
+        # edges out of the frontier are now satisfied
+        succs = _gather(indptr, indices, frontier)
+        succs = succs[layer[succs] < 0]
+        np.subtract.at(indegree, succs, 1)
+        succs = np.unique(succs)
+        frontier = succs[indegree[succs] == 0]
+
+    return layer, layer[src] >= layer[dst]
+
+
+def _pull_sources(src, dst, layer, n):
+    ''' moves source nodes (e.g. params) right above their first consumer '''
+    sources = np.bincount(dst, minlength=n) == 0
+    nearest = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(nearest, src, layer[dst])
+
+    pulled = sources & (nearest < np.iinfo(np.int64).max)
+    layer = np.where(pulled, nearest - 1, layer)
+
+    # compact any layers that were emptied
+    _, layer = np.unique(layer, return_inverse=True)
+    return layer.reshape(-1)
+
+
+def _add_dummies(src, dst, layer, n):
+    ''' splits edges spanning multiple layers with chains of dummy nodes '''
+    span = layer[dst] - layer[src]
+    is_long = span > 1
+    long_src, long_dst = src[is_long], dst[is_long]
+    n_steps = span[is_long] - 1
+    n_dummy = int(n_steps.sum())
+    if n_dummy == 0:
+        return src, dst, layer
+
+    # step of each dummy along its edge (1, ..., span - 1)
+    chain = np.repeat(np.arange(len(n_steps)), n_steps)
+    step = np.arange(n_dummy) - np.repeat(np.cumsum(n_steps) - n_steps,
+                                          n_steps) + 1
+    dummies = n + np.arange(n_dummy)
+
+    # segments: source -> first dummy, dummy -> dummy, last dummy -> target
+    seg_src = np.where(step == 1, long_src[chain], dummies - 1)
+    is_last = step == n_steps[chain]
+    src = np.concatenate([src[~is_long], seg_src, dummies[is_last]])
+    dst = np.concatenate([dst[~is_long], dummies, long_dst[chain[is_last]]])
+    layer = np.concatenate([layer, layer[long_src[chain]] + step])
+
+    return src, dst, layer
+
+
+def _order_layers(key, rank, layer):
+    ''' sorts nodes by layer then key (ties broken by the current rank),
+        returning the sorted order and the new rank of each node in its layer
+    '''
+    order = np.lexsort((rank, key, layer))
+    starts = np.searchsorted(layer[order], layer[order], side='left')
+    rank = np.empty(len(layer), dtype=np.int64)
+    rank[order] = np.arange(len(layer)) - starts
+    return order, rank
+
+
+def _neighbor_mean(values, src, dst, n, default):
+    ''' averages values over both predecessors and successors '''
+    total = np.bincount(dst, weights=values[src], minlength=n) + \
+        np.bincount(src, weights=values[dst], minlength=n)
+    count = np.bincount(dst, minlength=n) + np.bincount(src, minlength=n)
+    return np.where(count > 0, total / np.maximum(count, 1), default)
+
+
+def _reduce_crossings(src, dst, layer, n_iter):
+    ''' barycenter heuristic, alternating between odd and even layers '''
+    n = len(layer)
+    order, rank = _order_layers(np.arange(n), np.zeros(n), layer)
+    width = np.bincount(layer)
+
+    for _ in range(n_iter):
+        for parity in (0, 1):
+            # center ranks so that layers of different widths line up
+            pos = rank - (width[layer] - 1) / 2.0
+            bary = _neighbor_mean(pos, src, dst, n, pos)
+            key = np.where(layer % 2 == parity, bary, pos)
+            order, rank = _order_layers(key, rank, layer)
+
+    return order, rank
+
+
+def _assign_coordinates(src, dst, layer, order, rank, n_iter):
+    ''' pulls nodes towards their neighbors, keeping unit spacing in layers
+
+        each iteration moves nodes to the mean of their neighbors, then
+        restores the minimum separation in every layer by averaging a
+        left-to-right and right-to-left sweep (both vectorized over all
+        layers at once by offsetting each layer by a large constant)
+    '''
+    n = len(layer)
+    width = np.bincount(layer)
+    x = rank - (width[layer] - 1) / 2.0
+    slot_layer = layer[order]
+    slot_rank = rank[order].astype(np.float64)
+
+    for _ in range(n_iter):
+        desired = _neighbor_mean(x, src, dst, n, x)
+
+        shifted = desired[order] - slot_rank
+        offset = slot_layer * 4.0 * (np.abs(shifted).max() + 1.0)
+        forward = np.maximum.accumulate(shifted + offset) - offset
+        backward = np.minimum.accumulate(
+            (shifted + offset)[::-1])[::-1] - offset
+
+        x[order] = (forward + backward) / 2.0 + slot_rank
+
+    return x
+
+
+def layered_layout(edges, n_iter=8, nodesep=1.0, ranksep=1.0):
+    ''' lays out a directed graph in layers, like graphviz `dot`
+
+        edges    (iterable) : (source name, target name) pairs
+        n_iter   (int)      : iterations of crossing reduction and
+                              coordinate assignment
+        nodesep  (float)    : horizontal distance between adjacent nodes
+        ranksep  (float)    : vertical distance between adjacent layers
+
+        returns a mapping of node name to (x, y) coordinate, with sources on
+        top (largest y) as with graphviz
+    '''
+    # [1] intern node names to integer ids
+    # #########################################################################
+    names = {}
+    pairs = [(names.setdefault(u, len(names)), names.setdefault(v, len(names)))
+             for u, v in edges]
+    n = len(names)
+    if n == 0:
+        return {}
+
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    src, dst = pairs[:, 0], pairs[:, 1]
+
+    # [2] layer assignment
+    # #########################################################################
+    # longest-path layering from the sources, where edges closing a cycle are
+    # reversed, then sources are pulled down next to their consumers
+    # #########################################################################
+    layer, reverse = _rank_layers(src, dst, n)
+    src, dst = np.where(reverse, dst, src), np.where(reverse, src, dst)
+    layer = _pull_sources(src, dst, layer, n)
+
+    # [3] crossing reduction
+    # #########################################################################
+    # long edges are split with dummy nodes so that every edge connects
+    # adjacent layers, then nodes are reordered by barycenter
+    # #########################################################################
+    src, dst, layer = _add_dummies(src, dst, layer, n)
+    order, rank = _reduce_crossings(src, dst, layer, n_iter)
+
+    # [4] coordinate assignment
+    # #########################################################################
+    x = _assign_coordinates(src, dst, layer, order, rank, n_iter)
+    y = (layer.max() - layer) * ranksep
+    x = x * nodesep
+
+    return {name: (float(x[idx]), float(y[idx]))
+            for name, idx in names.items()}
@@ -2,28 +2,86 @@
 # -*- coding: utf-8 -*-
 ''' console script for visunn module '''
 
+import os
 import argparse
 from gevent.pywsgi import WSGIServer
 
+from visunn.plot import LAYOUTS
+from visunn.topology import precompute
+from visunn.storage import load_modu, save_modu
+from visunn.export import export_static, FRONTEND_BUILD
 from visunn.backend.app import App
+from visunn.backend.aio import AsyncApp
+from visunn.backend.prefork import serve_forked, preload
+from visunn.constants import MODU_EXT
 
 __author__ = 'Vincent Liu'
 __email__ = 'vliu15@stanford.edu'
 
+# servers of run_main (asyncio requires aiohttp)
+SERVERS = ['gevent', 'asyncio']
+
 
 def run_main():
     ''' entry point for console script '''
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', '--logdir', type=str, required=True,
                         help='string corresponding to saved model')
-    parser.add_argument('-n', '--name', type=str, required=True,
-                        help='string of model name')
+    parser.add_argument('-n', '--name', type=str, default=None,
+                        help='string of model name (serves all models in '
+                             'logdir under /api/<model>/<tag> if not set)')
     parser.add_argument('-p', '--port', type=int, default=5000,
                         help='port number to launch web app on')
+    parser.add_argument('-c', '--cache-size', type=int, default=128,
+                        help='max number of module responses to cache')
+    parser.add_argument('--layout', type=str, default='layered',
+                        choices=LAYOUTS,
+                        help='graph layout backend (dot requires graphviz)')
+    parser.add_argument('-b', '--budget', type=int, default=1024,
+                        help='max megabytes of topologies to keep loaded '
+                             '(when serving all models)')
+    parser.add_argument('--max-age', type=int, default=86400,
+                        help='seconds browsers may reuse module responses '
+                             'for without revalidating (single model served '
+                             'by gevent without reloading)')
+    parser.add_argument('-r', '--reload', default=False,
+                        action='store_true',
+                        help='whether to swap in topologies whose files are '
+                             'replaced (gevent server, always on when serving '
+                             'all models or with asyncio)')
+    parser.add_argument('-s', '--server', type=str, default='gevent',
+                        choices=SERVERS,
+                        help='server to run, asyncio renders modules in '
+                             'worker processes (requires aiohttp)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (asyncio server)')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='seconds a request may wait for its module to '
+                             'render (asyncio server)')
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help='max number of module renders queued or running '
+                             '(asyncio server)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of pre-forked server processes sharing '
+                             'loaded topologies (gevent server)')
     args = parser.parse_args()
 
-    app = App(args.logdir, args.name).app
-    server = WSGIServer(('localhost', args.port), app)
+    # reject options the chosen server would silently ignore
+    if args.server == 'asyncio':
+        if args.reload:
+            parser.error('-r/--reload is not supported by the asyncio server '
+                         '(which always swaps in replaced topologies)')
+        if args.workers != 1:
+            parser.error('-w/--workers requires the gevent server (use '
+                         '-j/--processes with asyncio)')
+    elif args.processes is not None:
+        parser.error('-j/--processes requires the asyncio server (use '
+                     '-w/--workers with gevent)')
+
+    # browsers must revalidate whenever topologies can be swapped in, which
+    # registries (serving all models, and every asyncio server) always do
+    reloads = args.reload or args.name is None or args.server == 'asyncio'
+    max_age = None if reloads else args.max_age
 
     format_name = '\033[92m' + 'visunn ' + '\033[0m'
     print()
@@ -31,6 +89,30 @@ def run_main():
           .format(args.port))
     print()
 
+    if args.server == 'asyncio':
+        from aiohttp import web
+        app = AsyncApp(args.logdir, args.name, cache_size=args.cache_size,
+                       layout=args.layout, budget=args.budget << 20,
+                       max_age=max_age, processes=args.processes,
+                       timeout=args.timeout,
+                       max_pending=args.max_pending).app
+        web.run_app(app, host='localhost', port=args.port, print=None)
+        print('\033[95m' + 'exited' + '\033[0m')
+        return
+
+    visu_app = App(args.logdir, args.name, cache_size=args.cache_size,
+                   layout=args.layout, budget=args.budget << 20,
+                   max_age=max_age, reload=args.reload)
+
+    # topologies are loaded before forking, so that workers share them
+    if args.workers > 1:
+        preload(visu_app)
+        serve_forked(visu_app.app, args.port, workers=args.workers)
+        print('\033[95m' + 'exited' + '\033[0m')
+        return
+
+    server = WSGIServer(('localhost', args.port), visu_app.app)
+
     try:
         server.serve_forever()
     except KeyboardInterrupt as ki:
@@ -38,5 +120,85 @@ def run_main():
         print('\033[95m' + 'exited' + '\033[0m')
 
 
+def run_precompute(args):
+    ''' precomputes the views of all modules of a logged topology '''
+    save_path = os.path.join(args.logdir, args.name + MODU_EXT)
+    modu = load_modu(save_path)
+
+    modu.add_views(
+        precompute(modu, layout=args.layout, processes=args.processes),
+        layout=args.layout
+    )
+
+    save_modu(modu, save_path)
+
+    format_name = '\033[92m' + args.name + '\033[0m'
+    print('Successfully precomputed {} views of {}!'
+          .format(len(modu.modules), format_name))
+
+
+def run_export_static(args):
+    ''' exports the frontend and the views of all modules as static files '''
+    modu = load_modu(args.path)
+    written, unchanged = export_static(
+        modu, args.outdir, layout=args.layout, compress=args.compress,
+        processes=args.processes
+    )
+
+    if not os.path.isdir(FRONTEND_BUILD):
+        format_warning = '\033[93m' + 'WARNING:' + '\033[0m'
+        print(format_warning + ' frontend build not found at {}, only views '
+              'were exported (npm run build in visunn/frontend).'
+              .format(FRONTEND_BUILD))
+
+    format_name = '\033[92m' + args.path + '\033[0m'
+    print('Successfully exported {} views of {} to {} ({} unchanged)!'
+          .format(written, format_name, args.outdir, unchanged))
+
+
+def run_command():
+    ''' entry point for console script with subcommands '''
+    parser = argparse.ArgumentParser(prog='visunn')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    # visunn precompute
+    precompute_parser = subparsers.add_parser(
+        'precompute', help='precompute the views of all modules')
+    precompute_parser.add_argument('-l', '--logdir', type=str, required=True,
+                                   help='string corresponding to saved model')
+    precompute_parser.add_argument('-n', '--name', type=str, required=True,
+                                   help='string of model name')
+    precompute_parser.add_argument('--layout', type=str, default='layered',
+                                   choices=LAYOUTS,
+                                   help='graph layout backend')
+    precompute_parser.add_argument('-j', '--processes', type=int,
+                                   default=None,
+                                   help='number of worker processes')
+    precompute_parser.set_defaults(run=run_precompute)
+
+    # visunn export-static
+    export_parser = subparsers.add_parser(
+        'export-static', help='export the frontend and module views as '
+                              'static files')
+    export_parser.add_argument('path', type=str,
+                               help='file path of logged topology')
+    export_parser.add_argument('-o', '--outdir', type=str, required=True,
+                               help='folder to export to')
+    export_parser.add_argument('--layout', type=str, default='layered',
+                               choices=LAYOUTS,
+                               help='graph layout backend')
+    export_parser.add_argument('-z', '--compress', default=False,
+                               action='store_true',
+                               help='whether to also write gzip (and brotli) '
+                                    'codings of views')
+    export_parser.add_argument('-j', '--processes', type=int, default=None,
+                               help='number of worker processes')
+    export_parser.set_defaults(run=run_export_static)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
 if __name__ == '__main__':
     run_main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains asynchronous logger of training metrics
+
+    file layout (all integers little endian):
+
+        [magic (8 bytes)][version (uint32)]
+        [block]*
+
+    where each block is a batch of flushed updates, stored as columns:
+
+        [rows (uint32)][param groups (uint32)]
+        [step (int64 x rows)][time (float64 x rows)][loss (float64 x rows)]
+        [lr (float64 x rows x param groups)]
+'''
+
+import time
+import atexit
+import struct
+import threading
+
+import numpy as np
+import torch
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['MetricsLogger', 'read_metrics']
+
+MAGIC = b'VISUMTR\x00'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sI')
+BLOCK = struct.Struct('<II')
+
+
+class MetricsLogger(object):
+    ''' logs scalars from the training loop without blocking it
+
+        updates are written into a preallocated ring buffer (the loss stays
+        on its device, so no host sync is forced), and a background thread
+        flushes them in batches to an append-only binary log
+    '''
+    def __init__(self, path, capacity=4096, flush_size=256, interval=1.0):
+        ''' creates a metrics log (discarding metrics of earlier runs, as
+            activation samples and snapshots are)
+
+            path        (str)   : file path of the metrics log
+            capacity    (int)   : number of updates the ring buffer holds
+            flush_size  (int)   : number of pending updates that triggers a
+                                  flush
+            interval    (float) : max seconds between flushes
+        '''
+        self._path = path
+        self._capacity = capacity
+        self._flush_size = min(flush_size, capacity)
+        self._interval = interval
+
+        # ring buffer, where the loss ring is allocated on the first update
+        self._steps = np.zeros(capacity, dtype=np.int64)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._lrs = [()] * capacity
+        self._losses = None
+
+        # updates [tail, head) are pending, as counts of all updates ever
+        self._head = 0
+        self._tail = 0
+        self._wanted = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def path(self):
+        ''' retrieves path of the metrics log '''
+        return self._path
+
+    def update(self, step, optim, loss):
+        ''' enqueues the metrics of a training step
+
+            step   (int)                   : iteration or epoch
+            optim  (torch.optim.Optimizer) : pytorch optimizer
+            loss   (torch.Tensor, float)   : loss of this step
+        '''
+        # [1] wait for space if the flusher has fallen a whole ring behind
+        # #####################################################################
+        if self._head - self._tail >= self._capacity:
+            with self._cond:
+                self._wanted = self._head
+                self._cond.notify_all()
+                while self._head - self._tail >= self._capacity and \
+                        not self._closed:
+                    self._cond.wait()
+        if self._closed:
+            raise ValueError('update on closed metrics logger')
+
+        # [2] write the slot, then publish it to the flusher
+        # #####################################################################
+        # the slot at head is never read by the flusher until head moves past
+        # it, so it is written without holding the lock
+        # #####################################################################
+        slot = self._head % self._capacity
+        if self._losses is None:
+            device = loss.device if torch.is_tensor(loss) else 'cpu'
+            self._losses = torch.zeros(self._capacity, dtype=torch.float64,
+                                       device=device)
+        if torch.is_tensor(loss):
+            self._losses[slot].copy_(loss.detach(), non_blocking=True)
+        else:
+            self._losses[slot] = loss
+        self._steps[slot] = step
+        self._times[slot] = time.time()
+        self._lrs[slot] = tuple(group['lr'] for group in optim.param_groups)
+
+        self._head += 1
+        if self._head - self._tail == self._flush_size:
+            with self._cond:
+                self._cond.notify_all()
+
+    def flush(self):
+        ''' blocks until all enqueued updates are written '''
+        head = self._head
+        with self._cond:
+            self._wanted = max(self._wanted, head)
+            self._cond.notify_all()
+            while self._tail < head and self._thread.is_alive():
+                self._cond.wait()
+
+    def close(self):
+        ''' flushes pending updates and stops the background thread '''
+        if self._closed:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _run(self):
+        ''' flushes pending updates until closed '''
+        while True:
+            with self._cond:
+                if self._head - self._tail < self._flush_size and \
+                        self._tail >= self._wanted and not self._closed:
+                    self._cond.wait(self._interval)
+                head, tail, closed = self._head, self._tail, self._closed
+
+            if head > tail:
+                self._write(tail, head)
+                with self._cond:
+                    self._tail = head
+                    self._cond.notify_all()
+            elif closed:
+                return
+
+    def _write(self, tail, head):
+        ''' appends updates [tail, head) to the log as column blocks '''
+        slots = np.arange(tail, head) % self._capacity
+        # the only host sync, which blocks this thread rather than training
+        losses = self._losses[torch.from_numpy(slots).to(
+            self._losses.device)].cpu().numpy()
+        steps = self._steps[slots]
+        times = self._times[slots]
+        lrs = [self._lrs[slot] for slot in slots]
+
+        # [1] split into runs with the same number of param groups
+        # #####################################################################
+        sizes = np.array([len(lr) for lr in lrs])
+        bounds = np.flatnonzero(np.diff(sizes)) + 1
+        bounds = [0] + bounds.tolist() + [len(slots)]
+
+        # [2] append one block per run
+        # #####################################################################
+        with open(self._path, 'ab') as f:
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                n_groups = int(sizes[start])
+                lr = np.array(lrs[start:end], dtype=np.float64) \
+                    .reshape(end - start, n_groups)
+                f.write(BLOCK.pack(end - start, n_groups))
+                f.write(steps[start:end].tobytes())
+                f.write(times[start:end].tobytes())
+                f.write(losses[start:end].tobytes())
+                f.write(lr.tobytes())
+
+
+def _check_header(path):
+    ''' validates the header of a metrics log '''
+    with open(path, 'rb') as f:
+        data = f.read(HEADER.size)
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise ValueError('{} is not a visunn metrics log'.format(path))
+    _, version = HEADER.unpack(data)
+    if version != FORMAT_VERSION:
+        raise ValueError('{} has unsupported format version {} '
+                         '(expected {})'.format(path, version, FORMAT_VERSION))
+
+
+def read_metrics(path):
+    ''' reads a metrics log into columns
+
+        path  (str) : file path of the metrics log
+
+        returns a dict of numpy arrays 'step', 'time', 'loss' and 'lr', where
+        'lr' has one column per param group (padded with nan)
+    '''
+    _check_header(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    blocks = []
+    offset = HEADER.size
+    # a trailing partial block (e.g. from a crash mid-write) is ignored
+    while offset + BLOCK.size <= len(data):
+        rows, n_groups = BLOCK.unpack_from(data, offset)
+        size = BLOCK.size + rows * 8 * (3 + n_groups)
+        if offset + size > len(data):
+            break
+
+        columns = np.frombuffer(data, dtype='<f8', count=rows * (3 + n_groups),
+                                offset=offset + BLOCK.size)
+        blocks.append((
+            columns[:rows].view('<i8'),
+            columns[rows:2*rows],
+            columns[2*rows:3*rows],
+            columns[3*rows:].reshape(rows, n_groups)
+        ))
+        offset += size
+
+    width = max([block[3].shape[1] for block in blocks] + [0])
+    lr = np.full((sum(len(block[0]) for block in blocks), width), np.nan)
+    row = 0
+    for block in blocks:
+        lr[row:row+len(block[0]), :block[3].shape[1]] = block[3]
+        row += len(block[0])
+
+    return {
+        'step': np.concatenate([b[0] for b in blocks] + [np.zeros(0, 'i8')]),
+        'time': np.concatenate([b[1] for b in blocks] + [np.zeros(0)]),
+        'loss': np.concatenate([b[2] for b in blocks] + [np.zeros(0)]),
+        'lr': lr
+    }
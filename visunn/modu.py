@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 ''' contains modu class for modular topology for backend api '''
 
-from copy import deepcopy
+import hashlib
+from collections import namedtuple
 
 from visunn.constants import MODU_ROOT
 
@@ -11,6 +12,12 @@ __email__ = 'vliu15@stanford.edu'
 
 __all__ = ['Modu']
 
+# immutable node record shared across exports
+_Node = namedtuple(
+    '_Node',
+    ['name', 'op', 'input', 'output', 'input_shapes', 'output_shapes']
+)
+
 
 class Modu(object):
     ''' low level api for backend '''
@@ -20,6 +27,10 @@ class Modu(object):
         # initialize modules with root module
         self._root = root
         self._modules = {}
+        self._hash = None
+        self._views = {}
+        self._costs = {}
+        self._estimates = {}
         self.add(self._root)
 
     @property
@@ -32,6 +43,63 @@ class Modu(object):
         ''' retrieves names of all existing modules '''
         return self._modules.keys()
 
+    @property
+    def hash(self):
+        ''' retrieves content hash of modular topology (hex string) '''
+        # older pickles predate the cached hash attribute
+        if getattr(self, '_hash', None) is None:
+            sha = hashlib.sha1()
+            for name in sorted(self._modules):
+                sha.update(name.encode())
+                for key, values in sorted(self._modules[name].items()):
+                    sha.update(repr((key, sorted(values))).encode())
+            for name in sorted(self._graphdict):
+                sha.update(repr(self._graphdict[name]).encode())
+            for name, cost in sorted(self.costs.items()):
+                sha.update(repr((name, sorted(cost.items()))).encode())
+            for name, estimate in sorted(self.estimates.items()):
+                sha.update(repr((name, sorted(estimate.items()))).encode())
+            self._hash = sha.hexdigest()
+        return self._hash
+
+    @property
+    def layouts(self):
+        ''' retrieves layouts that have precomputed views '''
+        return list(getattr(self, '_views', {}))
+
+    @property
+    def costs(self):
+        ''' retrieves measured costs of modules (empty if not profiled) '''
+        # older pickles predate profiles
+        return getattr(self, '_costs', {})
+
+    def add_costs(self, costs):
+        ''' stores measured costs (mapping of module name to costs) '''
+        self._costs = costs
+        self._hash = None
+
+    @property
+    def estimates(self):
+        ''' retrieves analytic costs of nodes and modules (empty if none) '''
+        # older pickles predate estimates
+        return getattr(self, '_estimates', {})
+
+    def add_estimates(self, estimates):
+        ''' stores analytic costs (mapping of node/module name to costs) '''
+        self._estimates = estimates
+        self._hash = None
+
+    def view(self, tag, layout='layered'):
+        ''' retrieves the precomputed view of a module (None if missing) '''
+        # older pickles predate precomputed views
+        return getattr(self, '_views', {}).get(layout, {}).get(tag, None)
+
+    def add_views(self, views, layout='layered'):
+        ''' stores precomputed views (mapping of module tag to view) '''
+        if getattr(self, '_views', None) is None:
+            self._views = {}
+        self._views[layout] = views
+
     def add(self, name):
         ''' initializes a new module '''
         self._modules[name] = {
@@ -43,72 +111,85 @@ class Modu(object):
             'out_shapes': set(),
             'params': set()
         }
+        self._hash = None
 
     def update(self, name, key, value):
         ''' updates the field of an existing module '''
         if name not in self.modules:
             self.add(name)
         self._modules[name][key].add(value)
+        self._hash = None
+        self._links = None
 
     def export(self, name):
         ''' exports the metadata of the specified module as a dict '''
         module = self._modules[name]
+        records = self._get_records()
+        links = self._get_links(name)
         meta = {}
 
-        def _fix_links(node):
-            ''' edits node inputs to reflect modularization '''
-            delim = len(node['input'])
-            for idx, link in enumerate(node['input'] + node['output']):
-
-                # if input comes from this module
-                if link.find(name) == 0:
-                    sub_name = link[len(name):].split('/')[0]
-
-                    # if input comes from a submodule
+        def _fix_links(node_links):
+            ''' maps links to reflect modularization, without duplicates '''
+            fixed = []
+            for link in node_links:
+                # if link comes from a submodule of this module
+                if link not in links:
+                    sub_name = None
+                    if link.startswith(name):
+                        sub_name = link[len(name):].split('/')[0]
                     if sub_name in module['modules']:
-                        if idx < delim:
-                            node['input'][idx] = name + sub_name + '/'
-                        else:
-                            node['output'][idx-delim] = name + sub_name + '/'
+                        links[link] = name + sub_name + '/'
+                    else:
+                        links[link] = link
+                fixed.append(links[link])
 
-            # discard duplicates from multiple inputs from same module
-            node['input'] = list(set(node['input']))
-            node['output'] = list(set(node['output']))
-            return node
+            # discard duplicates from multiple links to same module
+            return list(dict.fromkeys(fixed))
 
+        # sets are iterated in sorted order, since their order varies with
+        # string hash randomization and views should not vary across processes
         def _add_nodes(node_type):
             ''' adds nodes to the metadata dict '''
-            for node_name in module[node_type]:
+            for node_name in sorted(module[node_type]):
                 # op_nodes only contain relative name
                 if node_type == 'op_nodes':
                     node_name = name + node_name
 
-                node = deepcopy(self._graphdict[node_name])
-
-                # add input shapes (from input nodes' output shapes)
-                if node_type == 'in_nodes':
-                    node['input'] = []
-                elif node_type == 'out_nodes':
-                    node['output'] = []
-
-                meta[node_name] = _fix_links(node)
+                # shapes are shared (immutable) with the node records
+                record = records[node_name]
+                meta[node_name] = {
+                    'name': record.name,
+                    'op': record.op,
+                    'input': [] if node_type == 'in_nodes'
+                    else _fix_links(record.input),
+                    'output': [] if node_type == 'out_nodes'
+                    else _fix_links(record.output),
+                    'input_shapes': record.input_shapes,
+                    'output_shapes': record.output_shapes
+                }
+                if node_name in self.estimates:
+                    meta[node_name]['estimate'] = self.estimates[node_name]
 
         def _add_modules():
             ''' adds all modules to the metadata dict '''
-            for submodule in module['modules']:
+            for submodule in sorted(module['modules']):
                 sub_name = name + submodule + '/'
                 submodule = self._modules[sub_name]
 
-                node = {
+                meta[sub_name] = {
                     'name': sub_name,
                     'op': 'visu::module',
-                    'input': list(submodule['in_nodes']),
-                    'output': list(submodule['out_nodes']),
-                    'input_shapes': list(submodule['in_shapes']),
-                    'output_shapes': list(submodule['out_shapes']),
+                    'input': _fix_links(sorted(submodule['in_nodes'])),
+                    'output': _fix_links(sorted(submodule['out_nodes'])),
+                    'input_shapes': sorted(submodule['in_shapes'], key=repr),
+                    'output_shapes': sorted(submodule['out_shapes'],
+                                            key=repr),
                     'params': sorted(submodule['params'])
                 }
-                meta[sub_name] = _fix_links(node)
+                if sub_name in self.costs:
+                    meta[sub_name]['cost'] = self.costs[sub_name]
+                if sub_name in self.estimates:
+                    meta[sub_name]['estimate'] = self.estimates[sub_name]
 
         # convert all modules and nodes to dict
         # #####################################################################
@@ -123,7 +204,35 @@ class Modu(object):
         _add_nodes('out_nodes')
         _add_modules()
 
-        inputs = list(module['in_nodes'])
-        outputs = list(module['out_nodes'])
+        inputs = sorted(module['in_nodes'])
+        outputs = sorted(module['out_nodes'])
 
         return (meta, inputs, outputs)
+
+    def _get_records(self):
+        ''' retrieves immutable node records, built once from graphdict '''
+        if getattr(self, '_records', None) is None:
+            self._records = {
+                name: _Node(
+                    node['name'], node['op'],
+                    tuple(node['input']), tuple(node['output']),
+                    tuple(node['input_shapes']), tuple(node['output_shapes'])
+                )
+                for name, node in self._graphdict.items()
+            }
+        return self._records
+
+    def _get_links(self, name):
+        ''' retrieves the memo of link to submodule names of a module '''
+        if getattr(self, '_links', None) is None:
+            self._links = {}
+        if name not in self._links:
+            self._links[name] = {}
+        return self._links[name]
+
+    def __getstate__(self):
+        ''' excludes records and link memos (derived data) from pickles '''
+        state = self.__dict__.copy()
+        state.pop('_records', None)
+        state.pop('_links', None)
+        return state
@@ -5,10 +5,15 @@
 import networkx as nx
 import numpy as np
 
+from visunn.layout import layered_layout
+
 __author__ = 'Vincent Liu'
 __email__ = 'vliu15@stanford.edu'
 
-__all__ = ['plot']
+__all__ = ['plot', 'LAYOUTS']
+
+# supported layout backends ('dot' requires pydot and graphviz)
+LAYOUTS = ['layered', 'dot']
 
 
 def _rescale_to_gaussian(xs, ys, v=7.5):
@@ -29,14 +34,20 @@ def _rescale_to_gaussian(xs, ys, v=7.5):
     return xnorm, ynorm
 
 
-def plot(edges, normalize=True, truncate=False):
+def plot(edges, normalize=True, truncate=False, layout='layered'):
     ''' plots the graph and retrieves coordinates
 
         edges      (dict) : mapping of each node to its inputs
         normalize  (bool) : whether to normalize coordinates
         truncate   (bool) : whether to truncate names of nodes
                                       (useful when rendering with graphviz)
+        layout     (str)  : layout backend, 'layered' (built-in) or 'dot'
+                            (graphviz subprocess, requires pydot)
     '''
+    if layout not in LAYOUTS:
+        raise ValueError('layout must be one of {}, got {}'
+                         .format(LAYOUTS, layout))
+
     # [1] first create graph by adding edges
     # #########################################################################
     G = nx.DiGraph()
@@ -49,9 +60,12 @@ def plot(edges, normalize=True, truncate=False):
     if truncate:
         G = nx.relabel.relabel_nodes(G, lambda x: '/'.join(x.split('/')[-3:]))
 
-    # [3] get the actual coordinates from the dot algorithm
+    # [3] get the actual coordinates from the layered (or dot) algorithm
     # #########################################################################
-    pos = nx.nx_pydot.graphviz_layout(G, prog='dot')
+    if layout == 'dot':
+        pos = nx.nx_pydot.graphviz_layout(G, prog='dot')
+    else:
+        pos = layered_layout(G.edges())
 
     # [4] normalize values for displaying on canvas
     # #########################################################################
@@ -62,6 +76,9 @@ def plot(edges, normalize=True, truncate=False):
     # also allow user to specify the center and spread of the distributions
     # #########################################################################
 
+    if len(pos) == 0:
+        return G, pos
+
     xs, ys = zip(*pos.values())
     xnorm, ynorm = _rescale_to_gaussian(
         list(set(xs)), list(set(ys)), v=len(edges)
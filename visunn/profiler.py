@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains measured per-module latency and memory profiles '''
+
+import torch
+from torch.autograd.profiler import record_function
+
+from visunn.topology import scope_module
+from visunn.activations import module_scopes, _first_tensor
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['COSTS', 'profile_modules', 'rollup']
+
+# prefix of the profiler scopes of modules
+SCOPE = 'visu::'
+
+# inclusive costs, each with an exclusive 'self_' counterpart, where times
+# are in milliseconds per pass, memory is peak bytes allocated, and exclusive
+# memory is bytes allocated (net of frees) outside of submodules
+COSTS = ['time', 'memory', 'backward_time']
+
+
+def _nearest_scope(event):
+    ''' retrieves the innermost module scope event containing an event '''
+    parent = event.cpu_parent
+    while parent is not None and not parent.name.startswith(SCOPE):
+        parent = parent.cpu_parent
+    return parent
+
+
+def _child_scopes(event):
+    ''' retrieves the outermost module scope events within an event '''
+    for child in event.cpu_children:
+        if child.name.startswith(SCOPE):
+            yield child
+        else:
+            yield from _child_scopes(child)
+
+
+def _peak(event):
+    ''' estimates peak bytes allocated during an event
+
+        the running total of memory (net of frees) allocated by the children
+        of an event is taken in order, with each child at its own peak
+    '''
+    total, peak = 0, 0
+    for child in sorted(event.cpu_children, key=lambda e: e.time_range.start):
+        peak = max(peak, total + _peak(child))
+        total += child.cpu_memory_usage
+    return max(peak, event.cpu_memory_usage)
+
+
+def profile_modules(model, inputs, steps=3, backward=False):
+    ''' profiles each submodule over a few passes with the torch profiler
+
+        model     (torch.nn.Module) : pytorch model
+        inputs    (torch.Tensor)    : batch of inputs
+        steps     (int)             : number of passes to average over
+        backward  (bool)            : whether to also run (and attribute)
+                                      backward passes
+
+        returns a mapping of module name (as in modu) to its inclusive and
+        exclusive costs (see COSTS), where backward time of an op is
+        attributed to the module that ran its forward op
+    '''
+    # torch.profiler only exists from torch 1.8.1, so it is imported here
+    # rather than with visunn
+    try:
+        from torch.profiler import profile, ProfilerActivity
+    except ImportError:
+        raise ImportError('profiling modules requires torch>=1.8.1')
+
+    scopes = module_scopes(model)
+    stack = []
+
+    def _enter(module, inputs):
+        stack.append(record_function(SCOPE + scopes[module]))
+        stack[-1].__enter__()
+
+    def _exit(module, inputs, output):
+        stack.pop().__exit__(None, None, None)
+
+    # [1] run passes with every module call wrapped in a profiler scope
+    # #########################################################################
+    handles = []
+    for module in scopes:
+        handles.append(module.register_forward_pre_hook(_enter))
+        handles.append(module.register_forward_hook(_exit))
+
+    try:
+        # warm up (e.g. allocator and one-off initialization)
+        with torch.set_grad_enabled(backward):
+            model(inputs)
+
+        with profile(activities=[ProfilerActivity.CPU],
+                     profile_memory=True) as prof:
+            for _ in range(steps):
+                with torch.set_grad_enabled(backward):
+                    output = model(inputs)
+                    if backward:
+                        _first_tensor(output).float().sum().backward()
+                        model.zero_grad()
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    # [2] attribute ops (and their backward ops) to their innermost scope
+    # #########################################################################
+    events = prof.events()
+    costs = {name: {cost: 0.0 for cost in COSTS + ['self_' + c for c in COSTS]}
+             for name in scopes.values()}
+    forward_scope = {}
+
+    for event in events:
+        scope = _nearest_scope(event)
+        if event.name.startswith(SCOPE):
+            name = event.name[len(SCOPE):]
+            duration = event.time_range.elapsed_us() / 1e3
+            memory = event.cpu_memory_usage
+            costs[name]['time'] += duration
+            costs[name]['self_time'] += duration
+            costs[name]['memory'] = max(costs[name]['memory'], _peak(event))
+            costs[name]['self_memory'] = max(
+                costs[name]['self_memory'],
+                memory - sum(child.cpu_memory_usage
+                             for child in _child_scopes(event)))
+            if scope is not None:
+                costs[scope.name[len(SCOPE):]]['self_time'] -= duration
+        elif scope is not None and event.sequence_nr >= 0:
+            forward_scope[event.sequence_nr] = scope.name[len(SCOPE):]
+
+    for event in events:
+        if event.name.startswith('autograd::engine::evaluate_function') and \
+                event.sequence_nr in forward_scope:
+            name = forward_scope[event.sequence_nr]
+            costs[name]['self_backward_time'] += \
+                event.time_range.elapsed_us() / 1e3
+
+    # [4] roll backward time up the module tree, and average over passes
+    # #########################################################################
+    # each module adds its own backward time to itself and its ancestors,
+    # found by walking up its scope
+    for cost in costs.values():
+        cost['backward_time'] = 0.0
+    for name, cost in costs.items():
+        scope = name[:-1]
+        while scope:
+            if scope + '/' in costs:
+                costs[scope + '/']['backward_time'] += \
+                    cost['self_backward_time']
+            scope = scope.rpartition('/')[0]
+
+    for name in costs:
+        for cost in ['time', 'self_time', 'backward_time',
+                     'self_backward_time']:
+            costs[name][cost] /= steps
+
+    return costs
+
+
+def rollup(modu, costs):
+    ''' rolls measured costs up the module hierarchy of a modu
+
+        modu   (Modu) : modu object
+        costs  (dict) : mapping of module name to costs (see profile_modules)
+
+        modules that were collapsed in modu count towards the exclusive costs
+        of their nearest displayed ancestor, so that inclusive costs of each
+        module are always the sum of its exclusive costs and the inclusive
+        costs of its submodules (memory peaks are the max instead)
+    '''
+    modules = set(modu.modules)
+
+    # [1] accumulate exclusive costs on the nearest displayed module
+    # #########################################################################
+    keys = COSTS + ['self_' + cost for cost in COSTS]
+    rolled = {name: {key: 0.0 for key in keys} for name in modules}
+    for name, cost in costs.items():
+        target = rolled[scope_module(modu, name)]
+        for key in COSTS:
+            if key == 'memory':
+                target['self_memory'] = max(target['self_memory'],
+                                            cost['self_memory'])
+            else:
+                target['self_' + key] += cost['self_' + key]
+        if scope_module(modu, name) == name:
+            target['memory'] = cost['memory']
+
+    # [2] accumulate inclusive costs from the deepest modules up
+    # #########################################################################
+    for name in sorted(modules, key=lambda name: -name.count('/')):
+        for key in COSTS:
+            if key != 'memory':
+                rolled[name][key] += rolled[name]['self_' + key]
+        rolled[name]['memory'] = max(rolled[name]['memory'],
+                                     rolled[name]['self_memory'])
+        if name == modu.root:
+            continue
+
+        parent = rolled[name[:name[:-1].rfind('/') + 1]]
+        for key in COSTS:
+            if key == 'memory':
+                parent['memory'] = max(parent['memory'],
+                                       rolled[name]['memory'])
+            else:
+                parent[key] += rolled[name][key]
+
+    return rolled
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains per-module parameter and gradient snapshots
+
+    file layout (all integers little endian):
+
+        [magic (8 bytes)][version (uint32)][bins (uint32)]
+        [names length (uint32)][module names (json, utf-8)]
+        [block]*
+
+    where each block is the snapshot of all modules at one step, and has the
+    same size, so that blocks can be indexed by position:
+
+        [step (int64)]
+        [stats (float32 x kinds x (stats + bins) x modules)]
+
+    kinds are the weights and gradients of the params of each module (and of
+    its submodules), and histograms split [min, max] of each module into
+    equal-width bins and hold the fraction of values in each bin
+'''
+
+import json
+import mmap
+import queue
+import struct
+import threading
+
+import numpy as np
+import torch
+
+from visunn.activations import module_scopes
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['ParamSnapshots', 'read_snapshots']
+
+MAGIC = b'VISUSNP\x00'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIII')
+
+# kinds of snapshots, and scalar statistics stored before the histogram
+KINDS = ['weight', 'grad']
+STATS = ['norm', 'mean', 'std', 'min', 'max']
+
+
+def _block_dtype(bins, rows):
+    ''' retrieves the numpy dtype of one block '''
+    return np.dtype([
+        ('step', '<i8'),
+        ('stats', '<f4', (len(KINDS), len(STATS) + bins, rows))
+    ])
+
+
+def _segment_stats(flat, numels, members, chains, bins):
+    ''' computes the statistics of each module of a flat tensor, as rows
+
+        flat     (torch.Tensor) : values of all params, concatenated
+        numels   (list)         : number of values of each param
+        members  (torch.Tensor) : (modules x params) 1 where a module
+                                  contains a param, and 0 otherwise
+        chains   (list)         : ids of the modules that contain each param
+        bins     (int)          : number of histogram bins
+
+        the moments and extrema of each param are merged into every module
+        that contains it, and each param is binned once per module that
+        contains it, over [min, max] of that module
+    '''
+    n = members.shape[0]
+    device = flat.device
+
+    # [1] moments and extrema of each param
+    # #########################################################################
+    # params are reduced one by one (each is a contiguous view of flat), since
+    # older torch has no segmented reductions, and summing all values with
+    # one index_add loses precision in single precision
+    # #########################################################################
+    moments, lows, highs, squares = [], [], [], []
+    for chunk in flat.split(numels):
+        moments.append(torch.stack(torch.var_mean(chunk, unbiased=False)))
+        lows.append(chunk.min())
+        highs.append(chunk.max())
+        squares.append(chunk.dot(chunk))
+    variances, means = torch.stack(moments).double().t()
+    lows, highs = torch.stack(lows), torch.stack(highs)
+    counts = torch.tensor(numels, dtype=torch.double, device=device)
+    m2 = variances * counts
+    squares = torch.stack(squares)
+
+    # [2] merge params into modules (in double precision)
+    # #########################################################################
+    # variances are merged from the squared deviations of each param and of
+    # its mean from the mean of the module, which is exact (unlike the
+    # difference of raw second moments)
+    # #########################################################################
+    total = members.mv(counts)
+    mean = members.mv(counts * means) / total
+    deviation = means[None, :] - mean[:, None]
+    var = (members * (m2[None, :] + counts[None, :] * deviation * deviation)) \
+        .sum(1) / total
+    norm = members.mv(squares.double()).sqrt_()
+
+    # non-members are pushed out of reach of min and max
+    outside = lows.new_zeros(members.shape).masked_fill_(members == 0,
+                                                          float('inf'))
+    low = (lows[None, :] + outside).min(1)[0]
+    high = (highs[None, :] - outside).max(1)[0]
+
+    # [3] bins over [min, max] of each module
+    # #########################################################################
+    # (constant modules fall in the first bin)
+    # #########################################################################
+    span = high - low
+    scale = bins / torch.where(span > 0, span, torch.ones_like(span))
+    hist = torch.zeros(n, bins, device=device)
+    ones = flat.new_ones(max(numels))
+    for chunk, modules in zip(flat.split(numels), chains):
+        for idx in modules:
+            pos = chunk.sub(low[idx]).mul_(scale[idx]).clamp_(0, bins - 1)
+            if flat.is_cuda:
+                # bincount would sync on the max index to size its output
+                hist[idx].index_add_(0, pos.long(), ones[:len(chunk)])
+            else:
+                hist[idx] += torch.bincount(pos.long(), minlength=bins).float()
+
+    return torch.cat([
+        torch.stack([norm.float(), mean.float(), var.sqrt_().float(), low,
+                     high], dim=1),
+        hist / total.float()[:, None]
+    ], dim=1)
+
+
+class ParamSnapshots(object):
+    ''' snapshots weight and gradient distributions of modules
+
+        the params of all modules are concatenated on the device of the
+        model, where each param is reduced once and merged into every module
+        that contains it, and a background thread copies the statistics to
+        the host and appends them to the snapshot file
+    '''
+    def __init__(self, model, path, bins=32):
+        ''' indexes the params of a model by the modules that contain them
+
+            model  (torch.nn.Module) : pytorch model
+            path   (str)             : file path of the snapshots
+            bins   (int)             : number of histogram bins
+        '''
+        self._path = path
+        self._bins = bins
+
+        # [1] order params by module, so that the params of each module (and
+        # of its submodules) are one range
+        # #####################################################################
+        # modules are visited depth first, and a module is closed (with the
+        # params of all its submodules) once a module outside it is reached
+        # #####################################################################
+        scopes = module_scopes(model)
+        self._params, ranges, stack = [], [], []
+
+        def _contains(prefix, attr):
+            ''' checks whether a module attribute path is within another '''
+            return prefix == '' or attr.startswith(prefix + '.')
+
+        def _close(attr=None):
+            ''' closes the open modules not containing a module (or all) '''
+            while len(stack) > 0 and (
+                    attr is None or not _contains(stack[-1][0], attr)):
+                _, name, depth, start = stack.pop()
+                if len(self._params) > start:
+                    ranges.append((start, name, depth, len(self._params)))
+
+        for attr, module in model.named_modules():
+            _close(attr)
+            stack.append((attr, scopes[module], len(stack), len(self._params)))
+            self._params.extend(module.parameters(recurse=False))
+        _close()
+
+        # modules are listed in (depth first) order of their params
+        ranges.sort(key=lambda item: (item[0], item[2]))
+        self._names = [name for _, name, _, _ in ranges]
+
+        if len(self._params) > 0:
+            device = self._params[0].device
+            self._numels = [p.numel() for p in self._params]
+            members = torch.zeros(len(ranges), len(self._params),
+                                  dtype=torch.double)
+            self._chains = [[] for _ in self._params]
+            for idx, (start, _, _, end) in enumerate(ranges):
+                members[idx, start:end] = 1
+                for param_idx in range(start, end):
+                    self._chains[param_idx].append(idx)
+            self._members = members.to(device)
+
+        # [2] write header (snapshots of earlier runs are discarded)
+        # #####################################################################
+        names = json.dumps(self._names).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, bins, len(names)))
+            f.write(names)
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def path(self):
+        ''' retrieves path of the snapshots '''
+        return self._path
+
+    @property
+    def modules(self):
+        ''' retrieves names of modules that contain params '''
+        return self._names
+
+    def snapshot(self, step):
+        ''' snapshots weights and gradients (zero where missing) of modules
+
+            step  (int) : iteration or epoch
+        '''
+        if len(self._params) == 0:
+            return
+
+        device = self._members.device
+        with torch.no_grad():
+            weights = torch.cat([p.detach().reshape(-1).float().to(device)
+                                 for p in self._params])
+            grads = torch.cat([
+                torch.zeros(p.numel(), device=device) if p.grad is None
+                else p.grad.detach().reshape(-1).float().to(device)
+                for p in self._params
+            ])
+            stats = torch.stack([
+                _segment_stats(flat, self._numels, self._members,
+                               self._chains, self._bins)
+                for flat in [weights, grads]
+            ])
+        self._queue.put((step, stats))
+
+    def _run(self):
+        ''' writes snapshots until closed '''
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            step, stats = item
+            # (kinds, modules, stats) -> (kinds, stats, modules) columns
+            stats = stats.cpu().numpy().astype('<f4').transpose(0, 2, 1)
+            with open(self._path, 'ab') as f:
+                f.write(struct.pack('<q', step))
+                f.write(np.ascontiguousarray(stats).tobytes())
+
+    def flush(self):
+        ''' blocks until all snapshots taken so far are written '''
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        ''' writes pending snapshots and stops the background thread '''
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+def read_snapshots(path, name, start=None, end=None):
+    ''' reads the snapshot series of a module in a range of steps
+
+        path   (str) : file path of the snapshots
+        name   (str) : module name
+        start  (int) : first step to read (defaults to first snapshot)
+        end    (int) : step to read up to, exclusive (defaults to all)
+
+        returns a dict with 'bins', 'step', and per kind ('weight', 'grad') a
+        dict of numpy arrays (as in STATS and 'hist'), or None if the module
+        has no params
+
+        only the header and the blocks in range are read, since steps are
+        binary searched in the memory-mapped file
+    '''
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) < HEADER.size:
+            raise ValueError('{} is not a visunn snapshot file'.format(path))
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        magic, version, bins, length = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a visunn snapshot file'.format(path))
+        if version != FORMAT_VERSION:
+            raise ValueError('{} has unsupported format version {} '
+                             '(expected {})'
+                             .format(path, version, FORMAT_VERSION))
+
+        names = json.loads(mm[HEADER.size:HEADER.size+length].decode('utf-8'))
+        if name not in names:
+            return None
+        row = names.index(name)
+
+        # [1] view all complete blocks, and binary search the step range
+        # #####################################################################
+        offset = HEADER.size + length
+        dtype = _block_dtype(bins, len(names))
+        n_blocks = (len(mm) - offset) // dtype.itemsize
+        blocks = np.frombuffer(mm, dtype=dtype, count=n_blocks, offset=offset)
+
+        steps = blocks['step']
+        lo = 0 if start is None else np.searchsorted(steps, start, 'left')
+        hi = n_blocks if end is None else np.searchsorted(steps, end, 'left')
+
+        # [2] gather the columns of the module (copied out of the map)
+        # #####################################################################
+        stats = np.array(blocks['stats'][lo:hi, :, :, row])
+        result = {'bins': bins, 'step': np.array(steps[lo:hi])}
+        for kind_idx, kind in enumerate(KINDS):
+            columns = {stat: stats[:, kind_idx, col]
+                       for col, stat in enumerate(STATS)}
+            columns['hist'] = stats[:, kind_idx, len(STATS):]
+            result[kind] = columns
+
+        del blocks, steps
+        return result
+    finally:
+        mm.close()
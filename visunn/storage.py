@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains versioned, memory-mappable file format for modular topology
+
+    file layout (all integers little endian):
+
+        [magic (8 bytes)][version (uint32)][header length (uint32)]
+        [header (json, utf-8)]
+        [index (one entry per module)]
+        [order (uint32 per module)]
+        [data section]
+
+    the header only holds the root module, content hash, precomputed layouts
+    and number of modules. each index entry is a fixed-size run of
+    (offset uint64, length uint32) spans into the data section: the module
+    name, its export record, and its view record of each layout (of length 0
+    if missing). the order lists entries sorted by module name, so that a
+    module is found by binary search in the mapped file, and opening a file
+    costs the same however many modules it holds
+
+    views are stored as their coords and edges only, and reassembled with the
+    export record of their module (see assemble_view)
+'''
+
+import os
+import json
+import mmap
+import pickle
+import struct
+from collections.abc import Set
+
+from visunn.topology import assemble_view, module_tag, tag_module
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['MappedModu', 'save_modu', 'load_modu']
+
+MAGIC = b'VISUNN\x00\x00'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<8sII')
+SPAN = struct.Struct('<QI')
+ORDER = struct.Struct('<I')
+
+
+def _encode(value):
+    ''' serializes a record as compact json bytes '''
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def save_modu(modu, path):
+    ''' writes a modu (and its precomputed views) to the versioned format
+
+        modu  (Modu) : modu object
+        path  (str)  : file path to write to
+    '''
+    layouts = modu.layouts
+    names = list(modu.modules)
+
+    # [1] serialize names and module records into the data section
+    # #########################################################################
+    records, index, offset = [], [], 0
+
+    def _append(record):
+        nonlocal offset
+        records.append(record)
+        index.append(SPAN.pack(offset, len(record)))
+        offset += len(record)
+
+    for name in names:
+        tag = module_tag(modu, name)
+        _append(name.encode('utf-8'))
+        _append(_encode(modu.export(name)))
+        for layout in layouts:
+            view = modu.view(tag, layout)
+            if view is None:
+                index.append(SPAN.pack(0, 0))
+                continue
+            _append(_encode({'coords': view['coords'],
+                             'edges': view['edges']}))
+
+    order = sorted(range(len(names)), key=lambda idx: names[idx].encode())
+
+    # [2] write header, index and data, replacing any existing file atomically
+    # #########################################################################
+    # the old file may still be memory-mapped by a running server, so it is
+    # replaced rather than truncated in place
+    # #########################################################################
+    header = _encode({
+        'root': modu.root,
+        'hash': modu.hash,
+        'layouts': layouts,
+        'count': len(names)
+    })
+
+    # temp files are named by pid, so that concurrent writers never share one,
+    # and synced, so that a crash never leaves a partial file in place
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            f.write(b''.join(index))
+            f.write(b''.join(ORDER.pack(idx) for idx in order))
+            for record in records:
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_modu(path):
+    ''' loads a modu from the versioned format, or from an older pickle
+
+        path  (str) : file path to read from
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            return MappedModu(path)
+        f.seek(0)
+        return pickle.load(f)
+
+
+class _ModuleNames(Set):
+    ''' names of the modules of a mapped file, read from the map on access '''
+    __slots__ = ('_modu',)
+
+    def __init__(self, modu):
+        self._modu = modu
+
+    def __contains__(self, name):
+        return name in self._modu._entries or \
+            self._modu._find(name) is not None
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self._modu._name(idx).decode('utf-8')
+
+    def __len__(self):
+        return self._modu._count
+
+
+class MappedModu(object):
+    ''' read-only modu backed by a memory-mapped topology file
+
+        only the header is read when opened, and module exports and views are
+        looked up in and decoded from the mapped file on access
+    '''
+    def __init__(self, path):
+        ''' opens and validates a topology file
+
+            path  (str) : file path to read from
+        '''
+        self._path = path
+        self._views = {}
+        self._open()
+
+    def _open(self):
+        ''' maps the file and reads its header '''
+        with open(self._path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < HEADER.size:
+            raise ValueError('{} is not a visunn topology file'
+                             .format(self._path))
+        magic, version, length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a visunn topology file'
+                             .format(self._path))
+        if version not in (1, FORMAT_VERSION):
+            raise ValueError('{} has unsupported format version {} '
+                             '(expected {})'
+                             .format(self._path, version, FORMAT_VERSION))
+
+        start = HEADER.size
+        header = json.loads(self._mmap[start:start+length].decode('utf-8'))
+        self._root = header['root']
+        self._hash = header['hash']
+        self._layouts = header['layouts']
+
+        # export and view spans of modules that were looked up
+        self._entries = {}
+
+        # [1] version 1 files hold the index of all modules in the header
+        # #####################################################################
+        if version == 1:
+            for name, entry in header['index'].items():
+                self._entries[name] = (entry['export'], [
+                    entry['views'].get(layout, (0, 0))
+                    for layout in self._layouts])
+            self._count = len(self._entries)
+            self._names = self._entries.keys()
+            self._offset = start + length
+            return
+
+        # [2] later versions hold it in fixed-size entries after the header
+        # #####################################################################
+        self._count = header['count']
+        self._stride = SPAN.size * (2 + len(self._layouts))
+        self._index_offset = start + length
+        self._order_offset = self._index_offset + self._count * self._stride
+        self._offset = self._order_offset + self._count * ORDER.size
+        self._names = _ModuleNames(self)
+
+    def _span(self, idx, field):
+        ''' reads a span of an index entry (0 for the name, 1 for the export,
+            then views by layout) '''
+        return SPAN.unpack_from(
+            self._mmap, self._index_offset + idx * self._stride +
+            field * SPAN.size)
+
+    def _name(self, idx):
+        ''' reads the (utf-8) name of a module by index entry '''
+        offset, length = self._span(idx, 0)
+        offset += self._offset
+        return self._mmap[offset:offset+length]
+
+    def _find(self, name):
+        ''' binary searches the index entry of a module (None if missing) '''
+        key = name.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            idx, = ORDER.unpack_from(self._mmap,
+                                     self._order_offset + mid * ORDER.size)
+            if self._name(idx) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low == self._count:
+            return None
+        idx, = ORDER.unpack_from(self._mmap,
+                                 self._order_offset + low * ORDER.size)
+        return idx if self._name(idx) == key else None
+
+    def _entry(self, name):
+        ''' retrieves the export span and view spans of a module '''
+        if name not in self._entries:
+            idx = self._find(name)
+            if idx is None:
+                return None
+            self._entries[name] = (self._span(idx, 1), [
+                self._span(idx, 2 + field)
+                for field in range(len(self._layouts))])
+        return self._entries[name]
+
+    def _read(self, span):
+        ''' decodes the record at the (offset, length) of the data section '''
+        offset, length = span
+        offset += self._offset
+        return json.loads(self._mmap[offset:offset+length].decode('utf-8'))
+
+    @property
+    def path(self):
+        ''' retrieves path of the backing topology file '''
+        return self._path
+
+    @property
+    def root(self):
+        ''' retrieves root module of modular topology '''
+        return self._root
+
+    @property
+    def modules(self):
+        ''' retrieves names of all existing modules '''
+        return self._names
+
+    @property
+    def hash(self):
+        ''' retrieves content hash of modular topology (hex string) '''
+        return self._hash
+
+    @property
+    def layouts(self):
+        ''' retrieves layouts that have precomputed views '''
+        return list(dict.fromkeys(self._layouts + list(self._views)))
+
+    def view(self, tag, layout='layered'):
+        ''' retrieves the precomputed view of a module (None if missing) '''
+        if tag in self._views.get(layout, {}):
+            return self._views[layout][tag]
+
+        entry = self._entry(tag_module(self, tag))
+        if entry is None or layout not in self._layouts:
+            return None
+        export_span, view_spans = entry
+        span = view_spans[self._layouts.index(layout)]
+        if span[1] == 0:
+            return None
+
+        # version 1 files hold whole views
+        view = self._read(span)
+        if 'meta' in view:
+            return view
+        return assemble_view(tag, self._read(export_span), view['coords'],
+                             view['edges'])
+
+    def add_views(self, views, layout='layered'):
+        ''' stores precomputed views (mapping of module tag to view) '''
+        self._views[layout] = views
+
+    def export(self, name):
+        ''' exports the metadata of the specified module as a tuple '''
+        entry = self._entry(name)
+        if entry is None:
+            raise KeyError(name)
+        meta, inputs, outputs = self._read(entry[0])
+        return (meta, inputs, outputs)
+
+    def close(self):
+        ''' unmaps the backing topology file '''
+        self._mmap.close()
+
+    def __getstate__(self):
+        ''' pickles the file path (and any added views) rather than the map '''
+        return {'_path': self._path, '_views': self._views}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' contains functions to build the per-module views served by the api '''
+
+import os
+from multiprocessing import Pool
+
+from visunn.plot import plot
+
+__author__ = 'Vincent Liu'
+__email__ = 'vliu15@stanford.edu'
+
+__all__ = ['build_topology', 'assemble_view', 'module_tag', 'tag_module',
+           'module_scope', 'scope_module', 'precompute']
+
+# per-process state of precompute workers
+_worker = {}
+
+
+def module_tag(modu, name):
+    ''' converts a module name to the tag used by the api
+
+        modu  (Modu) : modu object
+        name  (str)  : module name (absolute path ending in '/')
+    '''
+    if name == modu.root:
+        return 'root'
+    return name[:-1].replace('/', ';')
+
+
+def tag_module(modu, tag):
+    ''' converts a tag used by the api to a module name
+
+        modu  (Modu) : modu object
+        tag   (str)  : module tag, 'root' or module name delimited by ';'
+    '''
+    if tag == 'root':
+        return modu.root
+    return tag.replace(';', '/') + '/'
+
+
+def module_scope(modu, name):
+    ''' converts a module name to the scope of its nn.Module (as traced)
+
+        modu  (Modu) : modu object
+        name  (str)  : module name, where collapsed modules are parenthesized
+
+        the root module is the model itself, whose scope is the first scope
+        of every other module (None if the model has no submodules)
+    '''
+    if name == modu.root:
+        for sub_name in modu.modules:
+            if sub_name != modu.root:
+                return module_scope(modu, sub_name).split('/', 1)[0] + '/'
+        return None
+    return name.replace('(', '').replace(')', '/')
+
+
+def scope_module(modu, scope):
+    ''' converts the scope of an nn.Module to the nearest module in modu
+
+        modu   (Modu) : modu object
+        scope  (str)  : module scope (as traced), ending in '/'
+
+        collapsed modules are merged into the name of their only child, so
+        their own costs (and those of collapsed leaves) belong to the nearest
+        module that is displayed
+    '''
+    name, collapsed = modu.root, ''
+    for module in scope[:-1].split('/'):
+        if name + collapsed + module + '/' in modu.modules:
+            name += collapsed + module + '/'
+            collapsed = ''
+        else:
+            collapsed += '(' + module + ')'
+    return name
+
+
+def build_topology(modu, tag, layout='layered'):
+    ''' builds the topology response of a module as a dict
+
+        modu    (Modu) : modu object
+        tag     (str)  : module tag, 'root' or module name delimited by ';'
+        layout  (str)  : layout backend passed to plot
+    '''
+    # [1] format the get request that comes in
+    # #########################################################################
+    module = tag_module(modu, tag)
+
+    # [2] retrieve metadata from modu
+    # #########################################################################
+    meta, inputs, outputs = modu.export(module)
+
+    # [3] accumulate edges between nodes
+    # #########################################################################
+    edges = {}
+    for name, node in meta.items():
+        if 'input' in list(node):
+            edges[name] = [
+                in_name for in_name in node['input'] if in_name in meta
+            ]
+
+    # [4] use these edges to plot and retrieve coordinates
+    # #########################################################################
+    _, coords = plot(edges, normalize=True, truncate=False, layout=layout)
+
+    return assemble_view(tag, (meta, inputs, outputs), coords, edges)
+
+
+def assemble_view(tag, export, coords, edges):
+    ''' formats the view of a module for export as json
+
+        tag     (str)   : module tag, 'root' or module name delimited by ';'
+        export  (tuple) : metadata, inputs and outputs (see Modu.export)
+        coords  (dict)  : mapping of node name to plotted coordinates
+        edges   (dict)  : mapping of node name to names of its inputs
+
+        views only add coords and edges to the export of a module, so stored
+        views keep those and are reassembled here (see save_modu)
+    '''
+    meta, inputs, outputs = export
+
+    # revise inputs/outputs for root module
+    if tag == 'root':
+        inputs, outputs = [], []
+        for name, node in meta.items():
+            if len(node['input']) == 0:
+                inputs += [name]
+            if len(node['output']) == 0:
+                outputs += [name]
+
+    return {
+        'meta': meta,
+        'coords': coords,
+        'edges': edges,
+        'inputs': inputs,
+        'outputs': outputs
+    }
+
+
+def _init_worker(modu, layout):
+    ''' stores the modu once per worker process '''
+    _worker['modu'] = modu
+    _worker['layout'] = layout
+
+
+def _build_worker(tag):
+    ''' builds the view of one module in a worker process '''
+    return tag, build_topology(_worker['modu'], tag, layout=_worker['layout'])
+
+
+def precompute(modu, layout='layered', processes=None):
+    ''' builds the views of all modules, in parallel
+
+        modu       (Modu) : modu object
+        layout     (str)  : layout backend passed to plot
+        processes  (int)  : number of worker processes (defaults to number of
+                            cpus, 1 builds all views in this process)
+
+        returns a mapping of module tag to view (same as build_topology)
+    '''
+    tags = [module_tag(modu, name) for name in modu.modules]
+
+    if processes == 1 or len(tags) <= 1:
+        return {tag: build_topology(modu, tag, layout=layout) for tag in tags}
+
+    # the modu is sent once per worker, rather than once per module
+    processes = min(processes or os.cpu_count() or 1, len(tags))
+    chunksize = max(1, len(tags) // (4 * processes))
+    with Pool(processes, initializer=_init_worker,
+              initargs=(modu, layout)) as pool:
+        return dict(pool.imap_unordered(_build_worker, tags, chunksize))
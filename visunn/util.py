@@ -3,10 +3,10 @@
 ''' contains util functions to facilitate graph parsing '''
 
 import re
-from copy import copy
-from google.protobuf.json_format import MessageToDict
+from collections import deque
 
 from visunn.modu import Modu
+from visunn.compact import CompactBuilder
 from visunn.constants import MODU_ROOT
 
 __author__ = 'Vincent Liu'
@@ -27,28 +27,79 @@ def proto_to_dict(graphdef):
         'output_shapes': []   # list(tuple) : list of output shape tuples
     }
 
+    # read fields directly off of the `NodeDef` messages, rather than
+    # serializing each message (and all of its attrs) with MessageToDict
     graphdict = {}
     for node in graphdef.node:
-        node = MessageToDict(node)
-        graphdict[node['name']] = {
-            'name': node.get('name', ''),
-            'op': node.get('op', ''),
-            'input': node.get('input', []),
+        output_shapes = []
+        if '_output_shapes' in node.attr:
+            for shape in node.attr['_output_shapes'].list.shape:
+                if len(shape.dim) > 0:
+                    output_shapes.append(tuple(dim.size for dim in shape.dim))
+
+        graphdict[node.name] = {
+            'name': node.name,
+            'op': node.op,
+            'input': list(node.input),
             'output': [],
             'input_shapes': [],
-            'output_shapes': []
+            'output_shapes': output_shapes
         }
-        if '_output_shapes' in node['attr']:
-            shapes = node['attr']['_output_shapes']['list']['shape']
-            for shape in shapes:
-                if 'dim' in shapes:
-                    graphdict[node['name']]['output_shapes'].append(
-                        tuple(int(dim['size']) for dim in shape['dim'])
-                    )
 
     return graphdict
 
 
+def _is_param(name):
+    ''' whether a node name corresponds to a weight or bias attribute '''
+    scopes = name.split('/')
+    return len(scopes) > 1 and scopes[-2] in ['weight', 'bias']
+
+
+def _merge_levels(prim_levels):
+    ''' merges resolved 'prim' levels depth by depth '''
+    depth = max([len(levels) for levels in prim_levels] + [0])
+    return [
+        [in_name for levels in prim_levels if idx < len(levels)
+         for in_name in levels[idx]]
+        for idx in range(depth)
+    ]
+
+
+def _resolve_prims(graphdict, name, prims, levels):
+    ''' resolves the tensor inputs of a 'prim' node, grouped by depth
+
+        graphdict  (dict) : mapping of node name to nodedict
+        name       (str)  : name of 'prim' node to resolve
+        prims      (set)  : names of all (non-param) 'prim' nodes
+        levels     (dict) : memo of 'prim' node name to its resolved levels
+
+        levels[name][k] holds the non-prim inputs found k 'prim' hops below
+        the node, in the order a breadth-first expansion would reach them
+    '''
+    # iterative post-order traversal, since prim chains can be arbitrarily deep
+    stack = [(name, False)]
+    while len(stack) > 0:
+        prim_name, expanded = stack.pop()
+        if prim_name in levels:
+            continue
+
+        inputs = graphdict[prim_name]['input']
+        children = [in_name for in_name in inputs if in_name in prims]
+        if not expanded:
+            stack.append((prim_name, True))
+            stack.extend((in_name, False) for in_name in children
+                         if in_name not in levels)
+            continue
+
+        # level 0 are direct tensor inputs, level k+1 merges the level k
+        # inputs of all child prims (in order of appearance)
+        levels[prim_name] = [
+            [in_name for in_name in inputs if in_name not in prims]
+        ] + _merge_levels([levels[in_name] for in_name in children])
+
+    return levels[name]
+
+
 def process_nodes(graphdict):
     ''' prunes non-tensor operations from graph topology
 
@@ -58,65 +109,72 @@ def process_nodes(graphdict):
         and will reflect the removal of nodes in the pruning process
     '''
     # get list of output nodes
-    outputs = set(graphdict.keys())
-    for name, node in graphdict.items():
-        outputs = outputs.difference(set(node['input']))
+    consumed = set()
+    for node in graphdict.values():
+        consumed.update(node['input'])
+    outputs = [name for name in graphdict if name not in consumed]
+
+    # bias and weight correspond to 'prim' ops, but should be kept
+    prims = set(
+        name for name, node in graphdict.items()
+        if node['op'].split('::')[0] == 'prim' and not _is_param(name)
+    )
 
     # [1] prune nodes with bfs
     # #########################################################################
-    queue = [copy(graphdict[name]) for name in outputs]
-    seen = set()
+    # each node is visited exactly once and 'prim' inputs are replaced by their
+    # transitive tensor inputs, which are resolved once per 'prim' node and
+    # memoized (instead of re-queueing nodes until no 'prim' inputs remain)
+    #
+    # resolved inputs keep the order of the original breadth-first expansion:
+    # direct inputs first, then inputs one 'prim' hop away, and so on
+    # #########################################################################
+    levels = {}
+    queue = deque(outputs)
+    queued = set(outputs)
     while len(queue) > 0:
-        node = queue.pop(0)
-        seen.add(node['name'])
-        contains_prim = False
+        node = graphdict.get(queue.popleft(), None)
+        if node is None:
+            continue
+
+        # expand 'prim' inputs level by level
+        candidates = [in_name for in_name in node['input']
+                      if in_name not in prims]
+        for level in _merge_levels([
+                _resolve_prims(graphdict, in_name, prims, levels)
+                for in_name in node['input'] if in_name in prims]):
+            candidates.extend(level)
 
-        del_idxs = []
-        # for each input, merge its inputs if 'prim'
-        for idx, input_name in enumerate(node['input']):
-            input_node = graphdict.get(input_name, None)
-            if input_node is not None:
-                input_node = copy(input_node)
+        inputs = []
+        for in_name in candidates:
+            input_node = graphdict.get(in_name, None)
 
             # torch==1.4.0: delete nodes not in graphdef
             if input_node is None:
-                del_idxs.append(idx)
-
-            # bias and weight correspond to 'prim' ops, but should be kept
-            elif input_name.split('/')[-2] in ['weight', 'bias']:
-                # edit naming scheme (and metadata) of param nodes
-                del graphdict[input_name]
-                input_name = input_name.rsplit('/', 1)[0]
-                graphdict[input_name] = {
-                    'name': input_name,
+                continue
+
+            # edit naming scheme (and metadata) of param nodes
+            elif _is_param(in_name):
+                del graphdict[in_name]
+                in_name = in_name.rsplit('/', 1)[0]
+                graphdict[in_name] = {
+                    'name': in_name,
                     'op': 'visu::param',
                     'input': [],
                     'output': [],
                     'input_shapes': [],
                     'output_shapes': input_node['output_shapes']
                 }
-                node['input'][idx] = input_name
-
-            # all other prim ops should be removed
-            elif input_node['op'].split('::')[0] == 'prim':
-                del_idxs.append(idx)
-                node['input'].extend(input_node['input'])
-                contains_prim = True
 
             # if input is still there, queue it
-            elif input_name not in seen:
-                queue.append(copy(input_node))
+            elif in_name not in queued:
+                queued.add(in_name)
+                queue.append(in_name)
 
-        # delete inputs from node
-        for idx in reversed(del_idxs):
-            del node['input'][idx]
+            inputs.append(in_name)
 
         # update node in graphdict
-        graphdict[node['name']] = node
-
-        # if 'prim' inputs were removed, re-queue and re-evaluate
-        if contains_prim:
-            queue.append(copy(node))
+        node['input'] = inputs
 
     # [2] clean up graphdict
     # #########################################################################
@@ -127,22 +185,28 @@ def process_nodes(graphdict):
 
     # [3] add doubly linked connections with bfs
     # #########################################################################
-    queue = [copy(graphdict[name]) for name in outputs]
-    seen = set()
+    # each node is linked once, so every edge adds one output name and one
+    # set of input shapes (rather than one per path the bfs reached the node
+    # by, which repeated them on graphs with shared inputs, e.g. squeezenet)
+    #
+    # shapes are only listed (never paired with inputs by position), and
+    # modu exports drop repeated links
+    # #########################################################################
+    outputs = [name for name in outputs if name in graphdict]
+    queue = deque(outputs)
+    seen = set(outputs)
     while len(queue) > 0:
-        node = queue.pop(0)
-        name = node['name']
-        seen.add(name)
+        name = queue.popleft()
+        node = graphdict[name]
 
         for in_name in node['input']:
-            in_node = copy(graphdict[in_name])
+            in_node = graphdict[in_name]
 
             node['input_shapes'] += in_node['output_shapes']
-            in_node['output'] += [node['name']]
+            in_node['output'].append(name)
             if in_name not in seen:
-                queue.append(in_node)
-
-        graphdict[name] = node
+                seen.add(in_name)
+                queue.append(in_name)
 
     return graphdict
 
@@ -153,60 +217,49 @@ def process_modules(graphdict):
 
     # [1] accumulate submodules per module
     # #########################################################################
-    # for each module, build track all submodules and nodes to identify which
-    # modules are "trivial" and should be collapsed
+    # for each module, build a trie of all submodules and nodes to identify
+    # which modules are "trivial" and should be collapsed
     # #########################################################################
-    contents = {}
+    trie = {}
     for name in names:
-        mod_name = MODU_ROOT
         modules = name.split('/')
         op_node = modules.pop(-1)
 
+        subtrie = trie
         for module in modules:
-            if mod_name in contents:
-                contents[mod_name].add(module)
-            else:
-                contents[mod_name] = set([module])
-            mod_name += module + '/'
-
-        if mod_name in contents:
-            contents[mod_name].add(op_node)
-        else:
-            contents[mod_name] = set([op_node])
+            subtrie = subtrie.setdefault(module, {})
+        subtrie.setdefault(op_node, {})
 
     # [2] create mappings for pruned names
     # #########################################################################
-    # accumulate all modules that only have 1 entry (and thus should be
-    # collapsed), map them to the index of nested position so that names with
-    # the module prefix can collapse the module at that position
+    # modules that only have 1 entry (and thus should be collapsed) are found
+    # by walking the trie along each module path, which is only done once per
+    # distinct module path
     #
     # collapsing essentially merges the module with its child module/node by
     # removing the '/' and putting the module in parentheses so that the
     # modularizing code will not identify it as a module
-    #
-    # subtract 2 to get the index to accommodate for
-    #   (1) len() is 1-indexed, and
-    #   (2) modules end in '/', so len() over-counts by 1 position
     # #########################################################################
-    prune_mods = set(
-        (k, len(k.split('/'))-2) for k, v in contents.items() if len(v) <= 1
-    )
-
+    prefix_map = {}
     name_map = {}
     for name in names:
-        map_idxs = set(idx for mod, idx in prune_mods if name.startswith(mod))
-        if len(map_idxs) == 0:
-            continue
-
-        mapped_name = ''
         modules = name.split('/')
         op_node = modules.pop(-1)
-        for idx, module in enumerate(modules):
-            if idx not in map_idxs:
-                mapped_name += module + '/'
-            else:
-                mapped_name += '(' + module + ')'
-        name_map[name] = mapped_name + op_node
+        prefix = name[:len(name)-len(op_node)]
+
+        if prefix not in prefix_map:
+            mapped_prefix = ''
+            subtrie = trie
+            for module in modules:
+                subtrie = subtrie[module]
+                if len(subtrie) <= 1:
+                    mapped_prefix += '(' + module + ')'
+                else:
+                    mapped_prefix += module + '/'
+            prefix_map[prefix] = mapped_prefix
+
+        if prefix_map[prefix] != prefix:
+            name_map[name] = prefix_map[prefix] + op_node
 
     # [3] apply mappings to all names
     # #########################################################################
@@ -232,14 +285,19 @@ def process_modules(graphdict):
     return graphdict
 
 
-def build_modu(graphdict, params=None):
+def build_modu(graphdict, params=None, compact=False):
     ''' builds the graph topology as a file system
 
         graphdict  (dict) : mapping of node name to nodedict
         params     (list) : list of model parameter names (if specified, will
                             allow for association of param names to modules)
+        compact    (bool) : whether to return an integer-indexed CompactModu
+                            (built directly, without a set-based Modu)
     '''
-    md = Modu(graphdict, root=MODU_ROOT)
+    if compact:
+        md = CompactBuilder(graphdict, root=MODU_ROOT)
+    else:
+        md = Modu(graphdict, root=MODU_ROOT)
 
     # iterate through the nodes and add them to the tree
     for name, node in graphdict.items():
@@ -346,4 +404,6 @@ def build_modu(graphdict, params=None):
                     for out_shape in out_shapes:
                         md.update(in_mod_name, 'out_shapes', out_shape)
 
+    if compact:
+        return md.build()
     return md
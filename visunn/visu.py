@@ -3,13 +3,14 @@
 ''' contains visu class for user api '''
 
 import os
-import pickle
-from torch.utils.tensorboard._pytorch_graph import graph
 
-from visunn.modu import Modu
-from visunn.constants import LOG_DIR, MODU_EXT
-from visunn.util import proto_to_dict, process_nodes, process_modules, \
-                 build_modu
+from visunn.builder import submit
+from visunn.cache import TopologyCache
+from visunn.metrics import MetricsLogger
+from visunn.activations import ActivationMonitor
+from visunn.snapshots import ParamSnapshots
+from visunn.constants import LOG_DIR, MODU_EXT, METRICS_EXT, \
+                             ACTIVATIONS_EXT, SNAPSHOTS_EXT, CACHE_DIR
 
 __author__ = 'Vincent Liu'
 __email__ = 'vliu15@stanford.edu'
@@ -19,97 +20,158 @@ __all__ = ['Visu']
 
 class Visu(object):
     ''' high level api for users '''
-    def __init__(self, model, dataloader, logdir=LOG_DIR, name='model'):
+    def __init__(self, model, dataloader, logdir=LOG_DIR, name='model',
+                 precompute=True, processes=None, compact=True,
+                 background=True, activations=False, sample_every=100,
+                 module_filter=None, snapshot_every=None, profile=False,
+                 profile_backward=False, cache=False, cache_dir=None):
         ''' initializes visu, which builds model topology
 
-            model       (torch.nn.Module)             : pytorch model
-            dataloader  (torch.utils.data.Dataloader) : dataloader of inputs
-            logdir      (str)                         : folder to dump pickle
-            name        (str)                         : model name, no real use
+            model             (torch.nn.Module)             : pytorch model
+            dataloader        (torch.utils.data.Dataloader) : dataloader of
+                                                              inputs
+            logdir            (str)                         : folder to dump
+                                                              topology
+            name              (str)                         : model name, no
+                                                              real use
+            precompute        (bool)                        : whether to
+                                                              precompute the
+                                                              views of all
+                                                              modules for the
+                                                              web app
+            processes         (int)                         : number of
+                                                              processes to
+                                                              precompute views
+                                                              with
+            compact           (bool)                        : whether to store
+                                                              the topology as a
+                                                              CompactModu
+            background        (bool)                        : whether to build
+                                                              the topology in a
+                                                              spawned process,
+                                                              without blocking
+            activations       (bool)                        : whether to sample
+                                                              activation
+                                                              statistics of
+                                                              modules
+            sample_every      (int)                         : sample
+                                                              activations every
+                                                              n training steps
+            module_filter     (str, callable)               : regex or
+                                                              predicate of
+                                                              module names to
+                                                              sample (defaults
+                                                              to all)
+            snapshot_every    (int)                         : snapshot weights
+                                                              and gradients of
+                                                              modules every n
+                                                              updates (defaults
+                                                              to never)
+            profile           (bool)                        : whether to
+                                                              measure latency
+                                                              and memory of
+                                                              modules (on cpu)
+            profile_backward  (bool)                        : whether to also
+                                                              measure backward
+                                                              passes
+            cache             (bool)                        : whether to reuse
+                                                              topologies of
+                                                              unchanged
+                                                              architectures
+                                                              (edits to
+                                                              functions that
+                                                              forward calls
+                                                              are not
+                                                              detected)
+            cache_dir         (str)                         : folder of cached
+                                                              topologies
+                                                              (defaults to
+                                                              <logdir>/.cache)
         '''
-        pid = os.fork()
-
-        # return parent process
-        if pid != 0:
-            return
+        self._name = name
+        self._metrics_path = os.path.join(logdir, name + METRICS_EXT)
+        self._metrics = None
+        self._activations = None
+        self._snapshots = None
+        self._snapshot_every = snapshot_every
 
         # [0] just get the first batch of inputs for now
         inputs, _ = next(iter(dataloader))
         params = [name for name, _ in model.named_parameters()]
 
-        # [1] use pytorch functionality to port to graphdef proto
-        # #####################################################################
-        # `graph` function:
-        #   https://github.com/pytorch/...
-        #       pytorch/blob/master/torch/utils/tensorboard/_pytorch_graph.py
-        #
-        # `GraphDef` protobuf:
-        #   https://github.com/tensorflow/...
-        #       tensorflow/blob/master/tensorflow/core/framework/graph.proto
-        #   from tensorboard.compat.proto.graph_pb2 import GraphDef
-        #   fields: ['node', 'versions', 'version' (deprecated), 'library']
-        #
-        # NOTE: see note on recycled layers in README.md
-        # #####################################################################
-        graphdef, _ = graph(model, inputs)
+        save_path = os.path.join(logdir, name + MODU_EXT)
 
-        # [2] convert and parse graphdef proto to dict format
-        # #####################################################################
-        # this maps the name of a node to its relevant contents, saving space
-        # and improving accessibility for downstream processing
-        #
-        # `NodeDef` protobuf:
-        #   https://github.com/tensorflow/...
-        #       tensorflow/blob/master/tensorflow/core/framework/node_def.proto
-        #   from tensorboard.compat.proto.node_def_pb2 import NodeDef
-        #   fields: ['name', 'op', 'input', 'device', 'attr']
-        # #####################################################################
-        graphdict = proto_to_dict(graphdef)
+        if not os.path.exists(logdir):
+            os.makedirs(os.path.join(os.getcwd(), logdir))
+        elif os.path.exists(save_path):
+            format_warning = '\033[93m' + 'WARNING:' + '\033[0m'
+            print(format_warning + ' {} already exists.'.format(save_path))
 
-        # [3] use bfs to prune nodes of op type 'prim'
-        # #####################################################################
-        # tensor basics:
-        #   https://pytorch.org/cppdocs/notes/tensor_basics.html
-        #
-        # only want to keep meaningful operations (that are directly relevant
-        # to manipulating the input tensor), which is why all operations of
-        # type 'prim' (non-tensor operations) are discarded
+        # [1] trace, parse, modularize and log the topology (see builder.py)
         # #####################################################################
-        graphdict = process_nodes(graphdict)
-
-        # [4] prune irrelevant modules that don't contribute to the hierarchy
+        # the cache lives in the logdir by default, so that cached topologies
+        # can be hard linked rather than copied
         # #####################################################################
-        # some modules only contain one submodule or one node, and such modules
-        # are uninteresting and only complicate the hierarchical structure of
-        # topology, all such modules are collapsed
+        topology_cache = None
+        if cache:
+            topology_cache = TopologyCache(
+                cache_dir or os.path.join(logdir, CACHE_DIR))
+        self._future = submit(
+            model, inputs, params, save_path, background=background,
+            precompute=precompute, processes=processes, compact=compact,
+            profile=profile, profile_backward=profile_backward,
+            cache=topology_cache
+        )
+        self._future.add_done_callback(self._report)
+
+        # [2] hook modules to sample activation statistics while training
         # #####################################################################
-        graphdict = process_modules(graphdict)
+        if activations:
+            self._activations = ActivationMonitor(
+                model, os.path.join(logdir, name + ACTIVATIONS_EXT),
+                every=sample_every, module_filter=module_filter
+            )
 
-        # [5] modularize pruned graph topology as a filesystem
+        # [3] index params by module to snapshot them on updates
         # #####################################################################
-        # want to retain the modularity of the topology so that it will be
-        # easy to interact with and represent as a web app
-        # #####################################################################
-        self._modu = build_modu(graphdict, params=params)
+        if snapshot_every:
+            self._snapshots = ParamSnapshots(
+                model, os.path.join(logdir, name + SNAPSHOTS_EXT)
+            )
+
+    def _report(self, future):
+        ''' prints the outcome of the build once it is done '''
+        if future.cancelled() or future.exception() is not None:
+            return
+        format_name = '\033[92m' + self._name + '\033[0m'
+        timings = future.result()
+        if 'trace' not in timings:
+            print('Reused cached {} topology in {:.3f} s!'
+                  .format(format_name, sum(timings.values())), flush=True)
+            return
+        print('Successfully parsed and saved {} topology in {:.3f} s!'
+              .format(format_name, sum(timings.values())), flush=True)
 
-        # [6] log it for later access
-        # #####################################################################
-        save_path = os.path.join(logdir, name + MODU_EXT)
+    def ready(self):
+        ''' checks whether the topology build is done (or failed) '''
+        return self._future.done()
 
-        if not os.path.exists(logdir):
-            os.makedirs(os.path.join(os.getcwd(), logdir))
-        elif os.path.exists(save_path):
-            format_warning = '\033[93m' + 'WARNING:' + '\033[0m'
-            print(format_warning + ' {} already exists.'.format(save_path))
+    def wait(self, timeout=None):
+        ''' waits for the topology build, raising any exception it raised
 
-        with open(save_path, 'wb') as f:
-            pickle.dump(self._modu, f)
+            timeout  (float) : seconds to wait for, or None to wait until done
 
-        # terminate child process
-        format_name = '\033[92m' + name + '\033[0m'
-        print('Successfully parsed and saved {} topology!'
-              .format(format_name), flush=True)
-        os._exit(0)
+            returns a mapping of build stage to wall time in seconds, and
+            raises concurrent.futures.TimeoutError if the build is not done
+        '''
+        return self._future.result(timeout)
+
+    @property
+    def timings(self):
+        ''' retrieves wall time of each build stage (None until built) '''
+        if not self.ready() or self._future.exception() is not None:
+            return None
+        return self._future.result()
 
     # NOTE: see https://www.wandb.com for this intended functionality
     def update(self, iter, optim, loss):
@@ -118,5 +180,24 @@ class Visu(object):
             iter   (int)                   : iteration or epoch
             optim  (torch.optim.Optimizer) : pytorch optimizer
             loss   (torch.Tensor)          : tensor loss
+
+            only enqueues the step, learning rates and loss (without syncing
+            on the loss), which are flushed to the metrics log in the
+            background, and snapshots params if due (after optim.step, the
+            gradients of this step are still set)
         '''
-        raise NotImplementedError
+        if self._metrics is None:
+            self._metrics = MetricsLogger(self._metrics_path)
+        self._metrics.update(iter, optim, loss)
+
+        if self._snapshots is not None and iter % self._snapshot_every == 0:
+            self._snapshots.snapshot(iter)
+
+    def close(self):
+        ''' flushes logged updates and samples and removes all hooks '''
+        if self._metrics is not None:
+            self._metrics.close()
+        if self._activations is not None:
+            self._activations.close()
+        if self._snapshots is not None:
+            self._snapshots.close()